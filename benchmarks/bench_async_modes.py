@@ -0,0 +1,162 @@
+"""
+并发模型基准测试
+分别以 threading / gevent / eventlet 模式启动服务器，建立大量空闲 WebSocket 连接，
+对比建立连接耗时、服务器内存和线程数，以及在这些连接存在时 HTTP 请求的延迟
+
+用法：
+    python benchmarks/bench_async_modes.py [--clients 1000] [--rooms 50] [--modes threading gevent]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ws_client import SocketIOClient, ClientPool  # noqa: E402
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = '127.0.0.1'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://{HOST}:{port}/api/room/public/content', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('服务器启动超时')
+
+
+def process_stats(pid):
+    """服务器进程的常驻内存（MB）和线程数"""
+    stats = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            stats[key] = value.strip()
+    return int(stats['VmRSS'].split()[0]) / 1024, int(stats['Threads'])
+
+
+def http_latency(port, requests):
+    """顺序请求房间内容接口，返回 (p50, p99) 毫秒"""
+    samples = []
+    url = f'http://{HOST}:{port}/api/room/public/content'
+    for _ in range(requests):
+        start = time.perf_counter()
+        urllib.request.urlopen(url, timeout=10).read()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def create_rooms(port, rooms):
+    for i in range(rooms):
+        body = json.dumps({'room_id': f'bench{i}'}).encode()
+        req = urllib.request.Request(f'http://{HOST}:{port}/api/room/create', data=body,
+                                     headers={'Content-Type': 'application/json'})
+        try:
+            urllib.request.urlopen(req, timeout=10).read()
+        except urllib.error.HTTPError:
+            pass  # 房间已存在
+
+
+def run_mode(mode, args):
+    """启动指定模式的服务器并测量，返回结果字典；缺少依赖时返回 None"""
+    if mode != 'threading':
+        probe = subprocess.run([sys.executable, '-c', f'import {mode}'], capture_output=True)
+        if probe.returncode != 0:
+            print(f'[跳过] {mode} 未安装')
+            return None
+
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix=f'netclip_{mode}_')
+    env = dict(os.environ, NETCLIP_ASYNC_MODE=mode)
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT_DIR, 'serve.py'), '--mode', mode, '--host', HOST, '--port', str(port)],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    pool = ClientPool()
+    try:
+        wait_ready(port)
+        create_rooms(port, args.rooms)
+        base_rss, base_threads = process_stats(server.pid)
+
+        start = time.perf_counter()
+        failures = 0
+        for i in range(args.clients):
+            try:
+                client = SocketIOClient(HOST, port)
+                client.emit('join', {'room': f'bench{i % args.rooms}', 'username': f'user{i}'})
+                pool.add(client)
+            except (OSError, TimeoutError) as e:
+                failures += 1
+                if failures == 1:
+                    print(f'[{mode}] 连接失败: {e}')
+        connect_seconds = time.perf_counter() - start
+
+        time.sleep(args.settle)
+        rss, threads = process_stats(server.pid)
+        p50, p99 = http_latency(port, args.requests)
+        alive = sum(1 for c in pool.clients if not c.closed)
+        return {
+            'mode': mode,
+            'connected': alive,
+            'failures': failures,
+            'connect_rate': args.clients / connect_seconds,
+            'rss_mb': rss,
+            'rss_per_conn_kb': (rss - base_rss) * 1024 / max(alive, 1),
+            'threads': threads,
+            'http_p50': p50,
+            'http_p99': p99
+        }
+    finally:
+        pool.close()
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='threading / gevent / eventlet 并发模型对比')
+    parser.add_argument('--clients', type=int, default=1000, help='空闲 WebSocket 连接数')
+    parser.add_argument('--rooms', type=int, default=50, help='连接分布的房间数')
+    parser.add_argument('--requests', type=int, default=200, help='测量延迟的 HTTP 请求数')
+    parser.add_argument('--settle', type=float, default=2.0, help='连接建立后等待的秒数')
+    parser.add_argument('--modes', nargs='+', default=['threading', 'gevent', 'eventlet'])
+    args = parser.parse_args()
+
+    # 每个连接占用一个文件描述符
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(max(soft, args.clients * 2 + 256), hard), hard))
+
+    results = [r for r in (run_mode(mode, args) for mode in args.modes) if r]
+    print(f"\n{'模式':<12}{'已连接':>8}{'连接/s':>10}{'RSS MB':>10}{'KB/连接':>10}"
+          f"{'线程数':>8}{'HTTP p50 ms':>13}{'p99 ms':>9}")
+    for r in results:
+        print(f"{r['mode']:<12}{r['connected']:>8}{r['connect_rate']:>10.0f}{r['rss_mb']:>10.1f}"
+              f"{r['rss_per_conn_kb']:>10.1f}{r['threads']:>8}{r['http_p50']:>13.2f}{r['http_p99']:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
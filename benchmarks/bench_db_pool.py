@@ -0,0 +1,158 @@
+"""
+连接池基准测试
+对比旧的「每次调用新建连接 + 默认 rollback 日志」与新的 WAL 连接池的吞吐量
+
+用法：
+    python benchmarks/bench_db_pool.py [--ops 2000] [--threads 8]
+"""
+import argparse
+import contextlib
+import io
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+# ==================== 旧实现（每次调用新建连接） ====================
+
+def legacy_connect():
+    conn = sqlite3.connect(db.DATABASE_FILE)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def legacy_get_room(room_id):
+    conn = legacy_connect()
+    result = conn.execute('SELECT * FROM rooms WHERE room_id = ?', (room_id,)).fetchone()
+    conn.close()
+    return dict(result) if result else None
+
+def legacy_verify_room_password(room_id, password):
+    conn = legacy_connect()
+    result = conn.execute('SELECT password_hash FROM rooms WHERE room_id = ?', (room_id,)).fetchone()
+    conn.close()
+    if result is None:
+        return False
+    if result['password_hash'] is None:
+        return True
+    return result['password_hash'] == hashlib.sha256(password.encode()).hexdigest()
+
+def legacy_save_room_content(room_id, content):
+    conn = legacy_connect()
+    conn.execute('UPDATE rooms SET content = ? WHERE room_id = ?', (content, room_id))
+    conn.commit()
+    conn.close()
+
+def legacy_add_file(file_id, room_id, filename, original_filename, file_size, description=''):
+    conn = legacy_connect()
+    conn.execute('''
+        INSERT INTO files (file_id, room_id, filename, original_filename, file_size, uploaded_at, description)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (file_id, room_id, filename, original_filename, file_size, datetime.now().isoformat(), description))
+    conn.commit()
+    conn.close()
+    return True
+
+LEGACY = {
+    'get_room': legacy_get_room,
+    'verify_room_password': legacy_verify_room_password,
+    'save_room_content': legacy_save_room_content,
+    'add_file': legacy_add_file,
+}
+
+POOLED = {
+    'get_room': db.get_room,
+    'verify_room_password': db.verify_room_password,
+    'save_room_content': db.save_room_content,
+    'add_file': db.add_file,
+}
+
+
+def call(impl, name, i):
+    room_id = f'room{i % 50}'
+    if name == 'get_room':
+        impl[name](room_id)
+    elif name == 'verify_room_password':
+        impl[name](room_id, 'secret')
+    elif name == 'save_room_content':
+        impl[name](room_id, f'content {i} ' * 20)
+    else:
+        impl[name](str(uuid.uuid4()), room_id, f'{i}.txt', f'{i}.txt', i)
+
+
+def run(impl, name, ops, threads):
+    """多线程执行 ops 次操作，返回 (每秒操作数, 锁冲突次数)"""
+    errors = []
+    per_thread = ops // threads
+
+    def worker(offset):
+        for i in range(per_thread):
+            try:
+                call(impl, name, offset * per_thread + i)
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+
+    workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed, len(errors)
+
+
+def setup_database(path, wal):
+    with contextlib.redirect_stdout(io.StringIO()):
+        _setup_database(path, wal)
+
+
+def _setup_database(path, wal):
+    db.DATABASE_FILE = path
+    db.close_pool()
+    if not wal:
+        # 旧实现使用默认 rollback 日志
+        conn = sqlite3.connect(path)
+        conn.close()
+    db.init_db()
+    if not wal:
+        db.close_pool()
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA journal_mode = DELETE')
+        conn.close()
+    for i in range(50):
+        db.create_room(f'room{i}', 'secret' if i % 2 else None)
+    db.close_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='db.py 连接池基准测试')
+    parser.add_argument('--ops', type=int, default=2000, help='每项测试的操作次数')
+    parser.add_argument('--threads', type=int, default=8, help='并发线程数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'操作':<24}{'旧实现 ops/s':>14}{'连接池 ops/s':>14}{'提升':>8}{'锁冲突(旧/新)':>16}")
+        for name in POOLED:
+            setup_database(os.path.join(tmp, f'legacy_{name}.db'), wal=False)
+            legacy_rate, legacy_errors = run(LEGACY, name, args.ops, args.threads)
+
+            setup_database(os.path.join(tmp, f'pooled_{name}.db'), wal=True)
+            pooled_rate, pooled_errors = run(POOLED, name, args.ops, args.threads)
+            db.close_pool()
+
+            print(f'{name:<24}{legacy_rate:>14.0f}{pooled_rate:>14.0f}'
+                  f'{pooled_rate / legacy_rate:>7.1f}x{legacy_errors:>9}/{pooled_errors}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,466 @@
+"""
+负载测试
+启动服务器（子进程或当前进程内），模拟 N 个编辑者分布在 M 个房间中，按客户端的真实流程
+join → 编辑（content_change 全量内容 + cursor_move）→ leave 施加负载，测量：
+- 加入房间耗时：发送 join 到收到 init_content（包含房间文档）
+- content_update 端到端延迟：发送 content_change 到房间内其他连接收到广播（p50/p95/p99）
+- 每秒发送和收到的消息数，以及因发送积压被合并（或丢失）的更新数
+- 服务器 CPU 占用、常驻内存，以及 SQLite 写入次数（由 /metrics 中 db.py 写函数的调用次数统计）
+结果可保存为 JSON（附带当前提交），用 --compare 与之前保存的结果对比。
+模拟客户端都在本进程中，「客户端 CPU」和「发送滞后」偏高时说明瓶颈在测试工具本身
+
+用法：
+    python benchmarks/bench_load.py [--clients 200] [--rooms 20] [--duration 30] [--mode gevent]
+    python benchmarks/bench_load.py --output before.json
+    python benchmarks/bench_load.py --compare before.json --output after.json
+    python benchmarks/bench_load.py --url http://127.0.0.1:8080 --pid 12345    # 对已运行的服务器
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_async_modes import ROOT_DIR, HOST, free_port  # noqa: E402
+from ws_client import SocketIOClient, ClientPool  # noqa: E402
+
+WORDS = ('netclip', '协作', 'markdown', '房间', 'upload', '版本', 'delta', '同步', 'cursor', '文件',
+         'server', '编辑', 'socket', '内容', 'history', '检查点')
+
+# 文档第一行的编号，用于在收到的 content_update 中找到对应的发送时间
+MARKER_PREFIX = '<!-- bench '
+MARKER_SUFFIX = ' -->\n'
+
+# db.py 中写数据库的函数（按名称前缀），用于统计 SQLite 写入
+WRITE_PREFIXES = ('save_', 'add_', 'create_', 'delete_', 'update_', 'reset_', 'admin_reset_', 'set_',
+                  'acquire_', 'release_', 'replace_', 'touch_', 'correct_')
+
+# --compare 对比的指标（名称, 说明, 是否越小越好）
+COMPARE_KEYS = (
+    ('join_ms.p50', '加入耗时 p50 ms', True),
+    ('join_ms.p99', '加入耗时 p99 ms', True),
+    ('update_ms.p50', '广播延迟 p50 ms', True),
+    ('update_ms.p95', '广播延迟 p95 ms', True),
+    ('update_ms.p99', '广播延迟 p99 ms', True),
+    ('received_per_sec', '收到消息/s', False),
+    ('updates_missing_ratio', '合并或丢失的更新比例', True),
+    ('server_cpu_percent', '服务器 CPU %', True),
+    ('server_rss_mb', '服务器 RSS MB', True),
+    ('sqlite_writes_per_sec', 'SQLite 写入/s', True),
+)
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def distribution_ms(samples):
+    """样本（秒）的 p50/p95/p99/max（毫秒）"""
+    result = {'count': len(samples)}
+    for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('max', 1.0)):
+        value = percentile(samples, q)
+        result[name] = round(value * 1000, 2) if value is not None else None
+    return result
+
+
+# ==================== 服务器 ====================
+
+def wait_ready(base, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'{base}/api/room/public/content', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('服务器启动超时')
+
+
+def create_rooms(base, room_ids):
+    for room_id in room_ids:
+        body = json.dumps({'room_id': room_id}).encode()
+        req = urllib.request.Request(f'{base}/api/room/create', data=body,
+                                     headers={'Content-Type': 'application/json'})
+        try:
+            urllib.request.urlopen(req, timeout=10).read()
+        except urllib.error.HTTPError:
+            pass  # 房间已存在
+
+
+def start_subprocess(mode, port, workdir):
+    env = dict(os.environ, NETCLIP_ASYNC_MODE=mode)
+    return subprocess.Popen(
+        [sys.executable, os.path.join(ROOT_DIR, 'serve.py'), '--mode', mode, '--host', HOST, '--port', str(port)],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def start_inprocess(port, workdir):
+    """在当前进程的后台线程中启动服务器（只支持 threading 模式，CPU 和内存统计包含模拟客户端）"""
+    os.environ['NETCLIP_ASYNC_MODE'] = 'threading'
+    os.environ.setdefault('NETCLIP_LOG_LEVEL', 'WARNING')
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT_DIR)
+    import server
+    thread = threading.Thread(target=lambda: server.socketio.run(
+        server.app, host=HOST, port=port, allow_unsafe_werkzeug=True, use_reloader=False, log_output=False
+    ), daemon=True)
+    thread.start()
+
+
+def cpu_seconds(pid):
+    """进程累计的 CPU 时间（用户态 + 内核态，秒）"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def memory_mb(pid):
+    """进程的 (常驻内存, 峰值常驻内存)，单位 MB"""
+    values = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            values[key] = value.strip()
+    return int(values['VmRSS'].split()[0]) / 1024, int(values['VmHWM'].split()[0]) / 1024
+
+
+def db_call_counts(base):
+    """/metrics 中 db.py 各函数的调用次数 {函数名: 次数}，服务器未记录指标时返回 None"""
+    try:
+        text = urllib.request.urlopen(f'{base}/metrics', timeout=10).read().decode()
+    except OSError:
+        return None
+    counts = {}
+    for line in text.splitlines():
+        if line.startswith('netclip_db_call_seconds_count{'):
+            name = line.split('function="', 1)[1].split('"', 1)[0]
+            counts[name] = float(line.rsplit(' ', 1)[1])
+    return counts or None
+
+
+# ==================== 模拟客户端 ====================
+
+class Recorder:
+    """编辑的发送时间和收到的广播（发送线程和收包线程共同更新）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = {}              # {编号: [发送时间, 应收到的连接数, 已收到的连接数]}
+        self.update_latencies = []  # 秒
+        self.join_latencies = []
+
+    def on_event(self, client, event, data):
+        """ClientPool 收包线程中调用"""
+        if event != 'content_update':
+            return
+        now = time.perf_counter()
+        content = data.get('content', '')
+        if not content.startswith(MARKER_PREFIX):
+            return
+        seq = int(content[len(MARKER_PREFIX):content.index(MARKER_SUFFIX)])
+        with self.lock:
+            entry = self.sent.get(seq)
+            if entry is not None:
+                entry[2] += 1
+                self.update_latencies.append(now - entry[0])
+
+
+class Room:
+    """房间文档的模拟编辑（由发送线程独占）"""
+
+    def __init__(self, room_id, size, rng):
+        self.id = room_id
+        self.size = size
+        self.members = []
+        words = []
+        total = 0
+        while total < size:
+            line = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 16)))
+            words.append(line)
+            total += len(line) + 1
+        self.body = '\n'.join(words)
+
+    def edit(self, rng):
+        """在随机位置输入一个词，偶尔删除一段，文档大小保持在初始大小附近；返回光标位置"""
+        position = rng.randrange(len(self.body) + 1)
+        if rng.random() < 0.1 or len(self.body) > self.size * 1.5:
+            end = position + rng.randint(1, max(len(self.body) - self.size, 20))
+            self.body = self.body[:position] + self.body[end:]
+        else:
+            word = rng.choice(WORDS) + ' '
+            self.body = self.body[:position] + word + self.body[position:]
+            position += len(word)
+        return position
+
+
+def join_clients(host, port, rooms, count, pool, recorder):
+    """依次建立连接并加入房间，每个房间的第一个连接写入初始文档"""
+    clients = []
+    failures = 0
+    for i in range(count):
+        room = rooms[i % len(rooms)]
+        try:
+            client = SocketIOClient(host, port)
+            start = time.perf_counter()
+            client.emit('join', {'room': room.id, 'username': f'user{i}'})
+            client.wait_for(lambda text: text.startswith('42["init_content"'))
+            recorder.join_latencies.append(time.perf_counter() - start)
+            if not room.members:
+                client.emit('content_change', {'room': room.id, 'content': room.body})
+        except (OSError, TimeoutError) as e:
+            failures += 1
+            if failures == 1:
+                print(f'连接失败: {e}')
+            continue
+        client.on_event = recorder.on_event
+        pool.add(client)
+        room.members.append(client)
+        clients.append((client, room))
+    return clients, failures
+
+
+def drive(clients, recorder, args, rng):
+    """
+    按泊松过程为打字的连接发送编辑，持续 args.duration 秒。
+    返回 (编辑数, 光标消息数, 最大发送滞后秒数)
+    """
+    typists = [entry for entry in clients if rng.random() < args.typists] or clients[:1]
+    start = time.perf_counter()
+    stop_at = start + args.duration
+    heap = [(start + rng.expovariate(args.rate), i) for i in range(len(typists))]
+    heapq.heapify(heap)
+    seq = edits = cursors = 0
+    max_lag = 0.0
+    while heap[0][0] < stop_at:
+        due, index = heap[0]
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            max_lag = max(max_lag, -delay)
+        heapq.heapreplace(heap, (due + rng.expovariate(args.rate), index))
+
+        client, room = typists[index]
+        if client.closed:
+            continue
+        position = room.edit(rng)
+        seq += 1
+        content = f'{MARKER_PREFIX}{seq}{MARKER_SUFFIX}{room.body}'
+        with recorder.lock:
+            recorder.sent[seq] = [time.perf_counter(), len(room.members) - 1, 0]
+        client.emit('content_change', {'room': room.id, 'content': content})
+        edits += 1
+        if rng.random() < args.cursor_ratio:
+            client.emit('cursor_move', {'room': room.id, 'position': position})
+            cursors += 1
+    return edits, cursors, max_lag
+
+
+# ==================== 测试流程 ====================
+
+def run(args):
+    rng = random.Random(args.seed)
+    workdir = None
+    server = None
+    pid = args.pid
+    if args.url:
+        base = args.url.rstrip('/')
+        parsed = urllib.parse.urlsplit(base)
+        host, port = parsed.hostname, parsed.port or 80
+    else:
+        host, port = HOST, free_port()
+        base = f'http://{host}:{port}'
+        workdir = tempfile.mkdtemp(prefix='netclip_load_')
+        if args.inprocess:
+            start_inprocess(port, workdir)
+            pid = os.getpid()
+        else:
+            server = start_subprocess(args.mode, port, workdir)
+            pid = server.pid
+
+    pool = ClientPool()
+    clients = []
+    try:
+        wait_ready(base)
+        rooms = [Room(f'load{i}', int(args.doc_kb * 1024 * rng.uniform(0.5, 1.5)), rng) for i in range(args.rooms)]
+        create_rooms(base, [room.id for room in rooms])
+
+        recorder = Recorder()
+        clients, failures = join_clients(host, port, rooms, args.clients, pool, recorder)
+        if not clients:
+            raise RuntimeError('没有连接成功')
+        time.sleep(args.settle)
+
+        # 稳定运行阶段
+        received_before = sum(client.received for client, _ in clients)
+        db_before = db_call_counts(base)
+        cpu_before = cpu_seconds(pid) if pid else None
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.perf_counter()
+        edits, cursors, max_lag = drive(clients, recorder, args, rng)
+        time.sleep(args.drain)
+        elapsed = time.perf_counter() - started
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_after = cpu_seconds(pid) if pid else None
+        db_after = db_call_counts(base)
+        received = sum(client.received for client, _ in clients) - received_before
+        rss, peak_rss = memory_mb(pid) if pid else (None, None)
+
+        for client, room in clients:
+            if not client.closed:
+                client.emit('leave', {'room': room.id})
+    finally:
+        pool.close()
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if workdir is not None and not args.inprocess:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    expected = sum(entry[1] for entry in recorder.sent.values())
+    delivered = sum(entry[2] for entry in recorder.sent.values())
+    db_calls = db_writes = None
+    if db_before is not None and db_after is not None:
+        delta = {name: count - db_before.get(name, 0) for name, count in db_after.items()}
+        db_calls = {name: int(count) for name, count in sorted(delta.items()) if count}
+        db_writes = sum(count for name, count in db_calls.items() if name.startswith(WRITE_PREFIXES))
+    client_cpu = (usage_after.ru_utime + usage_after.ru_stime) - (usage_before.ru_utime + usage_before.ru_stime)
+    return {
+        'clients': len(clients),
+        'failures': failures,
+        'rooms': args.rooms,
+        'seconds': round(elapsed, 2),
+        'join_ms': distribution_ms(recorder.join_latencies),
+        'update_ms': distribution_ms(recorder.update_latencies),
+        'edits_per_sec': round(edits / elapsed, 1),
+        'cursor_moves_per_sec': round(cursors / elapsed, 1),
+        'received_per_sec': round(received / elapsed, 1),
+        'updates_expected': expected,
+        'updates_delivered': delivered,
+        'updates_missing_ratio': round(1 - delivered / expected, 4) if expected else None,
+        'server_in_process': args.inprocess,
+        'server_cpu_percent': round((cpu_after - cpu_before) / elapsed * 100, 1) if pid else None,
+        'server_rss_mb': round(rss, 1) if rss is not None else None,
+        'server_peak_rss_mb': round(peak_rss, 1) if peak_rss is not None else None,
+        'sqlite_writes_per_sec': round(db_writes / elapsed, 2) if db_writes is not None else None,
+        'db_calls': db_calls,
+        'client_cpu_percent': round(client_cpu / elapsed * 100, 1),
+        'driver_max_lag_ms': round(max_lag * 1000, 1)
+    }
+
+
+# ==================== 结果 ====================
+
+def git_commit():
+    """当前提交和工作区是否有未提交的修改"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def lookup(result, key):
+    value = result
+    for part in key.split('.'):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def print_result(result):
+    join, update = result['join_ms'], result['update_ms']
+    print(f"连接 {result['clients']}（失败 {result['failures']}），房间 {result['rooms']}，"
+          f"测量 {result['seconds']} 秒")
+    print(f"加入耗时 ms：p50 {join['p50']}  p95 {join['p95']}  p99 {join['p99']}  max {join['max']}")
+    print(f"广播延迟 ms：p50 {update['p50']}  p95 {update['p95']}  p99 {update['p99']}  max {update['max']}"
+          f"（{update['count']} 个样本）")
+    print(f"编辑/s {result['edits_per_sec']}  光标/s {result['cursor_moves_per_sec']}  "
+          f"收到消息/s {result['received_per_sec']}  合并或丢失的更新 {result['updates_missing_ratio']}")
+    print(f"服务器 CPU {result['server_cpu_percent']}%  RSS {result['server_rss_mb']} MB"
+          f"（峰值 {result['server_peak_rss_mb']} MB）  SQLite 写入/s {result['sqlite_writes_per_sec']}")
+    print(f"客户端 CPU {result['client_cpu_percent']}%  最大发送滞后 {result['driver_max_lag_ms']} ms")
+
+
+def print_comparison(baseline, current):
+    print(f"\n与 {baseline.get('commit') or '基准'}（{baseline.get('timestamp')}）对比：")
+    print(f"{'指标':<22}{'基准':>12}{'当前':>12}{'变化':>10}")
+    for key, title, lower_better in COMPARE_KEYS:
+        before, after = lookup(baseline['result'], key), lookup(current['result'], key)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before else 0.0
+        worse = change > 0.1 if lower_better else change < -0.1
+        print(f"{title:<22}{before:>12}{after:>12}{change:>+9.0%}{'  ⚠' if worse else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='模拟多房间协作编辑的负载测试')
+    parser.add_argument('--clients', type=int, default=200, help='模拟的连接数')
+    parser.add_argument('--rooms', type=int, default=20, help='连接分布的房间数')
+    parser.add_argument('--duration', type=float, default=30, help='施加编辑负载的秒数')
+    parser.add_argument('--doc-kb', type=float, default=8, help='房间文档的平均大小（KB，各房间在 0.5~1.5 倍之间）')
+    parser.add_argument('--typists', type=float, default=0.25, help='正在打字的连接比例')
+    parser.add_argument('--rate', type=float, default=2, help='每个打字的连接每秒发送的编辑数')
+    parser.add_argument('--cursor-ratio', type=float, default=1.0, help='编辑后发送 cursor_move 的比例')
+    parser.add_argument('--settle', type=float, default=2.0, help='全部连接加入后等待的秒数')
+    parser.add_argument('--drain', type=float, default=2.0, help='停止发送后等待广播送达的秒数')
+    parser.add_argument('--mode', choices=('threading', 'gevent', 'eventlet'), default='gevent',
+                        help='子进程服务器的并发模型')
+    parser.add_argument('--inprocess', action='store_true', help='在当前进程中启动服务器（threading 模式）')
+    parser.add_argument('--url', help='对已运行的服务器测试，如 http://127.0.0.1:8080')
+    parser.add_argument('--pid', type=int, help='配合 --url 统计服务器进程的 CPU 和内存')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='保存结果的 JSON 文件')
+    parser.add_argument('--compare', help='与之前保存的 JSON 结果对比')
+    args = parser.parse_args()
+    if args.inprocess:
+        args.mode = 'threading'
+
+    # 每个连接占用一个文件描述符（子进程服务器继承同样的限制）
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(max(soft, args.clients * 2 + 256), hard), hard))
+
+    result = run(args)
+    commit, dirty = git_commit()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'result': result
+    }
+    print_result(result)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'\n结果已保存到 {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""
+单项操作基准测试
+在临时数据库中按指定规模预置房间、会话和文件，逐项测量请求路径上的 db.py 函数
+（create_room、verify_room_password、get_room_content、save_room_content、list_files、delete_room 等）
+和 validate_file_security 的单次耗时；并通过 Flask 测试客户端测量文件上传接口端到端的耗时
+（流式接收、文件头校验、SHA-256、登记 blob 和文件记录），文件大小覆盖 ALLOWED_EXTENSIONS 中的各档上限。
+数据库函数的耗时包含 metrics.py 和 profiling.py 的包装，与服务中的调用相同
+
+结果可保存为 JSON（附带当前提交）作为基准，之后用 --compare 对比中位数耗时和上传速度，列出变化超过 20% 的项
+
+用法：
+    python benchmarks/bench_operations.py [--scale 100:500:1000 --scale 10000:50000:100000] [--repeat 200]
+    python benchmarks/bench_operations.py --output baseline.json
+    python benchmarks/bench_operations.py --compare baseline.json
+    python benchmarks/bench_operations.py --skip-upload          # 只测数据库和校验函数
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('NETCLIP_LOG_LEVEL', 'WARNING')
+
+import db  # noqa: E402
+from bench_load import git_commit, percentile  # noqa: E402
+
+# 默认的预置规模（房间数:会话数:文件数）
+DEFAULT_SCALES = ('100:500:1000', '2000:10000:20000')
+# 房间文档的平均大小（字节）
+CONTENT_SIZE = 8 * 1024
+# 上传测试的文件大小（除各档上限外）
+UPLOAD_SIZES = (1024, 1024 * 1024)
+# --compare 时标出的变化比例
+REGRESSION_THRESHOLD = 0.2
+# --compare 对比的指标（p99、max 受 WAL checkpoint 等影响波动较大，不参与对比）
+COMPARE_METRICS = ('p50_us', 'p50_ms', 'mb_per_sec')
+
+MB = 1024 * 1024
+
+
+def parse_scale(text):
+    try:
+        rooms, sessions, files = (int(part) for part in text.split(':'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'规模格式为 房间数:会话数:文件数，如 1000:5000:20000（实际 {text}）')
+    return rooms, sessions, files
+
+
+def measure(func, repeat):
+    """执行 repeat 次 func(i)，返回 {p50_us, p99_us, ops_per_sec}"""
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - start)
+    return {
+        'p50_us': round(percentile(samples, 0.5) * 1e6, 1),
+        'p99_us': round(percentile(samples, 0.99) * 1e6, 1),
+        'ops_per_sec': round(len(samples) / sum(samples), 1)
+    }
+
+
+# ==================== 数据库 ====================
+
+def use_database(path):
+    db.DATABASE_FILE = path
+    db.close_pool()
+    with contextlib.redirect_stdout(io.StringIO()):
+        db.init_db()
+
+
+def seed(rooms, sessions, files, rng):
+    """直接批量插入预置数据（比逐条调用 db.py 函数快得多），奇数编号的房间设置密码"""
+    now = datetime.now()
+    secret_hash = db.hash_room_password('secret')
+    room_rows = []
+    for i in range(rooms):
+        content = 'x' * int(CONTENT_SIZE * rng.uniform(0.5, 1.5))
+        room_rows.append((f'room{i}', secret_hash if i % 2 else None,
+                          (now - timedelta(minutes=rooms - i)).isoformat(), content, db.new_password_epoch()))
+    session_rows = [(str(uuid.uuid4()), f'room{rng.randrange(rooms)}', None, now.isoformat())
+                    for _ in range(sessions)]
+    file_rows = []
+    blob_rows = {}
+    for i in range(files):
+        # 约一成文件内容重复，与去重后的存储一致
+        name = f'{rng.randrange(max(files * 9 // 10, 1)):064x}.bin'
+        size = rng.randint(1024, 10 * MB)
+        blob_rows.setdefault(name, [name, size, 0])[2] += 1
+        file_rows.append((str(uuid.uuid4()), f'room{rng.randrange(rooms)}', name,
+                          f'file{i}.{rng.choice(("pdf", "png", "txt", "zip", "docx"))}', size,
+                          (now - timedelta(seconds=files - i)).isoformat(), ''))
+
+    with db.connection() as conn, conn:
+        conn.executemany('''
+            INSERT INTO rooms (room_id, password_hash, created_at, content, password_epoch)
+            VALUES (?, ?, ?, ?, ?)
+        ''', room_rows)
+        conn.executemany('INSERT INTO user_sessions (session_id, room_id, password, created_at) VALUES (?, ?, ?, ?)',
+                         session_rows)
+        conn.executemany('''
+            INSERT INTO files (file_id, room_id, filename, original_filename, file_size, uploaded_at, description)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', file_rows)
+        conn.executemany('''
+            INSERT INTO blobs (kind, name, digest, size, refcount, created_at) VALUES ('file', ?, NULL, ?, ?, ?)
+        ''', [(name, size, refcount, now.isoformat()) for name, size, refcount in blob_rows.values()])
+
+
+def bench_database(scale, repeat, tmp, rng):
+    """在指定规模的数据库上测量各项操作"""
+    rooms, sessions, files = scale
+    use_database(os.path.join(tmp, f'bench_{rooms}_{sessions}_{files}.db'))
+    seed(rooms, sessions, files, rng)
+    content = 'y' * CONTENT_SIZE
+
+    def room(i):
+        return f'room{rng.randrange(rooms)}'
+
+    def private_room(i):
+        return f'room{rng.randrange(rooms // 2) * 2 + 1}' if rooms > 1 else 'room0'
+
+    operations = {
+        'create_room': lambda i: db.create_room(f'new{i}', 'secret' if i % 2 else None),
+        'verify_room_password(public)': lambda i: db.verify_room_password(f'room{rng.randrange(0, rooms, 2)}', None),
+        'verify_room_password(private)': lambda i: db.verify_room_password(private_room(i), 'secret'),
+        'verify_room_password(wrong)': lambda i: db.verify_room_password(private_room(i), 'wrong'),
+        'get_room_meta': lambda i: db.get_room_meta(room(i)),
+        'get_room_content': lambda i: db.get_room_content(room(i)),
+        'save_room_content': lambda i: db.save_room_content(room(i), content),
+        'save_room_contents(20)': lambda i: db.save_room_contents([(room(i), content) for _ in range(20)]),
+        'add_file': lambda i: db.add_file(str(uuid.uuid4()), room(i), f'{i:064x}.bin', f'new{i}.txt', 1024),
+        'list_files(all)': lambda i: db.list_files(),
+        'list_files(room)': lambda i: db.list_files(room(i)),
+        'list_files(ext)': lambda i: db.list_files(extensions=['pdf']),
+        'count_files(all)': lambda i: db.count_files(),
+        'get_all_rooms': lambda i: db.get_all_rooms(),
+        'get_rooms_overview': lambda i: db.get_rooms_overview(),
+    }
+    results = {}
+    for name, func in operations.items():
+        # get_all_rooms 读取所有房间（含内容），规模大时减少次数
+        count = max(repeat * 100 // max(rooms, 1), 5) if name == 'get_all_rooms' else repeat
+        results[name] = measure(func, count)
+
+    # 删除房间（含会话、文件记录和 blob 引用计数），每次删除不同的房间
+    victims = list(range(1, rooms, 2))[:repeat]
+    results['delete_room'] = measure(lambda i: db.delete_room(f'room{victims[i]}'), len(victims))
+    db.close_pool()
+    return results
+
+
+def bench_validation(server, repeat):
+    """validate_file_security：每种扩展名使用匹配的文件头"""
+    cases = []
+    for ext, config in server.ALLOWED_EXTENSIONS.items():
+        header = (config['headers'][0] if config['headers'] else b'text') + b'\0' * 16
+        cases.append((f'report.{ext}', header[:16], config['mime']))
+    cases.append(('bad..name.exe', b'MZ', 'application/octet-stream'))
+    return {
+        'validate_file_security': measure(
+            lambda i: server.validate_file_security(*cases[i % len(cases)]), repeat * len(cases))
+    }
+
+
+# ==================== 上传 ====================
+
+def upload_cases(server, max_mb):
+    """[(扩展名, 大小)]：每档上限取一种扩展名，测量小文件、1 MB 和上限大小"""
+    by_limit = {}
+    for ext, config in server.ALLOWED_EXTENSIONS.items():
+        by_limit.setdefault(config['max_size'], ext)
+    cases = []
+    for limit, ext in sorted(by_limit.items()):
+        for size in sorted({*UPLOAD_SIZES, limit}):
+            if size <= limit and (max_mb is None or size <= max_mb * MB):
+                cases.append((ext, size))
+    return cases
+
+
+def bench_upload(server, repeat, max_mb):
+    """通过测试客户端上传文件（每次内容不同，不命中去重），返回 {用例: 结果}"""
+    client = server.app.test_client()
+    db.create_room('upload')
+    results = {}
+    for ext, size in upload_cases(server, max_mb):
+        config = server.ALLOWED_EXTENSIONS[ext]
+        header = config['headers'][0] if config['headers'] else b''
+        samples = []
+        for _ in range(repeat):
+            body = header + os.urandom(size - len(header))
+            start = time.perf_counter()
+            response = client.post('/api/room/upload/upload', content_type='multipart/form-data', data={
+                'file': (io.BytesIO(body), f'bench.{ext}', config['mime'])
+            })
+            samples.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f'上传 {ext} {size} 字节失败: {response.get_json()}')
+            del body
+        seconds = percentile(samples, 0.5)
+        label = f'{size / MB:g}MB' if size >= MB else f'{size / 1024:g}KB'
+        results[f'upload {ext} {label}'] = {
+            'p50_ms': round(seconds * 1000, 2),
+            'max_ms': round(max(samples) * 1000, 2),
+            'mb_per_sec': round(size / MB / seconds, 1)
+        }
+    return results
+
+
+# ==================== 结果 ====================
+
+def flatten(results):
+    """{分组: {操作: {指标: 值}}} → {"分组 / 操作 / 指标": 值}（用于对比）"""
+    return {f'{group} / {name} / {metric}': value
+            for group, items in results.items()
+            for name, values in items.items()
+            for metric, value in values.items()}
+
+
+def print_results(results):
+    for group, items in results.items():
+        print(f'\n[{group}]')
+        for name, values in items.items():
+            print(f'  {name:<34}' + '  '.join(f'{metric} {value}' for metric, value in values.items()))
+
+
+def print_comparison(baseline, current):
+    print(f"\n与 {baseline.get('commit') or '基准'}（{baseline.get('timestamp')}）对比，"
+          f"只列出变化超过 {REGRESSION_THRESHOLD:.0%} 的项：")
+    before, after = flatten(baseline['results']), flatten(current['results'])
+    changed = 0
+    for key, value in after.items():
+        old = before.get(key)
+        if not old or value is None or not key.endswith(COMPARE_METRICS):
+            continue
+        change = (value - old) / old
+        if abs(change) < REGRESSION_THRESHOLD:
+            continue
+        # 吞吐量越大越好，耗时越小越好
+        worse = change < 0 if key.endswith('mb_per_sec') else change > 0
+        print(f"  {'变慢' if worse else '变快'} {key}: {old} → {value} ({change:+.0%})")
+        changed += 1
+    if not changed:
+        print('  无明显变化')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='db.py 操作和上传校验的单项基准测试')
+    parser.add_argument('--scale', action='append', type=parse_scale,
+                        help=f'预置规模 房间数:会话数:文件数，可重复指定（默认 {" ".join(DEFAULT_SCALES)}）')
+    parser.add_argument('--repeat', type=int, default=200, help='每项数据库操作的测量次数')
+    parser.add_argument('--upload-repeat', type=int, default=3, help='每个上传用例的测量次数')
+    parser.add_argument('--upload-max-mb', type=float, help='只测量不超过该大小的上传（默认覆盖各档上限）')
+    parser.add_argument('--skip-upload', action='store_true', help='不测量上传')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='保存结果的 JSON 文件')
+    parser.add_argument('--compare', help='与之前保存的 JSON 结果对比')
+    args = parser.parse_args()
+    scales = args.scale or [parse_scale(scale) for scale in DEFAULT_SCALES]
+
+    rng = random.Random(args.seed)
+    results = {}
+    tmp = tempfile.mkdtemp(prefix='netclip_ops_')
+    cwd = os.getcwd()
+    try:
+        # server.py 以当前目录保存数据库和上传文件，导入前切换到临时目录
+        os.chdir(tmp)
+        use_database(os.path.join(tmp, 'server.db'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            import server
+        results['validation'] = bench_validation(server, args.repeat)
+        if not args.skip_upload:
+            results['upload'] = bench_upload(server, args.upload_repeat, args.upload_max_mb)
+
+        for scale in scales:
+            label = f'db rooms={scale[0]} sessions={scale[1]} files={scale[2]}'
+            results[label] = bench_database(scale, args.repeat, tmp, rng)
+    finally:
+        os.chdir(cwd)
+        db.close_pool()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    commit, dirty = git_commit()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': results
+    }
+    print_results(results)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'\n结果已保存到 {args.output}')
+
+
+if __name__ == '__main__':
+    main()
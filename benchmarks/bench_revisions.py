@@ -0,0 +1,151 @@
+"""
+历史版本基准测试
+在一个大文档上模拟长时间的频繁编辑，每次写回记录一个版本，测量：
+- 记录版本的耗时
+- 存储占用（对比每个版本保存全文、每个版本保存压缩全文）
+- 任意版本的重建耗时
+- 精简前后的版本数、占用和重建耗时
+
+用法：
+    python benchmarks/bench_revisions.py [--size-kb 256] [--revisions 2000] [--days 60]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import revisions  # noqa: E402
+
+WORDS = ('netclip', '协作', 'markdown', '房间', 'upload', '版本', 'delta', '同步', 'cursor', '文件',
+         'server', '编辑', 'socket', '内容', 'history', '检查点')
+
+
+def random_line(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 16)))
+
+
+def generate_document(rng, size):
+    lines = []
+    total = 0
+    while total < size:
+        line = ('## ' if rng.random() < 0.05 else '') + random_line(rng)
+        lines.append(line)
+        total += len(line.encode()) + 1
+    return lines
+
+
+def edit(rng, lines, edits):
+    """模拟一个写回周期内的若干次编辑：改词、插入行、删除行，偶尔整段粘贴"""
+    for _ in range(edits):
+        roll = rng.random()
+        index = rng.randrange(len(lines))
+        if roll < 0.6:
+            words = lines[index].split(' ')
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+            lines[index] = ' '.join(words)
+        elif roll < 0.85:
+            lines.insert(index, random_line(rng))
+        elif roll < 0.98 and len(lines) > 10:
+            del lines[index]
+        else:
+            lines[index:index] = [random_line(rng) for _ in range(rng.randint(20, 80))]
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * p), len(samples) - 1)]
+
+
+def measure_restore(store, room_id, candidates, samples, rng):
+    timings = []
+    for revision in rng.sample(candidates, min(samples, len(candidates))):
+        start = time.perf_counter()
+        store.get(room_id, revision)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='房间历史版本存储与重建基准测试')
+    parser.add_argument('--size-kb', type=int, default=256, help='文档初始大小（KB）')
+    parser.add_argument('--revisions', type=int, default=2000, help='记录的版本数')
+    parser.add_argument('--edits', type=int, default=5, help='每个版本之间的编辑次数')
+    parser.add_argument('--days', type=float, default=60, help='版本时间跨度（天）')
+    parser.add_argument('--restores', type=int, default=200, help='测量重建耗时的随机版本数')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DATABASE_FILE = os.path.join(tmp, 'bench.db')
+        db.close_pool()
+        with contextlib.redirect_stdout(io.StringIO()):
+            db.init_db()
+        db.create_room('bench')
+
+        store = revisions.RevisionStore()
+        lines = generate_document(rng, args.size_kb * 1024)
+        start_time = datetime.now() - timedelta(days=args.days)
+        step = timedelta(days=args.days) / args.revisions
+
+        record_ms = []
+        full_bytes = compressed_bytes = 0
+        for i in range(args.revisions):
+            if i:
+                edit(rng, lines, args.edits)
+            content = '\n'.join(lines)
+            data = content.encode()
+            full_bytes += len(data)
+            if i % 50 == 0:
+                # 每个版本保存压缩全文的占用（抽样估算，避免基准本身过慢）
+                compressed_bytes += len(zlib.compress(data)) * min(50, args.revisions - i)
+            start = time.perf_counter()
+            store.record('bench', content, now=start_time + step * i)
+            record_ms.append((time.perf_counter() - start) * 1000)
+
+        before = db.get_revision_stats()
+        all_revisions = list(range(1, args.revisions + 1))
+        restore_before = measure_restore(revisions.RevisionStore(), 'bench', all_revisions,
+                                         args.restores, rng)
+
+        start = time.perf_counter()
+        removed = store.compact(now=start_time + step * args.revisions)
+        compact_seconds = time.perf_counter() - start
+        after = db.get_revision_stats()
+        remaining = [r['revision'] for r in db.list_revisions('bench', limit=args.revisions)]
+        restore_after = measure_restore(revisions.RevisionStore(), 'bench', remaining, args.restores, rng)
+
+        # 校验：精简后保留的版本内容与最新内容一致
+        latest = store.get('bench', args.revisions)
+        assert latest['content'] == '\n'.join(lines), '最新版本内容不一致'
+
+        mb = 1024 * 1024
+        print(f"文档大小：{len(data) / 1024:.0f} KB，版本数：{args.revisions}，时间跨度：{args.days:g} 天")
+        print(f"记录耗时 ms：p50 {statistics.median(record_ms):.2f}  p99 {percentile(record_ms, 0.99):.2f}"
+              f"  max {max(record_ms):.2f}")
+        print(f"\n{'存储方式':<22}{'占用 MB':>10}{'相对全文':>10}")
+        print(f"{'每版本全文':<22}{full_bytes / mb:>10.1f}{1:>10.0%}")
+        print(f"{'每版本压缩全文':<20}{compressed_bytes / mb:>10.1f}{compressed_bytes / full_bytes:>10.1%}")
+        print(f"{'checkpoint + delta':<22}{before['stored_bytes'] / mb:>10.2f}"
+              f"{before['stored_bytes'] / full_bytes:>10.2%}")
+        print(f"{'精简后':<22}{after['stored_bytes'] / mb:>10.2f}{after['stored_bytes'] / full_bytes:>10.2%}")
+        print(f"\n精简：删除 {removed} 个版本，剩余 {after['revisions']} 个"
+              f"（checkpoint {before['checkpoints']} → {after['checkpoints']}），耗时 {compact_seconds:.2f} s")
+        for label, timings in (('精简前', restore_before), ('精简后', restore_after)):
+            print(f"重建耗时 ms（{label}）：p50 {statistics.median(timings):.2f}"
+                  f"  p99 {percentile(timings, 0.99):.2f}  max {max(timings):.2f}")
+        db.close_pool()
+
+
+if __name__ == '__main__':
+    main()
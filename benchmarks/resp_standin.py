@@ -0,0 +1,185 @@
+"""
+测试用的 Redis 协议替身
+在本机没有 Redis 时用于运行多进程测试，只实现消息总线用到的命令：
+PING SELECT PUBLISH SUBSCRIBE GET SET(NX/PX/EX) DEL PEXPIRE HSET HGET HDEL HGETALL
+数据只保存在内存中，不区分数据库编号
+
+用法：
+    python benchmarks/resp_standin.py [--port 6399]
+然后以 NETCLIP_BUS_URL=redis://127.0.0.1:6399 启动多个服务进程
+"""
+import argparse
+import asyncio
+import time
+
+
+class Store:
+    def __init__(self):
+        self.data = {}        # {key: value}
+        self.expires = {}     # {key: 过期时间}
+        self.subscribers = {}  # {channel: set(writer)}
+
+    def _alive(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.data.pop(key, None)
+            del self.expires[key]
+        return key in self.data
+
+
+def encode(value):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, bool):
+        return b':1\r\n' if value else b':0\r\n'
+    if isinstance(value, int):
+        return f':{value}\r\n'.encode()
+    if isinstance(value, str):
+        return f'+{value}\r\n'.encode()
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(encode(v) for v in value)
+    raise TypeError(type(value))
+
+
+class Error(Exception):
+    pass
+
+
+async def read_command(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b'*'):
+        return line.split()
+    args = []
+    for _ in range(int(line[1:])):
+        length = int((await reader.readline())[1:])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+def execute(store, args):
+    name = args[0].upper().decode()
+    args = args[1:]
+    if name == 'PING':
+        return 'PONG'
+    if name == 'SELECT':
+        return 'OK'
+    if name == 'PUBLISH':
+        channel, message = args
+        subscribers = store.subscribers.get(channel, ())
+        frame = encode([b'message', channel, message])
+        for subscriber in subscribers:
+            subscriber.write(frame)
+        return len(subscribers)
+    if name == 'GET':
+        key = args[0]
+        return store.data[key] if store._alive(key) else None
+    if name == 'SET':
+        key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+        expires = None
+        nx = False
+        i = 0
+        while i < len(options):
+            if options[i] == b'NX':
+                nx = True
+            elif options[i] in (b'PX', b'EX'):
+                scale = 1000 if options[i] == b'PX' else 1
+                expires = time.monotonic() + int(options[i + 1]) / scale
+                i += 1
+            i += 1
+        if nx and store._alive(key):
+            return None
+        store.data[key] = value
+        store.expires.pop(key, None)
+        if expires is not None:
+            store.expires[key] = expires
+        return 'OK'
+    if name == 'DEL':
+        removed = 0
+        for key in args:
+            if store._alive(key):
+                del store.data[key]
+                store.expires.pop(key, None)
+                removed += 1
+        return removed
+    if name == 'PEXPIRE':
+        key, px = args
+        if not store._alive(key):
+            return 0
+        store.expires[key] = time.monotonic() + int(px) / 1000
+        return 1
+    if name in ('HSET', 'HGET', 'HDEL', 'HGETALL'):
+        key = args[0]
+        table = store.data.get(key) if store._alive(key) else None
+        if table is not None and not isinstance(table, dict):
+            raise Error('WRONGTYPE Operation against a key holding the wrong kind of value')
+        if name == 'HSET':
+            table = store.data.setdefault(key, {})
+            added = 0
+            for i in range(1, len(args), 2):
+                added += args[i] not in table
+                table[args[i]] = args[i + 1]
+            return added
+        if name == 'HGET':
+            return (table or {}).get(args[1])
+        if name == 'HDEL':
+            removed = sum(1 for field in args[1:] if (table or {}).pop(field, None) is not None)
+            if table == {}:
+                del store.data[key]
+            return removed
+        return [item for pair in (table or {}).items() for item in pair]
+    raise Error(f"ERR unknown command '{name}'")
+
+
+async def handle(store, reader, writer):
+    channels = []
+    try:
+        while True:
+            args = await read_command(reader)
+            if args is None:
+                break
+            if not args:
+                continue
+            if args[0].upper() == b'SUBSCRIBE':
+                for count, channel in enumerate(args[1:], len(channels) + 1):
+                    store.subscribers.setdefault(channel, set()).add(writer)
+                    channels.append(channel)
+                    writer.write(encode([b'subscribe', channel, count]))
+            else:
+                try:
+                    writer.write(encode(execute(store, args)))
+                except Error as e:
+                    writer.write(f'-{e}\r\n'.encode())
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        for channel in channels:
+            store.subscribers.get(channel, set()).discard(writer)
+        writer.close()
+
+
+async def serve(host, port):
+    store = Store()
+    server = await asyncio.start_server(lambda r, w: handle(store, r, w), host, port)
+    print(f'RESP 替身监听 {host}:{port}', flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测试用的 Redis 协议替身')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6399)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+基准测试用的最小 Socket.IO 客户端
+直接实现 WebSocket 帧和 Engine.IO v4 / Socket.IO v5 文本协议，不依赖额外的包，
+大量连接由一个 selector 线程统一收包和应答心跳
+"""
+import base64
+import json
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+
+
+class SocketIOClient:
+    """单个 WebSocket 连接"""
+
+    def __init__(self, host, port, timeout=10):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buffer = b''
+        self._send_lock = threading.Lock()
+        self.received = 0
+        self.events = {}          # {事件名: 收到次数}
+        self.on_event = None      # 回调 (client, event, data)
+        self.closed = False
+
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = (f'GET /socket.io/?EIO=4&transport=websocket HTTP/1.1\r\n'
+                   f'Host: {host}:{port}\r\n'
+                   f'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                   f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n')
+        self.sock.sendall(request.encode())
+        while b'\r\n\r\n' not in self._buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ConnectionError('握手时连接被关闭')
+            self._buffer += data
+        header, self._buffer = self._buffer.split(b'\r\n\r\n', 1)
+        if b' 101 ' not in header.split(b'\r\n', 1)[0]:
+            raise ConnectionError(header.split(b'\r\n', 1)[0].decode(errors='replace'))
+
+        # Engine.IO open 包，然后连接默认命名空间
+        self.wait_for(lambda text: text.startswith('0'))
+        self.send_text('40')
+        self.wait_for(lambda text: text.startswith('40'))
+
+    # ---------- WebSocket 帧 ----------
+
+    def send_text(self, text):
+        payload = text.encode()
+        header = bytearray([0x81])
+        length = len(payload)
+        if length < 126:
+            header.append(0x80 | length)
+        elif length < 65536:
+            header.append(0x80 | 126)
+            header += struct.pack('!H', length)
+        else:
+            header.append(0x80 | 127)
+            header += struct.pack('!Q', length)
+        mask = os.urandom(4)
+        # 按整数一次异或掩码（逐字节异或在发送整篇文档时是客户端的瓶颈）
+        key = (mask * (length // 4 + 1))[:length]
+        masked = (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(length, 'big')
+        with self._send_lock:
+            self.sock.sendall(bytes(header) + mask + masked)
+
+    def _parse_frames(self):
+        """从缓冲区取出完整的帧 [(opcode, payload)]"""
+        frames = []
+        buf = self._buffer
+        while len(buf) >= 2:
+            opcode = buf[0] & 0x0F
+            length = buf[1] & 0x7F
+            offset = 2
+            if length == 126:
+                if len(buf) < 4:
+                    break
+                length = struct.unpack('!H', buf[2:4])[0]
+                offset = 4
+            elif length == 127:
+                if len(buf) < 10:
+                    break
+                length = struct.unpack('!Q', buf[2:10])[0]
+                offset = 10
+            if len(buf) < offset + length:
+                break
+            frames.append((opcode, buf[offset:offset + length]))
+            buf = buf[offset + length:]
+        self._buffer = buf
+        return frames
+
+    def _handle(self, opcode, payload):
+        """处理一帧，返回文本消息或 None"""
+        if opcode == 0x8:
+            self.closed = True
+            return None
+        if opcode == 0x9:
+            return None
+        if opcode != 0x1:
+            return None
+        text = payload.decode()
+        self.received += 1
+        if text == '2':
+            # Engine.IO 心跳
+            self.send_text('3')
+        elif text.startswith('42'):
+            event, *args = json.loads(text[2:])
+            self.events[event] = self.events.get(event, 0) + 1
+            if self.on_event is not None:
+                self.on_event(self, event, args[0] if args else None)
+        return text
+
+    def wait_for(self, predicate, timeout=10):
+        """阻塞读取直到收到满足条件的文本消息"""
+        deadline = time.monotonic() + timeout
+        while True:
+            for opcode, payload in self._parse_frames():
+                text = self._handle(opcode, payload)
+                if text is not None and predicate(text):
+                    return text
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError('等待服务器消息超时')
+            self.sock.settimeout(remaining)
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError('连接被关闭')
+            self._buffer += data
+
+    def feed(self):
+        """非阻塞读取并处理已到达的数据（由 ClientPool 调用）"""
+        try:
+            data = self.sock.recv(65536)
+        except (BlockingIOError, TimeoutError):
+            return
+        if not data:
+            self.closed = True
+            return
+        self._buffer += data
+        for opcode, payload in self._parse_frames():
+            self._handle(opcode, payload)
+
+    # ---------- Socket.IO ----------
+
+    def emit(self, event, data):
+        self.send_text('42' + json.dumps([event, data], ensure_ascii=False))
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ClientPool:
+    """在后台线程中为所有连接收包、应答心跳"""
+
+    def __init__(self):
+        self.clients = []
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def add(self, client, send_timeout=10):
+        # 不使用完全非阻塞的 socket：发送缓冲区满时 sendall 会只写出部分帧，这里改为等待
+        client.sock.settimeout(send_timeout)
+        with self._lock:
+            self.clients.append(client)
+            self._selector.register(client.sock, selectors.EVENT_READ, client)
+
+    def _loop(self):
+        while self._running:
+            for key, _ in self._selector.select(timeout=0.05):
+                client = key.data
+                client.feed()
+                if client.closed:
+                    with self._lock:
+                        self._selector.unregister(client.sock)
+
+    def close(self):
+        self._running = False
+        self._thread.join(timeout=2)
+        for client in self.clients:
+            client.close()
+        self._selector.close()
@@ -0,0 +1,204 @@
+"""
+内容寻址文件存储
+上传的文件和图片按 SHA-256 摘要命名，相同内容在磁盘上只保存一份，
+引用计数记录在 blobs 表中，最后一个引用被删除后才删除实际文件。
+引用计数归零的记录就是待删除队列：删除记录时只修改引用计数，实际文件由后台清理任务分批删除
+（见 cleanup.py），进程重启后未删除的文件在下一次清理时继续删除
+"""
+import hashlib
+import os
+import tempfile
+import threading
+
+import db
+import runtime
+
+# 各类 blob 的存放目录
+FILES_FOLDER = 'files'
+IMAGES_FOLDER = 'images'
+
+# 计算摘要和复制数据的块大小
+HASH_CHUNK_SIZE = 1024 * 1024
+# 每批回收的 blob 数
+COLLECT_BATCH = 500
+# 回收时先将文件改名为该前缀，确认记录已删除后再删除文件
+TOMBSTONE_PREFIX = '.deleting_'
+
+
+class HashingWriter:
+    """写入临时文件的同时计算 SHA-256，完成后交给 BlobStore.commit() 登记"""
+
+    def __init__(self, directory, prefix='.upload_'):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.name = tempfile.mkstemp(prefix=prefix, suffix='.part', dir=directory)
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def close(self):
+        self._file.close()
+
+    def discard(self):
+        """关闭并删除临时文件"""
+        self._file.close()
+        if os.path.exists(self.name):
+            os.remove(self.name)
+
+    def __getattr__(self, name):
+        # seek/read/tell 等由底层文件提供
+        return getattr(self._file, name)
+
+
+@runtime.blocking
+def hash_file(path):
+    """计算已有文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blob_extension(filename):
+    """图片 blob 保留小写扩展名（用于推断 Content-Type），异常扩展名丢弃"""
+    ext = os.path.splitext(filename)[1].lower()
+    return ext if 1 < len(ext) <= 10 and ext[1:].isalnum() else ''
+
+
+@runtime.blocking
+def _copy_stream(stream, writer):
+    """将数据流完整写入 writer 并关闭"""
+    while True:
+        chunk = stream.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        writer.write(chunk)
+    writer.close()
+
+
+class BlobStore:
+    """按摘要去重的文件存储，每类 blob 对应一个目录"""
+
+    def __init__(self, folders):
+        self.folders = folders
+        # 登记与回收互斥，避免刚复用的 blob 被同时删除
+        self._lock = threading.Lock()
+        self.deduplicated = 0     # 本进程内命中已有内容的上传次数
+        self.bytes_saved = 0      # 因此少写入磁盘的字节数
+        self.collected = 0        # 已回收的 blob 数
+
+    def path(self, kind, name):
+        return os.path.join(self.folders[kind], name)
+
+    def writer(self, kind):
+        """在 blob 目录下创建临时写入器（同一文件系统，commit 时可原子重命名）"""
+        return HashingWriter(self.folders[kind])
+
+    def commit(self, kind, temp_path, digest, size, ext=''):
+        """
+        将临时文件登记为 blob 并增加一次引用，返回 blob 名称
+        内容已存在时直接删除临时文件
+        """
+        name = digest + ext
+        path = self.path(kind, name)
+        with self._lock:
+            # 先登记引用再检查文件：回收方（可能在其他进程中）只删除引用计数仍为零的记录，
+            # 登记之后已存在的文件不会再被删除，正在被回收的文件已改名，这里会重新写入
+            db.acquire_blob(kind, name, digest, size)
+            try:
+                if os.path.exists(path):
+                    os.remove(temp_path)
+                    duplicate = True
+                else:
+                    os.replace(temp_path, path)
+                    duplicate = False
+            except BaseException:
+                db.release_blob(kind, name)
+                raise
+            if duplicate:
+                self.deduplicated += 1
+                self.bytes_saved += size
+        return name
+
+    def store(self, kind, stream, ext=''):
+        """将数据流写入存储，返回 (blob 名称, 大小)"""
+        writer = self.writer(kind)
+        try:
+            _copy_stream(stream, writer)
+            return self.commit(kind, writer.name, writer.hexdigest(), writer.size, ext), writer.size
+        except BaseException:
+            writer.discard()
+            raise
+
+    def release(self, kind, name):
+        """释放一次引用（如文件记录保存失败），引用归零后由 collect() 删除文件"""
+        db.release_blob(kind, name)
+
+    def _remove(self, kind, name):
+        """
+        删除引用计数已归零的 blob，返回是否删除。
+        文件先改名再删除记录，期间被重新引用时改回原名（commit 发现文件不存在时会重新写入）
+        """
+        if kind not in self.folders:
+            return db.delete_unreferenced_blob(kind, name)
+        path = self.path(kind, name)
+        tombstone = self.path(kind, TOMBSTONE_PREFIX + name)
+        with self._lock:
+            try:
+                os.replace(path, tombstone)
+            except FileNotFoundError:
+                tombstone = None
+            deleted = db.delete_unreferenced_blob(kind, name)
+            if tombstone:
+                if deleted or os.path.exists(path):
+                    os.remove(tombstone)
+                else:
+                    os.replace(tombstone, path)
+            return deleted
+
+    def collect(self, limit=None):
+        """删除引用计数已归零的 blob，最多删除 limit 个（None 表示全部），返回删除的数量"""
+        removed = 0
+        while limit is None or removed < limit:
+            batch = COLLECT_BATCH if limit is None else min(COLLECT_BATCH, limit - removed)
+            candidates = db.get_unreferenced_blobs(batch)
+            for kind, name in candidates:
+                if self._remove(kind, name):
+                    removed += 1
+            if len(candidates) < batch:
+                break
+        self.collected += removed
+        return removed
+
+    def stats(self):
+        """存储统计，dedup_ratio 为逻辑字节数 / 实际占用字节数"""
+        kinds = db.get_blob_stats()
+        for kind_stats in kinds.values():
+            stored = kind_stats['stored_bytes']
+            kind_stats['dedup_ratio'] = round(kind_stats['logical_bytes'] / stored, 3) if stored else 1.0
+        stored = sum(k['stored_bytes'] for k in kinds.values())
+        logical = sum(k['logical_bytes'] for k in kinds.values())
+        return {
+            'kinds': kinds,
+            'stored_bytes': stored,
+            'logical_bytes': logical,
+            'saved_bytes': logical - stored,
+            'dedup_ratio': round(logical / stored, 3) if stored else 1.0,
+            'deduplicated_uploads': self.deduplicated,
+            'upload_bytes_saved': self.bytes_saved,
+            'collected': self.collected
+        }
+
+
+blob_store = BlobStore({'file': FILES_FOLDER, 'image': IMAGES_FOLDER})
@@ -0,0 +1,294 @@
+"""
+后台清理
+删除文件、房间时只修改数据库中的引用计数（见 blob_store.py），实际文件由这里的后台任务分批删除，
+每批之间暂停一段时间，大量删除不会占满磁盘 IO，也不会阻塞请求。
+此外定期执行一次完整清理：
+- 核对文件 blob 的引用计数与 files 记录，修正进程崩溃等原因留下的偏差
+- 扫描房间内容和保留的历史版本中引用的图片，长期未被上传也未被引用的图片交给删除队列
+- 删除磁盘上没有登记的文件（登记之前崩溃留下的文件、过期的上传临时文件）
+- 删除设置了过期时间、无活动超过该时长且无人在线的房间（剪贴板式的临时房间）
+待删除的记录保存在数据库中，多个进程可以同时运行清理任务，进程重启后继续处理
+"""
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+import db
+import runtime
+from blob_store import TOMBSTONE_PREFIX
+from eventlog import event_log
+
+# 完整清理的间隔（秒）
+CLEANUP_INTERVAL = float(os.environ.get('NETCLIP_CLEANUP_INTERVAL', '3600'))
+# 每批处理的数量（删除的文件数、核对的记录数、扫描的房间数或目录项数）
+CLEANUP_BATCH = int(os.environ.get('NETCLIP_CLEANUP_BATCH', '100'))
+# 每批之间暂停的时间（毫秒）
+CLEANUP_PAUSE_MS = int(os.environ.get('NETCLIP_CLEANUP_PAUSE_MS', '200'))
+# 磁盘上未登记的文件、上传临时文件超过该时长（小时）才删除，避免删除正在写入的文件
+ORPHAN_GRACE_HOURS = float(os.environ.get('NETCLIP_ORPHAN_GRACE_HOURS', '24'))
+# 图片超过该天数未被上传、也未被任何房间内容或保留的历史版本引用时删除，0 表示不删除图片
+IMAGE_RETENTION_DAYS = float(os.environ.get('NETCLIP_IMAGE_RETENTION_DAYS', '30'))
+
+# 房间内容中的图片引用（/upload-image 返回的 URL）
+IMAGE_REF_PATTERN = re.compile(r'/images/([A-Za-z0-9][A-Za-z0-9._-]*)')
+
+
+@runtime.blocking
+def _list_dir(path):
+    """目录中的文件名"""
+    try:
+        with os.scandir(path) as entries:
+            return [entry.name for entry in entries if entry.is_file()]
+    except FileNotFoundError:
+        return []
+
+
+@runtime.blocking
+def _modified_times(path, names):
+    """
+    文件的 [(名称, 修改时间)]，已不存在的文件不包含在结果中。
+    改名也算修改（回收中的文件改名后保留原来的 mtime），取 mtime 和 ctime 中较晚的一个
+    """
+    result = []
+    for name in names:
+        try:
+            stat = os.stat(os.path.join(path, name))
+        except FileNotFoundError:
+            continue
+        result.append((name, max(stat.st_mtime, stat.st_ctime)))
+    return result
+
+
+def image_references(content):
+    """内容中引用的图片 blob 名称"""
+    return set(IMAGE_REF_PATTERN.findall(content or ''))
+
+
+class Cleanup:
+    """后台删除队列和定期清理"""
+
+    def __init__(self, blob_store, live_contents=None, room_active=None, delete_room=None,
+                 upload_active=None, revision_references=None, sleep=time.sleep):
+        self.blob_store = blob_store
+        self.live_contents = live_contents  # live_contents() -> [(room_id, 内存中尚未写回的内容)]
+        self.room_active = room_active      # room_active(room_id) -> 是否有人在线
+        self.delete_room = delete_room      # delete_room(room_id) -> 是否删除（同管理员删除房间）
+        self.upload_active = upload_active  # upload_active(upload_id) -> 断点续传会话是否存在
+        # revision_references(room_id) -> 房间保留的历史版本中引用的图片
+        self.revision_references = revision_references
+        self.sleep = sleep
+        self._wake = threading.Event()
+        self._suspects = {}                 # 上一轮发现引用计数偏多的文件 blob {name: (refcount, actual)}
+        self._revision_refs = {}            # 历史版本中的图片引用 {room_id: ((最新版本号, 版本数), 图片名称集合)}
+        self.last_run = None
+        self.last_duration = None
+        self.collected = 0
+        self.refcounts_fixed = 0
+        self.images_released = 0
+        self.orphans_removed = 0
+        self.rooms_expired = 0
+
+    def wake(self):
+        """有新的待删除文件时唤醒后台任务"""
+        self._wake.set()
+
+    def _pause(self):
+        self.sleep(CLEANUP_PAUSE_MS / 1000)
+
+    # ==================== 删除队列 ====================
+
+    def drain(self):
+        """分批删除引用计数已归零的 blob，返回删除的数量"""
+        total = 0
+        while True:
+            removed = self.blob_store.collect(limit=CLEANUP_BATCH)
+            total += removed
+            self.collected += removed
+            if removed < CLEANUP_BATCH:
+                return total
+            self._pause()
+
+    # ==================== 定期清理 ====================
+
+    def reconcile_files(self):
+        """
+        核对文件 blob 的引用计数。计数偏少时立即修正（否则仍被引用的文件会被删除）；
+        计数偏多可能是上传尚未写入文件记录，连续两轮相同时才修正
+        """
+        suspects = {}
+        after = ''
+        while True:
+            rows = db.get_file_blob_refcounts(after, CLEANUP_BATCH)
+            for name, refcount, actual in rows:
+                if refcount < actual or (refcount > actual and self._suspects.get(name) == (refcount, actual)):
+                    if db.correct_blob_refcount('file', name, refcount, actual):
+                        self.refcounts_fixed += 1
+                        event_log.warning('blob_refcount_fixed', '修正文件 {name} 的引用计数 {refcount} -> {actual}',
+                                          name=name, refcount=refcount, actual=actual)
+                elif refcount > actual:
+                    suspects[name] = (refcount, actual)
+            if len(rows) < CLEANUP_BATCH:
+                break
+            after = rows[-1][0]
+            self._pause()
+        self._suspects = suspects
+
+    def _touch_revision_images(self, stamp):
+        """
+        记录历史版本中仍在引用的图片（恢复历史版本时图片仍然可用）。
+        重建全部版本的开销较大，房间的最新版本号和版本数都未变化时（没有新版本，也没有被精简）沿用上一轮的结果
+        """
+        known = {}
+        after = ''
+        while True:
+            rooms = db.get_revision_rooms(after, CLEANUP_BATCH)
+            referenced = set()
+            for room_id, latest, count in rooms:
+                cached = self._revision_refs.get(room_id)
+                if cached is not None and cached[0] == (latest, count):
+                    images = cached[1]
+                else:
+                    images = self.revision_references(room_id)
+                known[room_id] = ((latest, count), images)
+                referenced |= images
+            db.touch_blobs('image', referenced, stamp)
+            if len(rooms) < CLEANUP_BATCH:
+                break
+            after = rooms[-1][0]
+            self._pause()
+        self._revision_refs = known
+
+    def release_images(self, now):
+        """记录房间内容和历史版本中仍在引用的图片，释放超过保留期限未被引用的图片"""
+        if IMAGE_RETENTION_DAYS <= 0:
+            return 0
+        stamp = now.isoformat()
+        after = ''
+        while True:
+            rooms = db.get_room_contents(after, CLEANUP_BATCH)
+            referenced = set()
+            for _, content in rooms:
+                referenced |= image_references(content)
+            db.touch_blobs('image', referenced, stamp)
+            if len(rooms) < CLEANUP_BATCH:
+                break
+            after = rooms[-1][0]
+            self._pause()
+        if self.live_contents is not None:
+            referenced = set()
+            for _, content in self.live_contents():
+                referenced |= image_references(content)
+            db.touch_blobs('image', referenced, stamp)
+        if self.revision_references is not None:
+            self._touch_revision_images(stamp)
+
+        released = db.release_stale_blobs('image', (now - timedelta(days=IMAGE_RETENTION_DAYS)).isoformat())
+        self.images_released += released
+        return released
+
+    def _is_orphan(self, name, registered):
+        """目录中已超过宽限期的文件是否可以删除"""
+        if name.startswith(TOMBSTONE_PREFIX) or name.startswith('.upload_'):
+            return True
+        if name.startswith('.resumable_'):
+            upload_id = name[len('.resumable_'):].rsplit('.', 1)[0]
+            return self.upload_active is not None and not self.upload_active(upload_id)
+        return name not in registered
+
+    def remove_orphans(self, now):
+        """删除 blob 目录中没有登记的文件和过期的临时文件"""
+        cutoff = now.timestamp() - ORPHAN_GRACE_HOURS * 3600
+        removed = 0
+        for kind, folder in self.blob_store.folders.items():
+            listing = _list_dir(folder)
+            for start in range(0, len(listing), CLEANUP_BATCH):
+                if start:
+                    self._pause()
+                entries = _modified_times(folder, listing[start:start + CLEANUP_BATCH])
+                names = [name for name, mtime in entries if mtime < cutoff]
+                registered = db.get_existing_blobs(kind, [n for n in names if not n.startswith('.')])
+                unregistered = [n for n in names if not n.startswith('.') and n not in registered]
+                if kind == 'file':
+                    # 旧版本的文件记录直接引用文件名，启动时登记为 blob，这里再确认一次
+                    registered |= db.get_referenced_filenames(unregistered)
+                for name in names:
+                    if not self._is_orphan(name, registered):
+                        continue
+                    path = os.path.join(folder, name)
+                    try:
+                        if kind == 'image' and not name.startswith('.'):
+                            # 引入内容寻址存储之前上传的图片没有登记，登记后按引用情况处理
+                            db.acquire_blob(kind, name, None, os.path.getsize(path))
+                            continue
+                        os.remove(path)
+                    except FileNotFoundError:
+                        continue
+                    removed += 1
+        self.orphans_removed += removed
+        return removed
+
+    def expire_rooms(self, now):
+        """删除设置了过期时间、无活动超过该时长且无人在线的房间"""
+        if self.delete_room is None:
+            return 0
+        expired = 0
+        live = {room_id for room_id, _ in self.live_contents()} if self.live_contents is not None else set()
+        for room in db.get_expiring_rooms():
+            deadline = datetime.fromisoformat(room['last_activity']) + timedelta(seconds=room['ttl_seconds'])
+            if deadline > now or room['room_id'] in live:
+                continue
+            if self.room_active is not None and self.room_active(room['room_id']):
+                continue
+            if self.delete_room(room['room_id']):
+                expired += 1
+                event_log.info('room_expired', '房间 {room} 超过 {ttl} 秒无活动，已删除',
+                               room=room['room_id'], ttl=room['ttl_seconds'])
+            self._pause()
+        self.rooms_expired += expired
+        return expired
+
+    def run_once(self, now=None):
+        """执行一次完整清理"""
+        now = now or datetime.now()
+        start = time.monotonic()
+        self.expire_rooms(now)
+        self.reconcile_files()
+        self.release_images(now)
+        self.remove_orphans(now)
+        self.drain()
+        self.last_run = now.isoformat()
+        self.last_duration = round(time.monotonic() - start, 3)
+
+    def run(self):
+        """后台任务：被唤醒时处理删除队列，定期执行完整清理"""
+        next_full = time.monotonic() + min(CLEANUP_INTERVAL, 60)
+        while True:
+            self._wake.wait(max(next_full - time.monotonic(), 0))
+            self._wake.clear()
+            try:
+                if time.monotonic() >= next_full:
+                    next_full = time.monotonic() + CLEANUP_INTERVAL
+                    self.run_once()
+                else:
+                    self.drain()
+            except Exception as e:
+                event_log.error('cleanup_failed', '后台清理失败: {error}', error=str(e))
+
+    def stats(self):
+        return {
+            'pending': db.count_unreferenced_blobs(),
+            'collected': self.collected,
+            'refcounts_fixed': self.refcounts_fixed,
+            'images_released': self.images_released,
+            'orphans_removed': self.orphans_removed,
+            'rooms_expired': self.rooms_expired,
+            'last_run': self.last_run,
+            'last_duration': self.last_duration,
+            'interval': CLEANUP_INTERVAL,
+            'batch': CLEANUP_BATCH,
+            'pause_ms': CLEANUP_PAUSE_MS,
+            'orphan_grace_hours': ORPHAN_GRACE_HOURS,
+            'image_retention_days': IMAGE_RETENTION_DAYS
+        }
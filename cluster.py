@@ -0,0 +1,434 @@
+"""
+多进程协作
+通过消息总线（见 message_bus.py）让同一房间的用户分布在多个服务进程上：
+- 广播事件先发给本进程的连接，再发布到总线，由其他进程发给各自的连接
+- 每个房间的文档由一个进程持有（带租约），其他进程把加入、编辑请求转发给它，
+  由它统一变换、确认和广播，所有进程看到同一份文档和同一个版本序列
+- 在线成员保存在总线的哈希表中，心跳超时的进程的成员会被忽略并清理
+使用进程内总线时所有房间都由本进程持有，不产生任何额外开销
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import ot
+from eventlog import event_log
+from message_bus import create_bus
+
+# 心跳间隔（秒），同时也是文档归属缓存的有效期
+HEARTBEAT_INTERVAL = float(os.environ.get('NETCLIP_CLUSTER_HEARTBEAT', '2.0'))
+# 超过该时间（秒）没有心跳的进程视为失联，其持有的文档可被接管
+WORKER_TIMEOUT = float(os.environ.get('NETCLIP_CLUSTER_WORKER_TIMEOUT', '10.0'))
+# 文档租约时长（毫秒）
+OWNER_LEASE_MS = int(WORKER_TIMEOUT * 1000)
+# 文档归属变化时请求最多转发的次数
+MAX_FORWARD_HOPS = 3
+
+BROADCAST_CHANNEL = 'netclip:broadcast'
+WORKERS_KEY = 'netclip:workers'
+# 各进程的在线连接数，随心跳更新
+CONNECTIONS_KEY = 'netclip:connections'
+# 只支持全量内容的旧客户端额外加入的 Socket.IO 房间的前缀（不能用作房间号）
+LEGACY_ROOM_PREFIX = 'netclip:full:'
+
+
+def worker_channel(worker_id):
+    return f'netclip:worker:{worker_id}'
+
+
+def owner_key(room_id):
+    return f'netclip:owner:{room_id}'
+
+
+def members_key(room_id):
+    return f'netclip:members:{room_id}'
+
+
+def legacy_room(room_id):
+    """房间内旧客户端所在的 Socket.IO 房间，增量操作以全量内容的形式发给它们"""
+    return LEGACY_ROOM_PREFIX + room_id
+
+
+class Cluster:
+    """本进程在集群中的视图"""
+
+    def __init__(self, socketio, outbound, room_store, presence, room_cache=None, bus=None):
+        self.socketio = socketio
+        self.outbound = outbound   # 发送给本进程连接的消息都经过连接级发送队列，见 outbound.py
+        self.room_store = room_store
+        self.presence = presence
+        self.room_cache = room_cache  # 房间元数据缓存，见 room_cache.py
+        self.bus = bus if bus is not None else create_bus()
+        self.worker_id = uuid.uuid4().hex[:12]
+        self._owners = {}          # {room_id: (持有者, 缓存到期时间)}
+        self._owned = set()        # 本进程持有租约的房间
+        self._alive = {}           # {worker_id: 最后心跳时间（毫秒）}
+        self._alive_checked = 0.0
+        # 持有者按顺序应用编辑并发布结果，保证其他进程收到的事件与版本顺序一致
+        self._order_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._started = False
+        self.forwarded = 0         # 转发给其他进程的请求数
+        self.remote_events = 0     # 收到的其他进程的广播数
+
+        self.bus.subscribe(BROADCAST_CHANNEL, self._on_broadcast)
+        self.bus.subscribe(worker_channel(self.worker_id), self._on_direct)
+
+    @property
+    def distributed(self):
+        return self.bus.distributed
+
+    def start(self):
+        """启动总线订阅和心跳（首个连接加入时调用，可重复调用）"""
+        if self._started or not self.distributed:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            self._heartbeat_once()
+            self.bus.start(self.socketio.start_background_task)
+            self.socketio.start_background_task(self._heartbeat)
+            self._started = True
+
+    def _ordered(self):
+        return self._order_lock if self.distributed else contextlib.nullcontext()
+
+    # ==================== 心跳与归属 ====================
+
+    def _heartbeat(self):
+        while True:
+            self.socketio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                self._heartbeat_once()
+            except Exception as e:
+                event_log.error('cluster_heartbeat_failed', '心跳失败: {error}', error=str(e))
+
+    def _heartbeat_once(self):
+        self.bus.hset(WORKERS_KEY, self.worker_id, int(time.time() * 1000))
+        self.bus.hset(CONNECTIONS_KEY, self.worker_id, len(self.presence))
+        self._refresh_alive()
+
+        # 续期仍在内存中的文档的租约，已移出内存的文档让租约自然过期
+        loaded = set(self.room_store.room_ids())
+        for room_id in list(self._owned):
+            key = owner_key(room_id)
+            if room_id in loaded and self.bus.get(key) == self.worker_id:
+                self.bus.pexpire(key, OWNER_LEASE_MS)
+            else:
+                self._owned.discard(room_id)
+                self._owners.pop(room_id, None)
+
+    def _refresh_alive(self):
+        now_ms = time.time() * 1000
+        alive = {}
+        expired = []
+        for worker_id, beat in self.bus.hgetall(WORKERS_KEY).items():
+            beat = int(beat)
+            alive[worker_id] = beat
+            if now_ms - beat > WORKER_TIMEOUT * 1000 * 10:
+                expired.append(worker_id)
+        if expired:
+            self.bus.hdel(WORKERS_KEY, *expired)
+            self.bus.hdel(CONNECTIONS_KEY, *expired)
+        self._alive = alive
+        self._alive_checked = time.monotonic()
+
+    def is_alive(self, worker_id):
+        """进程是否仍有心跳（未知进程先刷新一次，避免误判刚启动的进程）"""
+        if worker_id == self.worker_id:
+            return True
+        if worker_id not in self._alive and time.monotonic() - self._alive_checked > 0.1:
+            self._refresh_alive()
+        beat = self._alive.get(worker_id)
+        return beat is not None and time.time() * 1000 - beat < WORKER_TIMEOUT * 1000
+
+    def owns(self, room_id):
+        """本进程是否持有房间文档（不查询总线）"""
+        return not self.distributed or room_id in self._owned
+
+    def owner_of(self, room_id, refresh=False):
+        """房间文档的持有进程，无人持有或持有者失联时由本进程接管"""
+        if not self.distributed:
+            return self.worker_id
+
+        now = time.monotonic()
+        cached = self._owners.get(room_id)
+        if cached and cached[1] > now and not refresh:
+            return cached[0]
+
+        key = owner_key(room_id)
+        owner = None
+        for _ in range(3):
+            owner = self.bus.get(key)
+            if owner is not None and not self.is_alive(owner):
+                event_log.warning('cluster_takeover', '进程 {owner} 已失联，接管房间 {room}', owner=owner, room=room_id)
+                self.bus.delete(key)
+                owner = None
+            if owner is None and self.bus.set(key, self.worker_id, nx=True, px=OWNER_LEASE_MS):
+                owner = self.worker_id
+            if owner is not None:
+                break
+
+        if owner == self.worker_id:
+            self._owned.add(room_id)
+        self._owners[room_id] = (owner, now + HEARTBEAT_INTERVAL)
+        return owner
+
+    def _forward(self, owner, message):
+        self.forwarded += 1
+        message.setdefault('hops', 0)
+        self.bus.publish(worker_channel(owner), message)
+
+    # ==================== 事件广播 ====================
+
+    def broadcast(self, event, data, room_id, skip_sid=None):
+        """发送给房间内所有进程上的连接"""
+        self.outbound.broadcast(event, data, room_id, skip_sid=skip_sid)
+        if self.distributed:
+            self.bus.publish(BROADCAST_CHANNEL, {
+                'origin': self.worker_id,
+                'event': event,
+                'data': data,
+                'room': room_id,
+                'skip_sid': skip_sid
+            })
+
+    def emit_to(self, worker_id, sid, event, data):
+        """发送给指定进程上的单个连接"""
+        if worker_id == self.worker_id:
+            self.outbound.send(sid, event, data)
+        else:
+            self.bus.publish(worker_channel(worker_id), {'type': 'emit', 'sid': sid, 'event': event, 'data': data})
+
+    def _on_broadcast(self, message):
+        if message.get('origin') == self.worker_id:
+            return
+        self.remote_events += 1
+        if message.get('control') == 'evict':
+            self.room_store.evict(message['room'])
+            return
+        if message.get('control') == 'room':
+            if self.room_cache is not None:
+                self.room_cache.invalidate(message['room'])
+            return
+        self.outbound.broadcast(message['event'], message['data'], message['room'], skip_sid=message.get('skip_sid'))
+
+    def _on_direct(self, message):
+        kind = message.get('type')
+        if kind == 'emit':
+            self.outbound.send(message['sid'], message['event'], message['data'])
+            return
+
+        room_id = message['room']
+        if room_id not in self._owned:
+            owner = self.owner_of(room_id, refresh=True)
+            if owner != self.worker_id:
+                # 归属已变化，转发给新的持有者
+                if message['hops'] < MAX_FORWARD_HOPS:
+                    message['hops'] += 1
+                    self._forward(owner, message)
+                return
+
+        if kind == 'open':
+            self._open(room_id, message['origin'], message['sid'], message.get('legacy', False))
+        elif kind == 'release':
+            self.room_store.release(room_id, message.get('legacy', False))
+        elif kind == 'ops':
+            self._apply_ops(room_id, message['origin'], message['sid'], message['username'],
+                            message['base_version'], message['ops'])
+        elif kind == 'full':
+            self._set_content(room_id, message['origin'], message['sid'], message['username'],
+                              message['content'], message['timestamp'])
+
+    # ==================== 在线成员 ====================
+
+    def add_member(self, member):
+        if self.distributed:
+            self.bus.hset(members_key(member.room), member.member_id, json.dumps({
+                'id': member.member_id,
+                'username': member.username,
+                'worker': self.worker_id,
+                'ops': member.ops,
+                'joined': time.time()
+            }, ensure_ascii=False))
+
+    def remove_member(self, member):
+        if self.distributed:
+            self.bus.hdel(members_key(member.room), member.member_id)
+
+    def members(self, room_id):
+        """房间内所有进程上的成员 [{'id', 'username'}]，按加入顺序"""
+        if not self.distributed:
+            return self.presence.members(room_id)
+
+        entries = []
+        stale = []
+        for member_id, raw in self.bus.hgetall(members_key(room_id)).items():
+            info = json.loads(raw)
+            if self.is_alive(info['worker']):
+                entries.append(info)
+            else:
+                stale.append(member_id)
+        if stale:
+            self.bus.hdel(members_key(room_id), *stale)
+        entries.sort(key=lambda info: info['joined'])
+        return [{'id': info['id'], 'username': info['username']} for info in entries]
+
+    def has_legacy_members(self, room_id):
+        """房间内（所有进程上）是否有只支持全量内容的旧客户端，它们的成员事件需要附带完整的 users 列表"""
+        if not self.distributed:
+            return self.presence.has_legacy(room_id)
+        for raw in self.bus.hgetall(members_key(room_id)).values():
+            info = json.loads(raw)
+            if not info.get('ops') and self.is_alive(info['worker']):
+                return True
+        return False
+
+    def count(self, room_id):
+        if not self.distributed:
+            return self.presence.count(room_id)
+        return len(self.members(room_id))
+
+    def room_counts(self, room_ids):
+        """指定房间在所有进程上的在线人数"""
+        if not self.distributed:
+            counts = self.presence.room_counts()
+            return {room_id: counts.get(room_id, 0) for room_id in room_ids}
+        return {room_id: len(self.members(room_id)) for room_id in room_ids}
+
+    def online_total(self):
+        """所有进程的在线连接数（其他进程的数量在心跳时更新）"""
+        if not self.distributed:
+            return len(self.presence)
+        total = len(self.presence)
+        for worker_id, count in self.bus.hgetall(CONNECTIONS_KEY).items():
+            if worker_id != self.worker_id and self.is_alive(worker_id):
+                total += int(count)
+        return total
+
+    def usernames(self, room_id):
+        if not self.distributed:
+            return self.presence.usernames(room_id)
+        return [m['username'] for m in self.members(room_id)]
+
+    # ==================== 文档 ====================
+
+    def open_document(self, room_id, sid, legacy=False):
+        """
+        连接加入房间后发送 init_content（由文档持有者发送，保证与后续操作的顺序）
+        legacy 表示连接只支持全量内容，持有者据此决定是否为增量操作附带广播 content_update
+        """
+        owner = self.owner_of(room_id)
+        if owner == self.worker_id:
+            self._open(room_id, self.worker_id, sid, legacy)
+        else:
+            self._forward(owner, {'type': 'open', 'room': room_id, 'origin': self.worker_id, 'sid': sid,
+                                  'legacy': legacy})
+
+    def release_document(self, room_id, legacy=False):
+        owner = self.owner_of(room_id)
+        if owner == self.worker_id:
+            self.room_store.release(room_id, legacy)
+        else:
+            self._forward(owner, {'type': 'release', 'room': room_id, 'legacy': legacy})
+
+    def evict_document(self, room_id):
+        """丢弃所有进程中的房间文档（房间被删除时使用）"""
+        self.room_store.evict(room_id)
+        if self.distributed:
+            self.bus.publish(BROADCAST_CHANNEL, {'origin': self.worker_id, 'control': 'evict', 'room': room_id})
+            self.bus.delete(owner_key(room_id))
+
+    def room_changed(self, room_id):
+        """房间被创建、修改密码或删除后，让所有进程丢弃缓存的房间元数据"""
+        if self.room_cache is not None:
+            self.room_cache.invalidate(room_id)
+        if self.distributed:
+            self.bus.publish(BROADCAST_CHANNEL, {'origin': self.worker_id, 'control': 'room', 'room': room_id})
+
+    def submit_ops(self, room_id, sid, username, base_version, ops):
+        """提交增量操作，由持有者应用后确认并广播（ops 为 None 表示校验失败，只要求重新同步）"""
+        owner = self.owner_of(room_id)
+        if owner == self.worker_id:
+            self._apply_ops(room_id, self.worker_id, sid, username, base_version, ops)
+        else:
+            self._forward(owner, {
+                'type': 'ops', 'room': room_id, 'origin': self.worker_id, 'sid': sid,
+                'username': username, 'base_version': base_version, 'ops': ops
+            })
+
+    def submit_content(self, room_id, sid, username, content, timestamp):
+        """提交全量内容，由持有者替换后广播"""
+        owner = self.owner_of(room_id)
+        if owner == self.worker_id:
+            self._set_content(room_id, self.worker_id, sid, username, content, timestamp)
+        else:
+            self._forward(owner, {
+                'type': 'full', 'room': room_id, 'origin': self.worker_id, 'sid': sid,
+                'username': username, 'content': content, 'timestamp': timestamp
+            })
+
+    def _open(self, room_id, origin, sid, legacy=False):
+        with self._ordered():
+            content, version = self.room_store.open(room_id, legacy)
+            self.emit_to(origin, sid, 'init_content', {'content': content, 'version': version})
+
+    def _apply_ops(self, room_id, origin, sid, username, base_version, ops):
+        with self._ordered():
+            try:
+                if ops is None:
+                    raise ot.OperationError('缺少基准版本号或操作格式错误')
+                result = self.room_store.apply_ops(room_id, base_version, ops)
+            except ot.OperationError as e:
+                event_log.warning('content_op_invalid', '房间 {room} - {user} 的编辑操作无效: {error}',
+                                  room=room_id, sid=sid, user=username, error=str(e))
+                result = None
+
+            if result is None:
+                # 基准版本过旧或操作无效，发送全量内容让客户端重新同步。
+                # rejected 表示这组操作没有被应用，客户端把它变换到全量内容之后重新发送
+                content, version = self.room_store.snapshot(room_id)
+                self.emit_to(origin, sid, 'content_resync', {'content': content, 'version': version, 'rejected': True})
+                return
+
+            version, applied, content = result
+
+            # 确认发送者的操作，并只向其他用户广播操作本身
+            self.emit_to(origin, sid, 'content_ack', {'version': version})
+            self.broadcast('content_op', {
+                'ops': applied,
+                'version': version,
+                'username': username
+            }, room_id, skip_sid=sid)
+            # 房间内有只支持全量内容的旧客户端时，另外向它们发送应用后的完整内容
+            if content is not None:
+                self.broadcast('content_update', {
+                    'content': content,
+                    'version': version,
+                    'username': username,
+                    'timestamp': datetime.now().isoformat()
+                }, legacy_room(room_id))
+
+    def _set_content(self, room_id, origin, sid, username, content, timestamp):
+        with self._ordered():
+            version = self.room_store.set_content(room_id, content)
+            self.broadcast('content_update', {
+                'content': content,
+                'version': version,
+                'username': username,
+                'timestamp': timestamp
+            }, room_id, skip_sid=sid)
+
+    def stats(self):
+        return {
+            'worker_id': self.worker_id,
+            'distributed': self.distributed,
+            'workers': sum(1 for w in self._alive if self.is_alive(w)) if self.distributed else 1,
+            'owned_rooms': len(self._owned) if self.distributed else len(self.room_store.room_ids()),
+            'forwarded': self.forwarded,
+            'remote_events': self.remote_events
+        }
@@ -0,0 +1,89 @@
+"""
+光标位置合并广播
+光标移动很频繁，逐条广播时每次移动都要发给房间内所有其他连接。
+这里每个房间只保留每个用户最新的位置，每个周期合并为一条 cursor_batch 发送；
+没有光标移动的房间不产生任何开销，后台任务在没有待发送数据时阻塞等待
+"""
+import os
+import threading
+
+from eventlog import event_log
+
+# 合并周期（毫秒）
+CURSOR_TICK_MS = int(os.environ.get('NETCLIP_CURSOR_TICK_MS', '30'))
+
+
+class CursorBatcher:
+    """按房间合并光标位置，周期性批量发送"""
+
+    def __init__(self, send, recipients, tick=CURSOR_TICK_MS / 1000):
+        self._send = send              # send(room_id, payload) 发送一批光标
+        self._recipients = recipients  # recipients(room_id) 本进程房间内的连接数
+        self.tick = tick
+        self._pending = {}             # {room_id: [本周期移动次数, {member_id: 光标}]}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.received = 0              # 收到的光标移动次数
+        self.collapsed = 0             # 被同一周期内更新的位置覆盖的次数
+        self.batches = 0               # 发送的 cursor_batch 数
+        self.messages_sent = 0         # 实际发出的消息数（批次 × 接收连接数）
+        self.messages_saved = 0        # 相比逐条广播节省的消息数
+
+    def update(self, room_id, member_id, username, position):
+        """记录用户的最新光标位置"""
+        with self._lock:
+            entry = self._pending.setdefault(room_id, [0, {}])
+            if member_id in entry[1]:
+                self.collapsed += 1
+            entry[0] += 1
+            entry[1][member_id] = {'id': member_id, 'username': username, 'position': position}
+            self.received += 1
+        self._wakeup.set()
+
+    def discard(self, room_id, member_id):
+        """用户离开房间时丢弃尚未发送的位置"""
+        with self._lock:
+            entry = self._pending.get(room_id)
+            if entry is not None:
+                entry[1].pop(member_id, None)
+
+    def flush(self):
+        """发送所有待发送的光标，返回发送的批次数"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._wakeup.clear()
+        sent = 0
+        for room_id, (moves, cursors) in pending.items():
+            if not cursors:
+                continue
+            self._send(room_id, {'cursors': list(cursors.values())})
+            sent += 1
+            # 逐条广播时每次移动发给除自己外的所有连接，合并后每个周期发给所有连接一次
+            recipients = self._recipients(room_id)
+            with self._lock:
+                self.batches += 1
+                self.messages_sent += recipients
+                self.messages_saved += max(moves * max(recipients - 1, 0) - recipients, 0)
+        return sent
+
+    def run(self, sleep):
+        """后台任务：有光标移动时等待一个周期再合并发送"""
+        while True:
+            self._wakeup.wait()
+            sleep(self.tick)
+            try:
+                self.flush()
+            except Exception as e:
+                event_log.error('cursor_send_failed', '发送光标失败: {error}', error=str(e))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tick_ms': round(self.tick * 1000),
+                'received': self.received,
+                'collapsed': self.collapsed,
+                'batches': self.batches,
+                'messages_sent': self.messages_sent,
+                'messages_saved': self.messages_saved,
+                'pending_rooms': len(self._pending)
+            }
@@ -5,108 +5,287 @@
 import sqlite3
 import hashlib
 import os
+import secrets
+from contextlib import contextmanager
 from datetime import datetime
 
+import metrics
+import runtime
+from profiling import profiler
+
 DATABASE_FILE = 'collab.db'
 
+# 连接池配置
+DB_POOL_SIZE = int(os.environ.get('NETCLIP_DB_POOL_SIZE', '8'))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('NETCLIP_DB_BUSY_TIMEOUT_MS', '5000'))
+DB_CACHE_SIZE_KB = int(os.environ.get('NETCLIP_DB_CACHE_SIZE_KB', '8192'))
+DB_STATEMENT_CACHE = 256  # 每个连接缓存的预编译语句数
+
 def get_db():
-    """获取数据库连接"""
-    conn = sqlite3.connect(DATABASE_FILE)
+    """创建新的数据库连接（WAL 模式，已设置性能参数）"""
+    conn = sqlite3.connect(
+        DATABASE_FILE,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,  # 连接由连接池在线程间复用
+        cached_statements=DB_STATEMENT_CACHE
+    )
     conn.row_factory = sqlite3.Row  # 使结果可以像字典一样访问
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store = MEMORY')
     return conn
 
-def init_db():
-    """初始化数据库"""
-    conn = get_db()
-    cursor = conn.cursor()
+class ConnectionPool:
+    """
+    SQLite 连接池，连接长期复用以保留预编译语句缓存
+    连接用尽时临时创建新连接（归还时关闭），借还不会阻塞，协程模式下可在原生线程池中使用
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = []
+        self._lock = runtime.native_lock()
+        self._path = DATABASE_FILE
+        self.overflow = 0  # 池中连接用尽时临时创建的连接数
+
+    def acquire(self):
+        """借出一个连接"""
+        with self._lock:
+            if self._path != DATABASE_FILE:
+                # 数据库文件路径变化（如测试或基准切换数据库）时重建连接池
+                self._close_idle()
+            if self._idle:
+                return self._idle.pop()
+        return get_db()
+
+    def release(self, conn):
+        """归还连接，池已满时关闭"""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if self._path == DATABASE_FILE and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+            self.overflow += 1
+        conn.close()
 
-    # 创建房间表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS rooms (
-            room_id TEXT PRIMARY KEY,
-            password_hash TEXT,
-            created_at TEXT,
-            content TEXT DEFAULT ''
-        )
-    ''')
+    def _close_idle(self):
+        for conn in self._idle:
+            conn.close()
+        self._idle.clear()
+        self._path = DATABASE_FILE
 
-    # 创建用户会话表（用于密码记忆）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_sessions (
-            session_id TEXT PRIMARY KEY,
-            room_id TEXT,
-            password TEXT,
-            created_at TEXT,
-            FOREIGN KEY (room_id) REFERENCES rooms (room_id)
-        )
-    ''')
+    def close_all(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            self._close_idle()
 
-    # 创建文件表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS files (
-            file_id TEXT PRIMARY KEY,
-            room_id TEXT NOT NULL,
-            filename TEXT NOT NULL,
-            original_filename TEXT NOT NULL,
-            file_size INTEGER NOT NULL,
-            uploaded_at TEXT NOT NULL,
-            description TEXT,
-            FOREIGN KEY (room_id) REFERENCES rooms (room_id)
-        )
-    ''')
-
-    # 检查是否需要为现有files表添加room_id列
-    cursor.execute("PRAGMA table_info(files)")
-    columns = [column[1] for column in cursor.fetchall()]
-
-    if 'room_id' not in columns:
-        print("添加room_id列到files表...")
-        cursor.execute("ALTER TABLE files ADD COLUMN room_id TEXT")
-        cursor.execute("UPDATE files SET room_id = 'default' WHERE room_id IS NULL")
-        conn.commit()
-
-    # 创建默认public房间（如果不存在）
-    cursor.execute('SELECT room_id FROM rooms WHERE room_id = ?', ('public',))
-    if not cursor.fetchone():
-        print("创建默认public房间...")
-        cursor.execute('''
-            INSERT OR IGNORE INTO rooms (room_id, password_hash, created_at, content)
-            VALUES (?, ?, ?, ?)
-        ''', ('public', None, datetime.now().isoformat(), ''))
+_pool = ConnectionPool(DB_POOL_SIZE)
+
+@contextmanager
+def connection():
+    """从连接池借用连接，写操作使用 `with conn:` 提交事务"""
+    conn = _pool.acquire()
+    try:
+        yield conn
+    finally:
+        _pool.release(conn)
+
+def close_pool():
+    """关闭连接池中的连接"""
+    _pool.close_all()
 
-    conn.commit()
-    conn.close()
+def init_db():
+    """初始化数据库"""
+    with connection() as conn, conn:
+        cursor = conn.cursor()
 
-def create_room(room_id, password=None):
-    """创建房间"""
-    conn = get_db()
-    cursor = conn.cursor()
+        # 创建房间表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rooms (
+                room_id TEXT PRIMARY KEY,
+                password_hash TEXT,
+                created_at TEXT,
+                content TEXT DEFAULT '',
+                password_epoch INTEGER NOT NULL DEFAULT 0,
+                ttl_seconds INTEGER
+            )
+        ''')
+
+        # 创建服务配置表（如多进程共享的房间令牌签名密钥）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        ''')
 
+        # 用户会话表（旧版本用于保存明文密码，已改为签名令牌，见 room_tokens.py）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_sessions (
+                session_id TEXT PRIMARY KEY,
+                room_id TEXT,
+                password TEXT,
+                created_at TEXT,
+                FOREIGN KEY (room_id) REFERENCES rooms (room_id)
+            )
+        ''')
+
+        # 创建文件表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                file_id TEXT PRIMARY KEY,
+                room_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                original_filename TEXT NOT NULL,
+                file_size INTEGER NOT NULL,
+                uploaded_at TEXT NOT NULL,
+                description TEXT,
+                FOREIGN KEY (room_id) REFERENCES rooms (room_id)
+            )
+        ''')
+
+        # 创建断点续传上传会话表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                upload_id TEXT PRIMARY KEY,
+                room_id TEXT NOT NULL,
+                original_filename TEXT NOT NULL,
+                mime_type TEXT,
+                description TEXT,
+                total_size INTEGER NOT NULL,
+                received INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+
+        # 创建内容寻址存储表（files/ 和 images/ 下的实际文件及其引用计数）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                digest TEXT,
+                size INTEGER NOT NULL,
+                refcount INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                referenced_at TEXT,
+                PRIMARY KEY (kind, name)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced ON blobs (kind) WHERE refcount <= 0')
+
+        # 创建房间历史版本表：定期保存压缩的全文（checkpoint），其余版本保存相对上一版本的压缩差异（delta）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS room_revisions (
+                room_id TEXT NOT NULL,
+                revision INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored INTEGER NOT NULL,
+                chain INTEGER NOT NULL,
+                chain_bytes INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (room_id, revision)
+            )
+        ''')
+
+        # 检查是否需要为现有files表添加room_id列
+        cursor.execute("PRAGMA table_info(files)")
+        columns = [column[1] for column in cursor.fetchall()]
+
+        if 'room_id' not in columns:
+            print("添加room_id列到files表...")
+            cursor.execute("ALTER TABLE files ADD COLUMN room_id TEXT")
+            cursor.execute("UPDATE files SET room_id = 'default' WHERE room_id IS NULL")
+
+        # 房间密码版本：每次修改密码时更换，之前签发的房间令牌随之失效。
+        # 使用随机值而不是递增计数，删除后重建的同名房间不会接受旧令牌
+        cursor.execute("PRAGMA table_info(rooms)")
+        if 'password_epoch' not in [column[1] for column in cursor.fetchall()]:
+            print("添加password_epoch列到rooms表...")
+            cursor.execute("ALTER TABLE rooms ADD COLUMN password_epoch INTEGER NOT NULL DEFAULT 0")
+            for (room_id,) in cursor.execute('SELECT room_id FROM rooms').fetchall():
+                cursor.execute('UPDATE rooms SET password_epoch = ? WHERE room_id = ?', (new_password_epoch(), room_id))
+
+        # 房间过期时间：设置后无活动超过该时长（秒）的房间由后台清理任务删除，NULL 表示永久保留
+        cursor.execute("PRAGMA table_info(rooms)")
+        if 'ttl_seconds' not in [column[1] for column in cursor.fetchall()]:
+            print("添加ttl_seconds列到rooms表...")
+            cursor.execute("ALTER TABLE rooms ADD COLUMN ttl_seconds INTEGER")
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rooms_ttl ON rooms (room_id) WHERE ttl_seconds IS NOT NULL')
+
+        # 不再保存明文密码，清除旧版本留下的会话密码
+        cursor.execute('DELETE FROM user_sessions')
+
+        # 文件列表按上传时间倒序分页，(uploaded_at, file_id) 作为游标，索引覆盖排序和游标条件
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_room_uploaded ON files (room_id, uploaded_at, file_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_uploaded ON files (uploaded_at, file_id)')
+        # 按 blob 名称统计引用（删除房间时释放引用、后台核对引用计数）
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_filename ON files (filename)')
+        # 管理后台的房间概览按创建时间倒序分页
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rooms_created ON rooms (created_at, room_id)')
+
+        # 旧版本按上传单独命名的文件登记为无摘要的 blob，删除时同样按引用计数处理
+        cursor.execute('''
+            INSERT OR IGNORE INTO blobs (kind, name, digest, size, refcount, created_at)
+            SELECT 'file', filename, NULL, MAX(file_size), COUNT(*), MIN(uploaded_at)
+            FROM files
+            WHERE filename NOT IN (SELECT name FROM blobs WHERE kind = 'file')
+            GROUP BY filename
+        ''')
+
+        # 创建默认public房间（如果不存在）
+        cursor.execute('SELECT room_id FROM rooms WHERE room_id = ?', ('public',))
+        if not cursor.fetchone():
+            print("创建默认public房间...")
+            cursor.execute('''
+                INSERT OR IGNORE INTO rooms (room_id, password_hash, created_at, content, password_epoch)
+                VALUES (?, ?, ?, ?, ?)
+            ''', ('public', None, datetime.now().isoformat(), '', new_password_epoch()))
+
+def hash_room_password(password):
+    """房间密码哈希"""
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def new_password_epoch():
+    """生成新的房间密码版本"""
+    return secrets.randbits(31) + 1
+
+def get_or_create_setting(key, create):
+    """读取配置项，不存在时以 create() 的值写入（多个进程同时写入时以先写入的为准）"""
+    with connection() as conn, conn:
+        conn.execute('INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)', (key, create()))
+        return conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()['value']
+
+def create_room(room_id, password=None, ttl_seconds=None):
+    """创建房间，ttl_seconds 为无活动后自动删除的时长（秒），None 表示永久保留"""
     password_hash = None
     if password:
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
+        password_hash = hash_room_password(password)
 
     try:
-        cursor.execute('''
-            INSERT INTO rooms (room_id, password_hash, created_at, content)
-            VALUES (?, ?, ?, ?)
-        ''', (room_id, password_hash, datetime.now().isoformat(), ''))
-        conn.commit()
-        conn.close()
+        with connection() as conn, conn:
+            conn.execute('''
+                INSERT INTO rooms (room_id, password_hash, created_at, content, password_epoch, ttl_seconds)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (room_id, password_hash, datetime.now().isoformat(), '', new_password_epoch(), ttl_seconds))
         return True
     except sqlite3.IntegrityError:
         # 房间已存在
-        conn.close()
         return False
 
 def verify_room_password(room_id, password):
     """验证房间密码"""
-    conn = get_db()
-    cursor = conn.cursor()
+    return _verify_room_password(room_id, password)
 
-    cursor.execute('SELECT password_hash FROM rooms WHERE room_id = ?', (room_id,))
-    result = cursor.fetchone()
-    conn.close()
+def _verify_room_password(room_id, password):
+    with connection() as conn:
+        result = conn.execute('SELECT password_hash FROM rooms WHERE room_id = ?', (room_id,)).fetchone()
 
     if result is None:
         return False
@@ -119,116 +298,118 @@ def verify_room_password(room_id, password):
         # 私密房间但未提供密码
         return False
 
-    password_hash = hashlib.sha256(password.encode()).hexdigest()
+    password_hash = hash_room_password(password)
     return result['password_hash'] == password_hash
 
+def get_room_meta(room_id):
+    """获取房间元数据（不含内容），房间不存在时返回 None"""
+    with connection() as conn:
+        result = conn.execute('''
+            SELECT room_id, password_hash, password_epoch, created_at FROM rooms WHERE room_id = ?
+        ''', (room_id,)).fetchone()
+
+    return dict(result) if result else None
+
 def get_room(room_id):
     """获取房间信息"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT * FROM rooms WHERE room_id = ?', (room_id,))
-    result = cursor.fetchone()
-    conn.close()
+    with connection() as conn:
+        result = conn.execute('SELECT * FROM rooms WHERE room_id = ?', (room_id,)).fetchone()
 
     return dict(result) if result else None
 
 def save_room_content(room_id, content):
     """保存房间内容"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute('UPDATE rooms SET content = ? WHERE room_id = ?', (content, room_id))
-    conn.commit()
-    conn.close()
+    with connection() as conn, conn:
+        conn.execute('UPDATE rooms SET content = ? WHERE room_id = ?', (content, room_id))
+
+def save_room_contents(items):
+    """
+    批量保存房间内容，items 为 (room_id, content) 列表，在同一事务中提交
+    返回实际存在并已保存的房间 ID（已被删除的房间不会写入）
+    """
+    saved = []
+    with connection() as conn, conn:
+        for room_id, content in items:
+            if conn.execute('UPDATE rooms SET content = ? WHERE room_id = ?', (content, room_id)).rowcount:
+                saved.append(room_id)
+    return saved
 
 def get_room_content(room_id):
     """获取房间内容"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT content FROM rooms WHERE room_id = ?', (room_id,))
-    result = cursor.fetchone()
-    conn.close()
+    with connection() as conn:
+        result = conn.execute('SELECT content FROM rooms WHERE room_id = ?', (room_id,)).fetchone()
 
     return result['content'] if result else ''
 
-def set_session_password(session_id, room_id, password):
-    """保存用户密码会话"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        INSERT OR REPLACE INTO user_sessions (session_id, room_id, password, created_at)
-        VALUES (?, ?, ?, ?)
-    ''', (session_id, room_id, password, datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
-
-def get_session_password(session_id, room_id):
-    """获取用户密码会话"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT password FROM user_sessions
-        WHERE session_id = ? AND room_id = ?
-    ''', (session_id, room_id))
-    result = cursor.fetchone()
-    conn.close()
-
-    return result['password'] if result else None
-
 def delete_session(session_id):
     """删除用户会话"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute('DELETE FROM user_sessions WHERE session_id = ?', (session_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn, conn:
+        conn.execute('DELETE FROM user_sessions WHERE session_id = ?', (session_id,))
 
 def reset_room_password(room_id, old_password, new_password):
     """重置房间密码"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    # 验证旧密码
-    if not verify_room_password(room_id, old_password):
-        conn.close()
+    # 验证旧密码（调用未包装的实现，耗时只按本函数统计一次）
+    if not _verify_room_password(room_id, old_password):
         return False
 
+    return _set_room_password(room_id, new_password)
+
+def admin_reset_room_password(room_id, new_password):
+    """直接设置房间新密码（管理员功能，无需旧密码），房间不存在时返回 False"""
+    return _set_room_password(room_id, new_password)
+
+def _set_room_password(room_id, new_password):
     # 设置新密码
     new_password_hash = None
     if new_password:
-        new_password_hash = hashlib.sha256(new_password.encode()).hexdigest()
-
-    cursor.execute('UPDATE rooms SET password_hash = ? WHERE room_id = ?', (new_password_hash, room_id))
-    conn.commit()
-    conn.close()
+        new_password_hash = hash_room_password(new_password)
 
-    # 清除所有保存的密码会话
-    delete_all_room_sessions(room_id)
+    with connection() as conn, conn:
+        # 同时更换密码版本，使之前签发的房间令牌失效
+        cursor = conn.execute('UPDATE rooms SET password_hash = ?, password_epoch = ? WHERE room_id = ?',
+                              (new_password_hash, new_password_epoch(), room_id))
+        if cursor.rowcount == 0:
+            return False
 
     return True
 
+def set_room_ttl(room_id, ttl_seconds):
+    """设置房间无活动后自动删除的时长（秒），None 表示永久保留，房间不存在时返回 False"""
+    with connection() as conn, conn:
+        cursor = conn.execute('UPDATE rooms SET ttl_seconds = ? WHERE room_id = ?', (ttl_seconds, room_id))
+    return cursor.rowcount > 0
+
+def get_room_contents(after='', limit=100):
+    """按房间 ID 分批获取房间内容 [(room_id, content)]"""
+    with connection() as conn:
+        results = conn.execute('''
+            SELECT room_id, content FROM rooms WHERE room_id > ? ORDER BY room_id LIMIT ?
+        ''', (after, limit)).fetchall()
+    return [(row['room_id'], row['content']) for row in results]
+
+def get_expiring_rooms():
+    """设置了过期时间的房间 [{room_id, ttl_seconds, last_activity}]，最后活动时间同 get_rooms_overview"""
+    with connection() as conn:
+        results = conn.execute('''
+            SELECT room_id, ttl_seconds,
+                   MAX(created_at,
+                       COALESCE((SELECT MAX(uploaded_at) FROM files WHERE files.room_id = rooms.room_id), ''),
+                       COALESCE((SELECT created_at FROM room_revisions r WHERE r.room_id = rooms.room_id
+                                 ORDER BY revision DESC LIMIT 1), '')) AS last_activity
+            FROM rooms
+            WHERE ttl_seconds IS NOT NULL
+        ''').fetchall()
+    return [dict(row) for row in results]
+
 def delete_all_room_sessions(room_id):
     """删除房间的所有会话"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute('DELETE FROM user_sessions WHERE room_id = ?', (room_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn, conn:
+        conn.execute('DELETE FROM user_sessions WHERE room_id = ?', (room_id,))
 
 def get_all_rooms():
     """获取所有房间信息（管理员功能）"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT room_id, password_hash, created_at FROM rooms ORDER BY created_at DESC')
-    results = cursor.fetchall()
-    conn.close()
+    with connection() as conn:
+        results = conn.execute('SELECT room_id, password_hash, created_at FROM rooms ORDER BY created_at DESC').fetchall()
 
     rooms = []
     for row in results:
@@ -240,42 +421,96 @@ def get_all_rooms():
 
     return rooms
 
+def get_rooms_overview(limit=50, after=None):
+    """
+    按创建时间倒序分页获取房间概览：文件数、文件总大小、内容长度和最后活动时间
+    （创建、上传文件、内容写回中最晚的一个），after 为上一页最后一个房间的 (created_at, room_id)。
+    只对当前页的房间做聚合，返回 (房间列表, 下一页游标或 None)
+    """
+    condition = 'WHERE (created_at, room_id) < (?, ?)' if after is not None else ''
+    params = (*after, limit + 1) if after is not None else (limit + 1,)
+
+    with connection() as conn:
+        results = conn.execute(f'''
+            WITH page AS (
+                SELECT room_id, password_hash, created_at, ttl_seconds, length(content) AS content_length
+                FROM rooms {condition}
+                ORDER BY created_at DESC, room_id DESC
+                LIMIT ?
+            ),
+            room_files AS (
+                SELECT room_id, COUNT(*) AS file_count, SUM(file_size) AS file_bytes, MAX(uploaded_at) AS last_upload
+                FROM files
+                WHERE room_id IN (SELECT room_id FROM page)
+                GROUP BY room_id
+            )
+            SELECT page.room_id, page.password_hash IS NULL AS is_public, page.created_at, page.ttl_seconds,
+                   page.content_length,
+                   COALESCE(room_files.file_count, 0) AS file_count,
+                   COALESCE(room_files.file_bytes, 0) AS file_bytes,
+                   MAX(COALESCE(page.created_at, ''), COALESCE(room_files.last_upload, ''), COALESCE((
+                       SELECT created_at FROM room_revisions
+                       WHERE room_revisions.room_id = page.room_id
+                       ORDER BY revision DESC LIMIT 1
+                   ), '')) AS last_activity
+            FROM page LEFT JOIN room_files USING (room_id)
+            ORDER BY page.created_at DESC, page.room_id DESC
+        ''', params).fetchall()
+
+    rooms = []
+    for row in results[:limit]:
+        room = dict(row)
+        room['is_public'] = bool(room['is_public'])
+        rooms.append(room)
+    next_after = None
+    if len(results) > limit:
+        last = results[limit - 1]
+        next_after = (last['created_at'], last['room_id'])
+    return rooms, next_after
+
+def get_overview_totals():
+    """管理后台统计：房间数、公开房间数、文件数和文件总大小"""
+    with connection() as conn:
+        result = conn.execute('''
+            SELECT (SELECT COUNT(*) FROM rooms) AS rooms,
+                   (SELECT COUNT(*) FROM rooms WHERE password_hash IS NULL) AS public_rooms,
+                   (SELECT COUNT(*) FROM files) AS files,
+                   (SELECT COALESCE(SUM(file_size), 0) FROM files) AS file_bytes
+        ''').fetchone()
+
+    totals = dict(result)
+    totals['private_rooms'] = totals['rooms'] - totals['public_rooms']
+    return totals
+
 def delete_room(room_id):
     """删除房间"""
     # 不能删除默认public房间
     if room_id == 'public':
         return False
 
-    conn = get_db()
-    cursor = conn.cursor()
+    with connection() as conn, conn:
+        cursor = conn.cursor()
 
-    # 检查房间是否存在
-    cursor.execute('SELECT room_id FROM rooms WHERE room_id = ?', (room_id,))
-    result = cursor.fetchone()
-
-    if not result:
-        conn.close()
-        return False
+        # 检查房间是否存在
+        cursor.execute('SELECT room_id FROM rooms WHERE room_id = ?', (room_id,))
+        result = cursor.fetchone()
 
-    # 删除房间相关的会话
-    cursor.execute('DELETE FROM user_sessions WHERE room_id = ?', (room_id,))
+        if not result:
+            return False
 
-    # 删除房间的文件
-    cursor.execute('SELECT filename FROM files WHERE room_id = ?', (room_id,))
-    files = cursor.fetchall()
+        # 删除房间相关的会话
+        cursor.execute('DELETE FROM user_sessions WHERE room_id = ?', (room_id,))
 
-    for file_row in files:
-        file_path = os.path.join('..', 'files', file_row['filename'])
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        # 删除房间的文件记录，实际文件在引用计数归零后由 blob_store.collect() 删除
+        _release_room_blobs(cursor, room_id)
+        cursor.execute('DELETE FROM files WHERE room_id = ?', (room_id,))
 
-    cursor.execute('DELETE FROM files WHERE room_id = ?', (room_id,))
+        # 删除房间历史版本
+        cursor.execute('DELETE FROM room_revisions WHERE room_id = ?', (room_id,))
 
-    # 删除房间
-    cursor.execute('DELETE FROM rooms WHERE room_id = ?', (room_id,))
+        # 删除房间
+        cursor.execute('DELETE FROM rooms WHERE room_id = ?', (room_id,))
 
-    conn.commit()
-    conn.close()
     return True
 
 if __name__ == '__main__':
@@ -287,88 +522,439 @@ if __name__ == '__main__':
 
 def add_file(file_id, room_id, filename, original_filename, file_size, description=''):
     """添加文件记录"""
-    conn = get_db()
-    cursor = conn.cursor()
-
     try:
-        cursor.execute('''
-            INSERT INTO files (file_id, room_id, filename, original_filename, file_size, uploaded_at, description)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (file_id, room_id, filename, original_filename, file_size, datetime.now().isoformat(), description))
-        conn.commit()
-        conn.close()
+        with connection() as conn, conn:
+            conn.execute('''
+                INSERT INTO files (file_id, room_id, filename, original_filename, file_size, uploaded_at, description)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (file_id, room_id, filename, original_filename, file_size, datetime.now().isoformat(), description))
         return True
     except sqlite3.IntegrityError:
-        conn.close()
         return False
 
-def get_all_files(room_id=None):
-    """获取所有文件列表，可按房间过滤"""
-    conn = get_db()
-    cursor = conn.cursor()
+# 文件列表的完整字段和精简字段（精简模式用于只需要展示名称、大小和时间的列表）
+FILE_COLUMNS = ('file_id', 'room_id', 'filename', 'original_filename', 'file_size', 'uploaded_at', 'description')
+FILE_LITE_COLUMNS = ('file_id', 'original_filename', 'file_size', 'uploaded_at')
 
+def _file_filters(room_id, extensions, min_size, max_size):
+    """文件列表的过滤条件，扩展名只允许字母和数字（由调用方校验）"""
+    conditions = []
+    params = []
     if room_id:
-        cursor.execute('SELECT * FROM files WHERE room_id = ? ORDER BY uploaded_at DESC', (room_id,))
-    else:
-        cursor.execute('SELECT * FROM files ORDER BY uploaded_at DESC')
-    results = cursor.fetchall()
-    conn.close()
-
-    files = []
-    for row in results:
-        files.append({
-            'file_id': row['file_id'],
-            'room_id': row['room_id'],
-            'filename': row['filename'],
-            'original_filename': row['original_filename'],
-            'file_size': row['file_size'],
-            'uploaded_at': row['uploaded_at'],
-            'description': row['description']
-        })
-
-    return files
+        conditions.append('room_id = ?')
+        params.append(room_id)
+    if extensions:
+        conditions.append('(' + ' OR '.join('original_filename LIKE ?' for _ in extensions) + ')')
+        params.extend(f'%.{ext}' for ext in extensions)
+    if min_size is not None:
+        conditions.append('file_size >= ?')
+        params.append(min_size)
+    if max_size is not None:
+        conditions.append('file_size <= ?')
+        params.append(max_size)
+    return conditions, params
+
+def list_files(room_id=None, limit=50, after=None, extensions=None, min_size=None, max_size=None, lite=False):
+    """
+    按上传时间倒序分页获取文件列表，可按房间、扩展名和大小范围过滤
+    after 为上一页最后一个文件的 (uploaded_at, file_id)，返回 (文件列表, 下一页游标或 None)
+    """
+    conditions, params = _file_filters(room_id, extensions, min_size, max_size)
+    if after is not None:
+        conditions.append('(uploaded_at, file_id) < (?, ?)')
+        params.extend(after)
+    columns = FILE_LITE_COLUMNS if lite else FILE_COLUMNS
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    with connection() as conn:
+        results = conn.execute(f'''
+            SELECT {', '.join(columns)} FROM files {where}
+            ORDER BY uploaded_at DESC, file_id DESC
+            LIMIT ?
+        ''', (*params, limit + 1)).fetchall()
+
+    files = [dict(row) for row in results[:limit]]
+    next_after = None
+    if len(results) > limit:
+        last = results[limit - 1]
+        next_after = (last['uploaded_at'], last['file_id'])
+    return files, next_after
+
+def count_files(room_id=None, extensions=None, min_size=None, max_size=None):
+    """符合过滤条件的文件数和总大小"""
+    conditions, params = _file_filters(room_id, extensions, min_size, max_size)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    with connection() as conn:
+        result = conn.execute(f'SELECT COUNT(*), COALESCE(SUM(file_size), 0) FROM files {where}', params).fetchone()
+    return result[0], result[1]
 
 def get_file(file_id):
     """获取文件信息"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT * FROM files WHERE file_id = ?', (file_id,))
-    result = cursor.fetchone()
-    conn.close()
+    with connection() as conn:
+        result = conn.execute('SELECT * FROM files WHERE file_id = ?', (file_id,)).fetchone()
 
     return dict(result) if result else None
 
 def delete_file(file_id):
-    """删除文件记录"""
-    conn = get_db()
-    cursor = conn.cursor()
+    """删除文件记录并释放对应 blob 的一次引用"""
+    with connection() as conn, conn:
+        row = conn.execute('SELECT filename FROM files WHERE file_id = ?', (file_id,)).fetchone()
+        if row is None:
+            return False
+        conn.execute('DELETE FROM files WHERE file_id = ?', (file_id,))
+        conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE kind = 'file' AND name = ?", (row['filename'],))
+    return True
 
-    cursor.execute('SELECT file_id FROM files WHERE file_id = ?', (file_id,))
-    result = cursor.fetchone()
+def delete_room_files(room_id):
+    """删除房间的所有文件记录并释放对应 blob 的引用"""
+    with connection() as conn, conn:
+        cursor = conn.cursor()
+        _release_room_blobs(cursor, room_id)
+        cursor.execute('DELETE FROM files WHERE room_id = ?', (room_id,))
+
+def _release_room_blobs(cursor, room_id):
+    """按房间内的引用次数减少 blob 引用计数，需在删除 files 记录之前、同一事务内调用"""
+    cursor.execute('''
+        UPDATE blobs
+        SET refcount = refcount - (
+            SELECT COUNT(*) FROM files WHERE files.room_id = ? AND files.filename = blobs.name
+        )
+        WHERE kind = 'file' AND name IN (SELECT filename FROM files WHERE room_id = ?)
+    ''', (room_id, room_id))
+
+# ==================== 内容寻址存储 ====================
+
+def acquire_blob(kind, name, digest, size):
+    """登记一次 blob 引用（不存在时创建），返回新的引用计数"""
+    now = datetime.now().isoformat()
+    with connection() as conn, conn:
+        row = conn.execute('''
+            INSERT INTO blobs (kind, name, digest, size, refcount, created_at, referenced_at)
+            VALUES (?, ?, ?, ?, 1, ?, ?)
+            ON CONFLICT (kind, name) DO UPDATE SET refcount = MAX(refcount, 0) + 1, referenced_at = excluded.referenced_at
+            RETURNING refcount
+        ''', (kind, name, digest, size, now, now)).fetchone()
+    return row['refcount']
+
+def release_blob(kind, name):
+    """释放一次 blob 引用"""
+    with connection() as conn, conn:
+        conn.execute('UPDATE blobs SET refcount = refcount - 1 WHERE kind = ? AND name = ?', (kind, name))
+
+def get_unreferenced_blobs(limit=500):
+    """获取引用计数已归零的 blob [(kind, name)]"""
+    with connection() as conn:
+        results = conn.execute('SELECT kind, name FROM blobs WHERE refcount <= 0 LIMIT ?', (limit,)).fetchall()
+    return [(row['kind'], row['name']) for row in results]
+
+def delete_unreferenced_blob(kind, name):
+    """删除仍未被引用的 blob 记录，返回是否删除（期间被重新引用时返回 False）"""
+    with connection() as conn, conn:
+        cursor = conn.execute('DELETE FROM blobs WHERE kind = ? AND name = ? AND refcount <= 0', (kind, name))
+        return cursor.rowcount > 0
+
+def count_unreferenced_blobs():
+    """等待删除的 blob 数"""
+    with connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM blobs WHERE refcount <= 0').fetchone()[0]
+
+def get_existing_blobs(kind, names):
+    """names 中已登记的 blob 名称"""
+    if not names:
+        return set()
+    with connection() as conn:
+        results = conn.execute(f'''
+            SELECT name FROM blobs WHERE kind = ? AND name IN ({', '.join('?' for _ in names)})
+        ''', (kind, *names)).fetchall()
+    return {row['name'] for row in results}
+
+def get_referenced_filenames(names):
+    """names 中仍被 files 记录引用的文件名"""
+    if not names:
+        return set()
+    with connection() as conn:
+        results = conn.execute(f'''
+            SELECT DISTINCT filename FROM files WHERE filename IN ({', '.join('?' for _ in names)})
+        ''', names).fetchall()
+    return {row['filename'] for row in results}
+
+def get_file_blob_refcounts(after='', limit=500):
+    """按名称分批获取文件 blob 的 [(name, 引用计数, files 中的实际引用数)]"""
+    with connection() as conn:
+        results = conn.execute('''
+            SELECT name, refcount, (SELECT COUNT(*) FROM files WHERE files.filename = blobs.name) AS actual
+            FROM blobs
+            WHERE kind = 'file' AND name > ?
+            ORDER BY name
+            LIMIT ?
+        ''', (after, limit)).fetchall()
+    return [(row['name'], row['refcount'], row['actual']) for row in results]
+
+def correct_blob_refcount(kind, name, expected, refcount):
+    """引用计数仍为 expected 时改为 refcount，返回是否修改"""
+    with connection() as conn, conn:
+        cursor = conn.execute('UPDATE blobs SET refcount = ? WHERE kind = ? AND name = ? AND refcount = ?',
+                              (refcount, kind, name, expected))
+        return cursor.rowcount > 0
+
+def touch_blobs(kind, names, now):
+    """记录 blob 仍被引用（referenced_at 更新为 now）"""
+    names = list(names)
+    with connection() as conn, conn:
+        for start in range(0, len(names), 500):
+            batch = names[start:start + 500]
+            conn.execute(f'''
+                UPDATE blobs SET referenced_at = ?
+                WHERE kind = ? AND refcount > 0 AND name IN ({', '.join('?' for _ in batch)})
+            ''', (now, kind, *batch))
+
+def release_stale_blobs(kind, before):
+    """释放最近一次被引用早于 before（ISO 时间字符串）的 blob，返回释放的数量"""
+    with connection() as conn, conn:
+        cursor = conn.execute('''
+            UPDATE blobs SET refcount = 0
+            WHERE kind = ? AND refcount > 0 AND COALESCE(referenced_at, created_at) < ?
+        ''', (kind, before))
+        return cursor.rowcount
+
+def get_blob_stats():
+    """按类型统计被引用的 blob：实际文件数和字节数、引用数和逻辑字节数"""
+    with connection() as conn:
+        results = conn.execute('''
+            SELECT kind,
+                   COUNT(*) AS blobs,
+                   COALESCE(SUM(size), 0) AS stored_bytes,
+                   COALESCE(SUM(refcount), 0) AS refs,
+                   COALESCE(SUM(size * refcount), 0) AS logical_bytes
+            FROM blobs
+            WHERE refcount > 0
+            GROUP BY kind
+        ''').fetchall()
+
+    return {row['kind']: {
+        'blobs': row['blobs'],
+        'stored_bytes': row['stored_bytes'],
+        'references': row['refs'],
+        'logical_bytes': row['logical_bytes']
+    } for row in results}
+
+# ==================== 房间历史版本 ====================
+
+REVISION_COLUMNS = 'room_id, revision, kind, created_at, size, stored, chain, chain_bytes, digest, data'
+
+def get_latest_revision(room_id):
+    """获取房间最新版本的元数据（不含数据）"""
+    with connection() as conn:
+        result = conn.execute('''
+            SELECT revision, kind, created_at, size, chain, chain_bytes, digest FROM room_revisions
+            WHERE room_id = ? ORDER BY revision DESC LIMIT 1
+        ''', (room_id,)).fetchone()
 
-    if not result:
-        conn.close()
+    return dict(result) if result else None
+
+def add_revision(row):
+    """
+    写入一个版本，row 为按 REVISION_COLUMNS 顺序的元组
+    版本号已存在或房间已被删除时返回 False（删除房间后仍在途的写回不会留下历史版本）
+    """
+    try:
+        with connection() as conn, conn:
+            cursor = conn.execute(f'''
+                INSERT INTO room_revisions ({REVISION_COLUMNS})
+                SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM rooms WHERE room_id = ?)
+            ''', (*row, row[0]))
+        return cursor.rowcount > 0
+    except sqlite3.IntegrityError:
         return False
 
-    cursor.execute('DELETE FROM files WHERE file_id = ?', (file_id,))
-    conn.commit()
-    conn.close()
-    return True
+def list_revisions(room_id, limit=50, before=None):
+    """按版本号倒序列出房间历史版本（不含数据），before 为上一页最后一个版本号"""
+    with connection() as conn:
+        results = conn.execute('''
+            SELECT revision, kind, created_at, size, stored FROM room_revisions
+            WHERE room_id = ? AND revision < ?
+            ORDER BY revision DESC LIMIT ?
+        ''', (room_id, before if before is not None else 2 ** 62, limit)).fetchall()
+
+    return [dict(row) for row in results]
+
+def get_revision_chain(room_id, revision):
+    """获取重建指定版本所需的行：不晚于该版本的最近 checkpoint 及之后到该版本的 delta，按版本号升序"""
+    with connection() as conn:
+        results = conn.execute('''
+            SELECT revision, kind, created_at, size, digest, data FROM room_revisions
+            WHERE room_id = ? AND revision <= ? AND revision >= (
+                SELECT MAX(revision) FROM room_revisions
+                WHERE room_id = ? AND revision <= ? AND kind = 'checkpoint'
+            )
+            ORDER BY revision
+        ''', (room_id, revision, room_id, revision)).fetchall()
+
+    return [dict(row) for row in results]
+
+def get_revisions_before(room_id, before):
+    """获取 created_at 早于 before 的全部版本（含数据），按版本号升序"""
+    with connection() as conn:
+        results = conn.execute(f'''
+            SELECT {REVISION_COLUMNS} FROM room_revisions
+            WHERE room_id = ? AND created_at < ?
+            ORDER BY revision
+        ''', (room_id, before)).fetchall()
+
+    return [dict(row) for row in results]
+
+def get_revisions(room_id):
+    """获取房间的全部版本（含数据），按版本号升序"""
+    with connection() as conn:
+        results = conn.execute(f'''
+            SELECT {REVISION_COLUMNS} FROM room_revisions WHERE room_id = ? ORDER BY revision
+        ''', (room_id,)).fetchall()
+
+    return [dict(row) for row in results]
+
+def get_revision_rooms(after='', limit=100):
+    """按房间 ID 分批获取有历史版本的房间 [(room_id, 最新版本号, 版本数)]"""
+    with connection() as conn:
+        results = conn.execute('''
+            SELECT room_id, MAX(revision) AS latest, COUNT(*) AS revisions FROM room_revisions
+            WHERE room_id > ? GROUP BY room_id ORDER BY room_id LIMIT ?
+        ''', (after, limit)).fetchall()
+
+    return [(row['room_id'], row['latest'], row['revisions']) for row in results]
+
+def get_next_revision_kind(room_id, revision):
+    """获取指定版本之后下一个版本的类型，没有时返回 None"""
+    with connection() as conn:
+        result = conn.execute('''
+            SELECT kind FROM room_revisions WHERE room_id = ? AND revision > ?
+            ORDER BY revision LIMIT 1
+        ''', (room_id, revision)).fetchone()
+
+    return result['kind'] if result else None
+
+def get_compactable_revision_rooms(hourly_before, daily_before):
+    """
+    获取可以精简历史版本的房间：created_at 早于 hourly_before 的版本按小时分组，
+    早于 daily_before 的按天分组，存在多于一个版本的分组即可精简
+    """
+    with connection() as conn:
+        results = conn.execute('''
+            SELECT DISTINCT room_id FROM (
+                SELECT room_id FROM room_revisions
+                WHERE created_at < ?
+                GROUP BY room_id, CASE WHEN created_at < ? THEN substr(created_at, 1, 10)
+                                       ELSE substr(created_at, 1, 13) END
+                HAVING COUNT(*) > 1
+            )
+        ''', (hourly_before, daily_before)).fetchall()
+
+    return [row['room_id'] for row in results]
+
+def replace_revisions(room_id, upto_revision, rows):
+    """在同一事务中用 rows 替换房间版本号不超过 upto_revision 的全部版本"""
+    with connection() as conn, conn:
+        conn.execute('DELETE FROM room_revisions WHERE room_id = ? AND revision <= ?', (room_id, upto_revision))
+        conn.executemany(f'INSERT INTO room_revisions ({REVISION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+def get_revision_stats():
+    """历史版本统计：版本数、checkpoint 数、实际占用字节数和全文字节数"""
+    with connection() as conn:
+        result = conn.execute('''
+            SELECT COUNT(DISTINCT room_id) AS rooms,
+                   COUNT(*) AS revisions,
+                   COALESCE(SUM(kind = 'checkpoint'), 0) AS checkpoints,
+                   COALESCE(SUM(stored), 0) AS stored_bytes,
+                   COALESCE(SUM(size), 0) AS logical_bytes
+            FROM room_revisions
+        ''').fetchone()
+
+    return dict(result)
+
+# ==================== 断点续传上传会话 ====================
+
+def create_upload_session(upload_id, room_id, original_filename, mime_type, total_size, description=''):
+    """创建上传会话"""
+    now = datetime.now().isoformat()
+    with connection() as conn, conn:
+        conn.execute('''
+            INSERT INTO upload_sessions (upload_id, room_id, original_filename, mime_type, description,
+                                         total_size, received, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)
+        ''', (upload_id, room_id, original_filename, mime_type, description, total_size, now, now))
+
+def get_upload_session(upload_id):
+    """获取上传会话"""
+    with connection() as conn:
+        result = conn.execute('SELECT * FROM upload_sessions WHERE upload_id = ?', (upload_id,)).fetchone()
 
-def delete_room_files(room_id):
-    """删除房间的所有文件"""
-    conn = get_db()
-    cursor = conn.cursor()
+    return dict(result) if result else None
 
-    cursor.execute('SELECT filename FROM files WHERE room_id = ?', (room_id,))
-    files = cursor.fetchall()
+def update_upload_progress(upload_id, received):
+    """更新已接收的字节数（只增不减），返回更新后的值"""
+    with connection() as conn, conn:
+        conn.execute('''
+            UPDATE upload_sessions SET received = MAX(received, ?), updated_at = ?
+            WHERE upload_id = ?
+        ''', (received, datetime.now().isoformat(), upload_id))
+        result = conn.execute('SELECT received FROM upload_sessions WHERE upload_id = ?', (upload_id,)).fetchone()
+
+    return result['received'] if result else None
+
+def delete_upload_session(upload_id):
+    """删除上传会话"""
+    with connection() as conn, conn:
+        cursor = conn.execute('DELETE FROM upload_sessions WHERE upload_id = ?', (upload_id,))
+        return cursor.rowcount > 0
+
+def claim_upload_session(upload_id, room_id):
+    """
+    领取已接收完整的上传会话：删除并返回会话记录，同一会话被并发完成时只有一个请求能领取到
+    会话不存在、不属于该房间或尚未接收完整时返回 None
+    """
+    with connection() as conn, conn:
+        result = conn.execute('''
+            DELETE FROM upload_sessions
+            WHERE upload_id = ? AND room_id = ? AND received >= total_size
+            RETURNING *
+        ''', (upload_id, room_id)).fetchone()
 
-    for file_row in files:
-        file_path = os.path.join('..', 'files', file_row['filename'])
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    return dict(result) if result else None
 
-    cursor.execute('DELETE FROM files WHERE room_id = ?', (room_id,))
-    conn.commit()
-    conn.close()
+def get_expired_upload_sessions(before):
+    """获取 updated_at 早于 before（ISO 时间字符串）的上传会话"""
+    with connection() as conn:
+        results = conn.execute('SELECT * FROM upload_sessions WHERE updated_at < ?', (before,)).fetchall()
+
+    return [dict(row) for row in results]
+
+# ==================== 耗时统计与协程运行时 ====================
+
+# 访问数据库的公开函数。连接管理（connection、close_pool、init_db）和不访问数据库的辅助函数
+# （hash_room_password、new_password_epoch）不在其中；模块内部互相调用时使用下划线开头的未包装实现，
+# 避免重复统计耗时和再次切换线程
+_DB_FUNCTIONS = (
+    'get_or_create_setting',
+    'create_room', 'verify_room_password', 'get_room_meta', 'get_room', 'save_room_content', 'save_room_contents',
+    'get_room_content', 'delete_session', 'reset_room_password', 'admin_reset_room_password', 'set_room_ttl',
+    'get_room_contents', 'get_expiring_rooms', 'delete_all_room_sessions', 'get_all_rooms', 'get_rooms_overview',
+    'get_overview_totals', 'delete_room',
+    'add_file', 'list_files', 'count_files', 'get_file', 'delete_file', 'delete_room_files',
+    'acquire_blob', 'release_blob', 'get_unreferenced_blobs', 'delete_unreferenced_blob', 'count_unreferenced_blobs',
+    'get_existing_blobs', 'get_referenced_filenames', 'get_file_blob_refcounts', 'correct_blob_refcount',
+    'touch_blobs', 'release_stale_blobs', 'get_blob_stats',
+    'get_latest_revision', 'add_revision', 'list_revisions', 'get_revision_chain', 'get_revisions_before',
+    'get_revisions', 'get_revision_rooms', 'get_next_revision_kind', 'get_compactable_revision_rooms',
+    'replace_revisions', 'get_revision_stats',
+    'create_upload_session', 'get_upload_session', 'update_upload_progress', 'delete_upload_session',
+    'claim_upload_session', 'get_expired_upload_sessions',
+)
+
+# 记录公开的数据库函数的耗时（见 metrics.py），并登记为可剖析的调用（见 profiling.py）
+for _name in _DB_FUNCTIONS:
+    globals()[_name] = metrics.timed(metrics.DB_CALL_SECONDS, _name)(profiler.traced('db', _name)(globals()[_name]))
+
+# gevent/eventlet 模式下 sqlite3 调用会阻塞事件循环，公开的数据库函数改为在原生线程池中执行
+# （在耗时统计之外包装，统计的是原生线程中的执行时间，不含排队等待）
+if runtime.COOPERATIVE:
+    for _name in _DB_FUNCTIONS:
+        globals()[_name] = runtime.blocking(globals()[_name])
@@ -0,0 +1,225 @@
+"""
+结构化事件日志
+Socket.IO 事件处理中直接 print 会在每次按键时同步写控制台（输出通常还被重定向到 server.log），
+连接多时控制台写入成为所有处理线程共同等待的串行点。这里的日志调用只做三件事：
+- 按级别过滤：NETCLIP_LOG_LEVEL 为全局阈值，NETCLIP_LOG_EVENTS 可单独调整某个事件的级别或关闭
+- 高频事件按每秒条数采样，被丢弃的条数附在该事件下一条记录的 suppressed 字段中
+- 将事件名、消息模板和字段放入有界队列，队列满时丢弃并计数，从不阻塞
+消息模板的格式化和写出由一个原生线程完成（协程模式下也不占用事件循环），默认每行一个 JSON 对象：
+    {"ts": "...", "level": "INFO", "event": "join", "msg": "...", "room": "...", "sid": "...", "size": 12}
+"""
+import atexit
+import json
+import os
+import sys
+import time
+from collections import deque
+from datetime import datetime
+
+import runtime
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+LEVELS = {'DEBUG': DEBUG, 'INFO': INFO, 'WARNING': WARNING, 'ERROR': ERROR, 'OFF': OFF}
+LEVEL_NAMES = {value: name for name, value in LEVELS.items()}
+
+
+def parse_level(name):
+    """级别名称（不区分大小写）对应的数值"""
+    try:
+        return LEVELS[name.strip().upper()]
+    except KeyError:
+        raise ValueError(f'不支持的日志级别: {name}，可选 {", ".join(LEVELS)}') from None
+
+
+def parse_pairs(text, convert):
+    """解析 "事件=值,事件=值" 形式的配置"""
+    result = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        event, _, value = item.partition('=')
+        result[event.strip()] = convert(value)
+    return result
+
+
+# 全局级别阈值，低于该级别的事件不记录
+LOG_LEVEL = parse_level(os.environ.get('NETCLIP_LOG_LEVEL', 'INFO'))
+# 单独调整事件的级别，如 "content_change=DEBUG,cursor_move=INFO"，OFF 表示不记录
+LOG_EVENT_LEVELS = parse_pairs(os.environ.get('NETCLIP_LOG_EVENTS', ''), parse_level)
+# 高频事件每秒最多记录的条数，如 "content_change=5"，0 表示不采样
+LOG_SAMPLE_RATES = {
+    'content_change': 10,
+    'content_op': 10,
+    'cursor_move': 1,
+    'slow_call': 10,
+    **parse_pairs(os.environ.get('NETCLIP_LOG_SAMPLE', ''), int)
+}
+# 输出格式：json（每行一个 JSON 对象）或 text（便于开发时阅读）
+LOG_FORMAT = os.environ.get('NETCLIP_LOG_FORMAT', 'json').lower()
+# 写入的文件，未设置时写到标准输出
+LOG_FILE = os.environ.get('NETCLIP_LOG_FILE', '')
+# 队列中最多等待写出的记录数
+LOG_QUEUE_SIZE = int(os.environ.get('NETCLIP_LOG_QUEUE_SIZE', '10000'))
+# 写出线程在队列为空时的等待间隔（毫秒）
+LOG_FLUSH_MS = int(os.environ.get('NETCLIP_LOG_FLUSH_MS', '100'))
+# 写出线程每次最多合并写出的记录数
+LOG_WRITE_BATCH = 1000
+
+if LOG_FORMAT not in ('json', 'text'):
+    raise ValueError(f'不支持的 NETCLIP_LOG_FORMAT: {LOG_FORMAT}，可选 json、text')
+
+
+class EventLog:
+    """事件日志：调用方只入队，由后台原生线程格式化并写出"""
+
+    def __init__(self, level=LOG_LEVEL, event_levels=LOG_EVENT_LEVELS, sample_rates=LOG_SAMPLE_RATES,
+                 fmt=LOG_FORMAT, path=LOG_FILE, queue_size=LOG_QUEUE_SIZE):
+        self.level = level
+        self.event_levels = dict(event_levels)
+        self.sample_rates = {event: rate for event, rate in sample_rates.items() if rate > 0}
+        self.format = fmt
+        self.path = path
+        self.queue_size = queue_size
+        self._queue = deque()   # [(时间戳, 级别, 事件, 消息模板, 字段)]
+        self._windows = {}      # 采样窗口 {事件: [秒, 本秒已记录条数, 尚未报告的丢弃条数]}
+        self._lock = runtime.native_lock()
+        self._started = False
+        self._output = None
+        self.written = 0        # 已写出的记录数
+        self.dropped = 0        # 队列已满时丢弃的记录数
+        self.suppressed = 0     # 采样丢弃的记录数
+        self.errors = 0         # 写出失败次数
+
+    # ==================== 记录 ====================
+
+    def enabled(self, event, level=INFO):
+        """事件在该级别下是否会被记录（用于跳过代价较高的字段计算）"""
+        level = self.event_levels.get(event, level)
+        return self.level <= level < OFF
+
+    def log(self, level, event, msg, **fields):
+        """
+        记录事件。msg 为 str.format 模板，在写出线程中用 fields 填充，
+        调用方不必预先格式化字符串；fields 同时作为 JSON 字段输出
+        """
+        level = self.event_levels.get(event, level)
+        if not self.level <= level < OFF:
+            return
+        now = time.time()
+
+        rate = self.sample_rates.get(event)
+        if rate is not None:
+            second = int(now)
+            window = self._windows.get(event)
+            if window is None:
+                window = self._windows[event] = [second, 0, 0]
+            elif window[0] != second:
+                window[0], window[1] = second, 0
+            if window[1] >= rate:
+                window[2] += 1
+                self.suppressed += 1
+                return
+            window[1] += 1
+            if window[2]:
+                fields['suppressed'] = window[2]
+                window[2] = 0
+
+        if len(self._queue) >= self.queue_size:
+            self.dropped += 1
+            return
+        self._queue.append((now, level, event, msg, fields))
+        if not self._started:
+            self._start()
+
+    def debug(self, event, msg, **fields):
+        self.log(DEBUG, event, msg, **fields)
+
+    def info(self, event, msg, **fields):
+        self.log(INFO, event, msg, **fields)
+
+    def warning(self, event, msg, **fields):
+        self.log(WARNING, event, msg, **fields)
+
+    def error(self, event, msg, **fields):
+        self.log(ERROR, event, msg, **fields)
+
+    # ==================== 写出 ====================
+
+    def _start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        atexit.register(self.flush)
+        runtime.native_thread(self._run)
+
+    def _format(self, timestamp, level, event, msg, fields):
+        try:
+            text = msg.format(**fields) if fields else msg
+        except (KeyError, IndexError, ValueError):
+            text = msg
+        moment = datetime.fromtimestamp(timestamp)
+        if self.format == 'text':
+            line = f"{moment.isoformat(sep=' ', timespec='milliseconds')} {LEVEL_NAMES[level]} [{event}] {text}"
+            if 'suppressed' in fields:
+                line += f" (此前 {fields['suppressed']} 条未记录)"
+            return line
+        record = {
+            'ts': moment.isoformat(timespec='milliseconds'),
+            'level': LEVEL_NAMES[level],
+            'event': event,
+            'msg': text,
+            **fields
+        }
+        return json.dumps(record, ensure_ascii=False, default=str)
+
+    def _stream(self):
+        if self._output is None:
+            self._output = open(self.path, 'a', encoding='utf-8') if self.path else sys.stdout
+        return self._output
+
+    def flush(self):
+        """写出队列中的全部记录，返回写出的条数"""
+        total = 0
+        while True:
+            lines = []
+            while self._queue and len(lines) < LOG_WRITE_BATCH:
+                lines.append(self._format(*self._queue.popleft()))
+            if not lines:
+                return total
+            try:
+                stream = self._stream()
+                stream.write('\n'.join(lines) + '\n')
+                stream.flush()
+            except Exception:
+                self.errors += 1
+                return total
+            total += len(lines)
+            self.written += len(lines)
+
+    def _run(self):
+        """写出线程（原生线程）"""
+        while True:
+            if not self.flush():
+                runtime.native_sleep(LOG_FLUSH_MS / 1000)
+
+    def stats(self):
+        return {
+            'level': LEVEL_NAMES[self.level],
+            'format': self.format,
+            'event_levels': {event: LEVEL_NAMES[level] for event, level in self.event_levels.items()},
+            'sample_rates': self.sample_rates,
+            'queued': len(self._queue),
+            'queue_size': self.queue_size,
+            'written': self.written,
+            'dropped': self.dropped,
+            'suppressed': self.suppressed,
+            'errors': self.errors
+        }
+
+
+# 全局实例
+event_log = EventLog()
@@ -0,0 +1,227 @@
+"""
+文件响应
+为下载和图片提供 Range（含多段）、If-Range、ETag/If-None-Match 支持。
+完整响应和单段响应在服务器提供 wsgi.file_wrapper 时交给它发送（如 gunicorn 通过 os.sendfile 零拷贝发送），
+否则按块读取
+"""
+import mimetypes
+import os
+import unicodedata
+import uuid
+from urllib.parse import quote
+
+from flask import Response, request
+from werkzeug.http import http_date, parse_date
+
+import runtime
+
+# 读取文件的块大小
+FILE_CHUNK_SIZE = 256 * 1024
+# 单个请求允许的最大区间数，超出时忽略 Range 返回完整内容
+MAX_RANGES = 16
+
+# 内容不可变的资源（以 uuid 或摘要命名）的缓存策略
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# 可能被删除的资源，每次使用前通过 ETag 重新验证
+REVALIDATE_CACHE_CONTROL = 'private, no-cache'
+
+
+def parse_byte_ranges(header, length):
+    """
+    解析 Range 请求头，返回 [(start, stop)]（stop 不包含）
+    格式错误或区间过多时返回 None（按规范忽略 Range），全部区间不可满足时返回 []
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+
+    ranges = []
+    for spec in header[len('bytes='):].split(','):
+        spec = spec.strip()
+        if not spec or '-' not in spec:
+            return None
+        first, _, last = spec.partition('-')
+        first, last = first.strip(), last.strip()
+        try:
+            if not first:
+                # 后缀区间：最后 N 个字节
+                suffix = int(last)
+                if suffix <= 0:
+                    continue
+                start, stop = max(length - suffix, 0), length
+            else:
+                start = int(first)
+                stop = int(last) + 1 if last else length
+                if start < 0 or (last and stop <= start):
+                    return None
+                stop = min(stop, length)
+        except ValueError:
+            return None
+        if start < length:
+            ranges.append((start, stop))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    # 合并重叠或相邻的区间
+    ranges.sort()
+    merged = []
+    for start, stop in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def etag_matches(header, etag):
+    """If-None-Match 比较（弱比较）"""
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in header.split(',')]
+    return any(tag.removeprefix('W/') == etag for tag in candidates)
+
+
+def _if_range_matches(header, etag, mtime):
+    """If-Range 校验：ETag 需强匹配，日期需与最后修改时间一致"""
+    header = header.strip()
+    if header.startswith('"') or header.startswith('W/'):
+        return header == etag
+    date = parse_date(header)
+    return date is not None and int(date.timestamp()) == int(mtime)
+
+
+def _content_disposition(download_name):
+    """生成附件下载头，非 ASCII 文件名使用 RFC 5987 编码"""
+    try:
+        download_name.encode('ascii')
+        return f'attachment; filename="{download_name}"'
+    except UnicodeEncodeError:
+        fallback = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        fallback = fallback.replace('"', '') or 'download'
+        return f'attachment; filename="{fallback}"; filename*=UTF-8\'\'{quote(download_name, safe="")}'
+
+
+def _read_range(path, start, stop):
+    """按块读取文件的一个区间（协程模式下在原生线程中读取，不阻塞事件循环）"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = runtime.offload(f.read, min(FILE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class _FileRange:
+    """
+    文件中间的一个区间，交给 wsgi.file_wrapper 按块读取，恰好读出区间内的字节
+    不提供 fileno()：服务器的原生 sendfile 会一直发送到文件末尾
+    """
+
+    def __init__(self, f, start, stop):
+        f.seek(start)
+        self._file = f
+        self._remaining = stop - start
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        chunk = runtime.offload(self._file.read, size) if size else b''
+        self._remaining -= len(chunk)
+        return chunk
+
+    def close(self):
+        self._file.close()
+
+
+def _file_body(path, start, length):
+    """
+    文件内容响应体，都恰好发送 length 个字节
+    服务器提供 wsgi.file_wrapper 时交给它发送：到文件末尾为止的响应传入文件本身，服务器可以用原生 sendfile 发送，
+    中间的区间只能按块读取；没有 wsgi.file_wrapper 时按块读取
+    """
+    if request.method == 'HEAD' or length == 0:
+        return ()
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is None:
+        return _read_range(path, start, start + length)
+    f = open(path, 'rb')
+    if start + length == os.fstat(f.fileno()).st_size:
+        f.seek(start)
+        return file_wrapper(f, FILE_CHUNK_SIZE)
+    return file_wrapper(_FileRange(f, start, start + length), FILE_CHUNK_SIZE)
+
+
+def send_stored_file(path, etag, mimetype=None, download_name=None, cache_control=REVALIDATE_CACHE_CONTROL):
+    """
+    发送磁盘上的文件
+    etag 为不带引号的实体标签（基于文件元数据），download_name 不为空时作为附件下载
+    """
+    stat = os.stat(path)
+    length = stat.st_size
+    etag = f'"{etag}"'
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(download_name or path)[0] or 'application/octet-stream'
+
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': cache_control
+    }
+    if download_name:
+        headers['Content-Disposition'] = _content_disposition(download_name)
+
+    # 缓存验证
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers=headers)
+
+    ranges = None
+    range_header = request.headers.get('Range')
+    if range_header and request.method in ('GET', 'HEAD'):
+        if_range = request.headers.get('If-Range')
+        if not if_range or _if_range_matches(if_range, etag, stat.st_mtime):
+            ranges = parse_byte_ranges(range_header, length)
+
+    if ranges is None:
+        headers['Content-Length'] = str(length)
+        return Response(_file_body(path, 0, length), status=200, headers=headers,
+                        mimetype=mimetype, direct_passthrough=True)
+
+    if not ranges:
+        headers['Content-Range'] = f'bytes */{length}'
+        return Response(status=416, headers=headers)
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{length}'
+        headers['Content-Length'] = str(stop - start)
+        return Response(_file_body(path, start, stop - start), status=206, headers=headers,
+                        mimetype=mimetype, direct_passthrough=True)
+
+    # 多段区间：multipart/byteranges
+    boundary = uuid.uuid4().hex
+    parts = []
+    body_length = 0
+    for start, stop in ranges:
+        part_header = (f'\r\n--{boundary}\r\n'
+                       f'Content-Type: {mimetype}\r\n'
+                       f'Content-Range: bytes {start}-{stop - 1}/{length}\r\n\r\n').encode('ascii')
+        parts.append((part_header, start, stop))
+        body_length += len(part_header) + stop - start
+    closing = f'\r\n--{boundary}--\r\n'.encode('ascii')
+    body_length += len(closing)
+
+    def generate():
+        for part_header, start, stop in parts:
+            yield part_header
+            yield from _read_range(path, start, stop)
+        yield closing
+
+    headers['Content-Length'] = str(body_length)
+    return Response(generate(), status=206, headers=headers,
+                    content_type=f'multipart/byteranges; boundary={boundary}', direct_passthrough=True)
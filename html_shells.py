@@ -0,0 +1,111 @@
+"""
+HTML 页面缓存
+tuieditor.html / admin.html 只在启动或文件变化时读取一次，同时生成 gzip 和 brotli
+压缩版本，按 Accept-Encoding 协商返回，并支持 ETag / If-None-Match
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+from flask import Response, request
+
+from file_responses import etag_matches, REVALIDATE_CACHE_CONTROL
+
+try:
+    import brotli
+except ImportError:  # brotli 已列在 requirements.txt 中，缺失时退回只提供 gzip
+    brotli = None
+
+# 开发模式：每次请求检查文件修改时间，修改后自动重新加载
+DEV_RELOAD = os.environ.get('NETCLIP_DEV_RELOAD', '').lower() in ('1', 'true', 'yes')
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# 优先使用压缩率更高的编码
+ENCODING_PREFERENCE = ('br', 'gzip')
+
+
+class HtmlShell:
+    """单个页面的内存副本及其压缩版本"""
+    __slots__ = ('path', 'mtime', 'variants', 'etag')
+
+    def __init__(self, path, body, mtime):
+        self.path = path
+        self.mtime = mtime
+        self.variants = {'identity': body, 'gzip': gzip.compress(body, GZIP_LEVEL, mtime=0)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+        self.etag = hashlib.sha1(body).hexdigest()[:16]
+
+
+class ShellCache:
+    """页面缓存，transform 用于在加载时改写页面内容"""
+
+    def __init__(self, base_dir, reload=DEV_RELOAD, transform=None):
+        self.base_dir = base_dir
+        self.reload = reload
+        self.transform = transform
+        self._shells = {}
+        self._lock = threading.Lock()
+
+    def load(self, name):
+        """读取并压缩页面，文件不存在时抛出 FileNotFoundError"""
+        path = os.path.join(self.base_dir, name)
+        with open(path, 'rb') as f:
+            mtime = os.fstat(f.fileno()).st_mtime
+            body = f.read()
+        if self.transform is not None:
+            body = self.transform(body.decode('utf-8')).encode('utf-8')
+        shell = HtmlShell(path, body, mtime)
+        with self._lock:
+            self._shells[name] = shell
+        return shell
+
+    def get(self, name):
+        shell = self._shells.get(name)
+        if shell is None:
+            return self.load(name)
+        if self.reload and os.stat(shell.path).st_mtime != shell.mtime:
+            return self.load(name)
+        return shell
+
+    def preload(self, *names):
+        """启动时预先加载页面，缺失的页面在请求时返回 404"""
+        for name in names:
+            try:
+                self.load(name)
+            except FileNotFoundError:
+                pass
+
+    def invalidate(self):
+        with self._lock:
+            self._shells.clear()
+
+    def response(self, name):
+        """按请求协商编码返回页面"""
+        try:
+            shell = self.get(name)
+        except FileNotFoundError:
+            return Response(f'{name} not found', status=404, mimetype='text/plain')
+
+        encoding = 'identity'
+        for candidate in ENCODING_PREFERENCE:
+            if candidate in shell.variants and request.accept_encodings[candidate] > 0:
+                encoding = candidate
+                break
+
+        # 不同编码是不同的表示，使用不同的强 ETag
+        etag = f'"{shell.etag}"' if encoding == 'identity' else f'"{shell.etag}-{encoding}"'
+        headers = {
+            'ETag': etag,
+            'Vary': 'Accept-Encoding',
+            'Cache-Control': REVALIDATE_CACHE_CONTROL
+        }
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            return Response(status=304, headers=headers)
+        return Response(shell.variants[encoding], headers=headers, mimetype='text/html')
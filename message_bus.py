@@ -0,0 +1,290 @@
+"""
+消息总线
+多个服务进程之间广播事件并共享少量状态（在线成员、文档归属），由 NETCLIP_BUS_URL 选择后端：
+    未设置 / local://      进程内后端（单进程部署，默认）
+    redis://host:port/db  Redis 协议（RESP）后端，可连接 Redis 或兼容的服务
+
+两种后端提供相同的接口：
+    publish(channel, message) / subscribe(channel, handler)   发布订阅，消息为 JSON 可序列化的 dict
+    get / set(nx, px) / delete / pexpire / hset / hdel / hgetall   键值与哈希
+"""
+import json
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+from eventlog import event_log
+
+BUS_URL = os.environ.get('NETCLIP_BUS_URL', '')
+
+# 连接断开后重连的最大等待时间（秒）
+RECONNECT_MAX_DELAY = 5.0
+
+
+class BusError(Exception):
+    """消息总线命令执行失败"""
+
+
+class LocalBus:
+    """进程内后端：发布的消息同步分发给本进程的订阅者"""
+    distributed = False
+
+    def __init__(self):
+        self._handlers = {}
+        self._data = {}       # {key: (value, 过期时间或 None)}
+        self._lock = threading.Lock()
+
+    def start(self, spawn=None):
+        pass
+
+    def publish(self, channel, message):
+        for handler in self._handlers.get(channel, ()):
+            handler(message)
+
+    def subscribe(self, channel, handler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def _get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key, value, nx=False, px=None):
+        with self._lock:
+            if nx and self._get(key) is not None:
+                return False
+            self._data[key] = (value, time.monotonic() + px / 1000 if px else None)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def pexpire(self, key, px):
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                return False
+            self._data[key] = (value, time.monotonic() + px / 1000)
+            return True
+
+    def hset(self, key, field, value):
+        with self._lock:
+            self._data.setdefault(key, ({}, None))[0][field] = value
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            table = self._get(key)
+            if table is not None:
+                for field in fields:
+                    table.pop(field, None)
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._get(key) or {})
+
+    def close(self):
+        pass
+
+
+# ==================== RESP 协议 ====================
+
+def encode_command(*args):
+    """编码为 RESP 数组"""
+    parts = [f'*{len(args)}\r\n'.encode()]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(f'${len(arg)}\r\n'.encode())
+        parts.append(arg)
+        parts.append(b'\r\n')
+    return b''.join(parts)
+
+
+class RespConnection:
+    """单个 RESP 连接（非线程安全，由调用方加锁）"""
+
+    def __init__(self, host, port, db=0, timeout=5):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self.sock.makefile('rb')
+        if db:
+            self.execute('SELECT', db)
+
+    def send(self, *args):
+        self.sock.sendall(encode_command(*args))
+
+    def read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError('消息总线连接已关闭')
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+':
+            return body.decode()
+        if kind == b'-':
+            raise BusError(body.decode())
+        if kind == b':':
+            return int(body)
+        if kind == b'$':
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(body)
+            if length < 0:
+                return None
+            return [self.read_reply() for _ in range(length)]
+        raise BusError(f'无法解析的回复: {line!r}')
+
+    def execute(self, *args):
+        self.send(*args)
+        return self.read_reply()
+
+    def close(self):
+        try:
+            self._file.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisBus:
+    """
+    Redis 协议后端
+    命令使用一个加锁的连接，订阅使用独立连接并在后台任务中按到达顺序分发消息
+    """
+    distributed = True
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self._handlers = {}
+        self._conn = None
+        self._lock = threading.Lock()
+        self._running = False
+        self._subscribed = threading.Event()
+
+    def start(self, spawn, timeout=5):
+        """
+        启动订阅任务，spawn 为启动后台任务的函数（如 socketio.start_background_task）
+        等待订阅生效后返回，保证之后发给本进程的消息不会丢失
+        """
+        if not self._running:
+            self._running = True
+            spawn(self._listen)
+        if not self._subscribed.wait(timeout):
+            raise BusError('订阅消息总线超时')
+
+    def _command(self, *args):
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._conn is None:
+                        self._conn = RespConnection(self.host, self.port, self.db)
+                    return self._conn.execute(*args)
+                except (OSError, ConnectionError):
+                    # 连接断开时重连一次
+                    if self._conn is not None:
+                        self._conn.close()
+                        self._conn = None
+                    if attempt == 2:
+                        raise
+
+    def publish(self, channel, message):
+        self._command('PUBLISH', channel, json.dumps(message, ensure_ascii=False, separators=(',', ':')))
+
+    def subscribe(self, channel, handler):
+        """注册订阅（需在 start() 之前调用）"""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def _listen(self):
+        delay = 0.1
+        while self._running:
+            conn = None
+            try:
+                conn = RespConnection(self.host, self.port, self.db, timeout=None)
+                conn.send('SUBSCRIBE', *self._handlers)
+                for _ in self._handlers:
+                    conn.read_reply()
+                self._subscribed.set()
+                delay = 0.1
+                while self._running:
+                    reply = conn.read_reply()
+                    if not isinstance(reply, list) or reply[0] != b'message':
+                        continue
+                    channel = reply[1].decode()
+                    message = json.loads(reply[2])
+                    for handler in self._handlers.get(channel, ()):
+                        try:
+                            handler(message)
+                        except Exception as e:
+                            event_log.error('bus_handler_failed', '处理 {channel} 消息失败: {error}',
+                                            channel=channel, error=str(e))
+            except (OSError, ConnectionError, BusError) as e:
+                event_log.warning('bus_reconnect', '订阅连接断开，{delay:.1f} 秒后重连: {error}',
+                                  delay=delay, error=str(e))
+            finally:
+                if conn is not None:
+                    conn.close()
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def get(self, key):
+        value = self._command('GET', key)
+        return value.decode() if value is not None else None
+
+    def set(self, key, value, nx=False, px=None):
+        args = ['SET', key, value]
+        if px:
+            args += ['PX', int(px)]
+        if nx:
+            args.append('NX')
+        return self._command(*args) == 'OK'
+
+    def delete(self, key):
+        self._command('DEL', key)
+
+    def pexpire(self, key, px):
+        return self._command('PEXPIRE', key, int(px)) == 1
+
+    def hset(self, key, field, value):
+        self._command('HSET', key, field, value)
+
+    def hdel(self, key, *fields):
+        if fields:
+            self._command('HDEL', key, *fields)
+
+    def hgetall(self, key):
+        reply = self._command('HGETALL', key) or []
+        return {reply[i].decode(): reply[i + 1].decode() for i in range(0, len(reply), 2)}
+
+    def close(self):
+        self._running = False
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def create_bus(url=BUS_URL):
+    """根据 URL 创建消息总线"""
+    if not url or url.startswith('local:'):
+        return LocalBus()
+    if url.startswith('redis://'):
+        return RedisBus(url)
+    raise ValueError(f'不支持的 NETCLIP_BUS_URL: {url}')
@@ -0,0 +1,243 @@
+"""
+运行指标
+记录 Socket.IO 事件处理、HTTP 路由和 db.py 函数的耗时、房间广播的接收连接数和消息大小，
+以 Prometheus 文本格式（/metrics）和 JSON 摘要（/api/admin/metrics，管理后台使用）提供。
+
+记录只在内存中累加：直方图使用固定的桶，每次记录是一次二分查找和几次加法；
+在线人数、积压队列等状态由回调在抓取时计算，平时没有任何开销。
+设置 NETCLIP_METRICS=0 时不记录任何指标（装饰器直接返回原函数）
+"""
+import functools
+import os
+import time
+from bisect import bisect_left
+
+import runtime
+
+# 是否记录指标
+METRICS_ENABLED = os.environ.get('NETCLIP_METRICS', '1') != '0'
+# 每多少次广播测量一次消息大小（需要序列化消息），1 表示每次都测量
+METRICS_PAYLOAD_SAMPLE = max(int(os.environ.get('NETCLIP_METRICS_PAYLOAD_SAMPLE', '10')), 1)
+# 按房间输出在线连接数时最多输出的房间数（按连接数从多到少）
+METRICS_TOP_ROOMS = int(os.environ.get('NETCLIP_METRICS_TOP_ROOMS', '100'))
+
+# 耗时桶（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 广播接收连接数的桶
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+# 消息大小的桶（字节）
+BYTES_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数"""
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}   # {标签值: 计数}
+        self._lock = runtime.native_lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        return [f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}'
+                for labels, value in sorted(self.samples().items())]
+
+    def summary(self):
+        return [{'labels': dict(zip(self.labels, labels)), 'value': value}
+                for labels, value in sorted(self.samples().items())]
+
+
+class Gauge:
+    """抓取时由回调计算的数值，回调返回一个数，或 {标签值: 数} 字典"""
+
+    def __init__(self, name, description, func, labels=(), kind='gauge'):
+        self.name = name
+        self.description = description
+        self.func = func
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def samples(self):
+        value = self.func()
+        return value if isinstance(value, dict) else {(): value}
+
+    def render(self):
+        return [f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}'
+                for labels, value in sorted(self.samples().items())]
+
+    def summary(self):
+        return [{'labels': dict(zip(self.labels, labels)), 'value': value}
+                for labels, value in sorted(self.samples().items())]
+
+
+class Histogram:
+    """固定桶的分布（桶计数、总和、次数）"""
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}   # {标签值: [各桶计数..., +Inf 桶计数, 总和, 次数]}
+        self._lock = runtime.native_lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            return {labels: list(series) for labels, series in self._series.items()}
+
+    def render(self):
+        lines = []
+        bounds = self.buckets + (float('inf'),)
+        for labels, series in sorted(self.samples().items()):
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(series[-2])}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, labels)} {series[-1]}')
+        return lines
+
+    def _quantile(self, series, q):
+        """按桶估算分位数（取所在桶的上界，落在最后一个桶时为 None）"""
+        target = series[-1] * q
+        cumulative = 0
+        for bound, count in zip(self.buckets, series):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return None
+
+    def summary(self):
+        result = []
+        for labels, series in self.samples().items():
+            count, total = series[-1], series[-2]
+            result.append({
+                'labels': dict(zip(self.labels, labels)),
+                'count': count,
+                'sum': round(total, 6),
+                'avg': round(total / count, 6) if count else None,
+                'p50': self._quantile(series, 0.5),
+                'p90': self._quantile(series, 0.9),
+                'p99': self._quantile(series, 0.99)
+            })
+        result.sort(key=lambda item: item['sum'], reverse=True)
+        return result
+
+
+class Registry:
+    """指标集合"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'指标 {metric.name} 已存在')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, labels=()):
+        return self._register(Counter(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def gauge(self, name, description, func, labels=(), kind='gauge'):
+        return self._register(Gauge(name, description, func, labels, kind))
+
+    def render(self):
+        """Prometheus 文本格式"""
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = metric.render()
+            except Exception:
+                # 回调失败时跳过该指标，不影响其他指标
+                continue
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """JSON 摘要，直方图给出次数、总耗时、平均值和估算的分位数"""
+        result = {}
+        for name, metric in self._metrics.items():
+            try:
+                result[name] = {'type': metric.kind, 'description': metric.description, 'samples': metric.summary()}
+            except Exception as e:
+                result[name] = {'type': metric.kind, 'description': metric.description, 'error': str(e)}
+        return result
+
+
+def timed(histogram, *labels):
+    """装饰器：记录函数耗时（包括抛出异常的调用）"""
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labels)
+        return wrapper
+    return decorator
+
+
+# 全局实例
+registry = Registry()
+
+SOCKET_EVENT_SECONDS = registry.histogram(
+    'netclip_socketio_event_seconds', 'Socket.IO 事件处理耗时（秒）', ('event',))
+HTTP_REQUEST_SECONDS = registry.histogram(
+    'netclip_http_request_seconds', 'HTTP 请求处理耗时（秒，不含响应体传输）', ('route', 'method'))
+HTTP_REQUESTS = registry.counter(
+    'netclip_http_requests_total', 'HTTP 请求数', ('route', 'method', 'status'))
+DB_CALL_SECONDS = registry.histogram(
+    'netclip_db_call_seconds', 'db.py 函数耗时（秒，协程模式下为原生线程中的执行时间）', ('function',))
+BROADCAST_FANOUT = registry.histogram(
+    'netclip_broadcast_recipients', '每次房间广播在本进程的接收连接数', ('event',), FANOUT_BUCKETS)
+BROADCAST_BYTES = registry.histogram(
+    'netclip_broadcast_payload_bytes', '房间广播的消息大小（字节，抽样测量）', ('event',), BYTES_BUCKETS)
@@ -0,0 +1,141 @@
+"""
+文本操作变换（OT）
+编辑操作以字符（Unicode 码点）偏移表示：
+    {'op': 'insert', 'pos': 3, 'text': 'abc'}
+    {'op': 'delete', 'pos': 3, 'length': 2}
+一次编辑是按顺序应用的操作列表
+"""
+
+
+class OperationError(ValueError):
+    """操作格式错误或无法应用到当前文档"""
+
+
+def normalize_ops(ops):
+    """校验客户端发送的操作列表，返回规范化后的副本"""
+    if not isinstance(ops, list):
+        raise OperationError('ops 必须是列表')
+
+    result = []
+    for op in ops:
+        if not isinstance(op, dict):
+            raise OperationError('操作必须是对象')
+        pos = op.get('pos')
+        if not isinstance(pos, int) or isinstance(pos, bool) or pos < 0:
+            raise OperationError('pos 必须是非负整数')
+        kind = op.get('op')
+        if kind == 'insert':
+            text = op.get('text')
+            if not isinstance(text, str):
+                raise OperationError('insert 操作缺少 text')
+            if text:
+                result.append({'op': 'insert', 'pos': pos, 'text': text})
+        elif kind == 'delete':
+            length = op.get('length')
+            if not isinstance(length, int) or isinstance(length, bool) or length < 0:
+                raise OperationError('delete 操作的 length 必须是非负整数')
+            if length:
+                result.append({'op': 'delete', 'pos': pos, 'length': length})
+        else:
+            raise OperationError(f'未知操作类型: {kind}')
+    return result
+
+
+def apply_ops(content, ops):
+    """将操作列表应用到文本"""
+    for op in ops:
+        pos = op['pos']
+        if pos > len(content):
+            raise OperationError('操作位置超出文档长度')
+        if op['op'] == 'insert':
+            content = content[:pos] + op['text'] + content[pos:]
+        else:
+            end = pos + op['length']
+            if end > len(content):
+                raise OperationError('删除范围超出文档长度')
+            content = content[:pos] + content[end:]
+    return content
+
+
+def diff(old, new):
+    """
+    比较新旧文本，生成最多一个删除和一个插入操作
+    与客户端 diffText 的结果一致，客户端据此把未确认的本地操作变换到全量内容之后
+    """
+    prefix = 0
+    max_prefix = min(len(old), len(new))
+    while prefix < max_prefix and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    max_suffix = max_prefix - prefix
+    while suffix < max_suffix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+
+    ops = []
+    removed = len(old) - prefix - suffix
+    inserted = new[prefix:len(new) - suffix]
+    if removed:
+        ops.append({'op': 'delete', 'pos': prefix, 'length': removed})
+    if inserted:
+        ops.append({'op': 'insert', 'pos': prefix, 'text': inserted})
+    return ops
+
+
+def _transform_op(a, b, a_wins):
+    """将操作 a 变换到操作 b 之后，a_wins 表示同位置插入时 a 排在前面"""
+    if a['op'] == 'insert':
+        if b['op'] == 'insert':
+            if b['pos'] < a['pos'] or (b['pos'] == a['pos'] and not a_wins):
+                return [dict(a, pos=a['pos'] + len(b['text']))]
+            return [a]
+        # b 为删除
+        b_end = b['pos'] + b['length']
+        if a['pos'] <= b['pos']:
+            return [a]
+        if a['pos'] >= b_end:
+            return [dict(a, pos=a['pos'] - b['length'])]
+        return [dict(a, pos=b['pos'])]
+
+    a_end = a['pos'] + a['length']
+    if b['op'] == 'insert':
+        if b['pos'] <= a['pos']:
+            return [dict(a, pos=a['pos'] + len(b['text']))]
+        if b['pos'] >= a_end:
+            return [a]
+        # 插入点落在删除范围内，拆成两段删除以保留插入的文本
+        head = b['pos'] - a['pos']
+        return [
+            {'op': 'delete', 'pos': a['pos'], 'length': head},
+            {'op': 'delete', 'pos': a['pos'] + len(b['text']), 'length': a['length'] - head}
+        ]
+
+    # 两个删除
+    b_end = b['pos'] + b['length']
+    if a_end <= b['pos']:
+        return [a]
+    if a['pos'] >= b_end:
+        return [dict(a, pos=a['pos'] - b['length'])]
+    overlap = min(a_end, b_end) - max(a['pos'], b['pos'])
+    length = a['length'] - overlap
+    if length == 0:
+        return []
+    return [{'op': 'delete', 'pos': min(a['pos'], b['pos']), 'length': length}]
+
+
+def transform(a_ops, b_ops, a_wins=False):
+    """
+    变换两个基于同一版本的操作列表
+    返回 (a', b')：a' 可应用在 b 之后，b' 可应用在 a 之后
+    """
+    if not a_ops or not b_ops:
+        return a_ops, b_ops
+    if len(a_ops) == 1 and len(b_ops) == 1:
+        return (_transform_op(a_ops[0], b_ops[0], a_wins),
+                _transform_op(b_ops[0], a_ops[0], not a_wins))
+    if len(a_ops) > 1:
+        head, b_ops = transform(a_ops[:1], b_ops, a_wins)
+        tail, b_ops = transform(a_ops[1:], b_ops, a_wins)
+        return head + tail, b_ops
+    a_ops, head = transform(a_ops, b_ops[:1], a_wins)
+    a_ops, tail = transform(a_ops, b_ops[1:], a_wins)
+    return a_ops, head + tail
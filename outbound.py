@@ -0,0 +1,345 @@
+"""
+连接级发送队列
+Socket.IO 为每个连接维护一个无上限的发送队列，网络慢的客户端会积压所有消息，
+内存持续增长，追上后还会依次重放过时的中间状态。
+
+这里在 Socket.IO 之前加一层：
+- 正常连接直接发送，没有额外开销
+- 后台任务定期检查每个连接在 Engine.IO 中未发出的数据包数，超过高水位的连接进入积压状态，
+  之后发给它的消息先进入本模块的队列，等 Engine.IO 队列降下来再按顺序补发
+- 积压队列中被取代的消息直接丢弃：新的全量内容取代之前的文档消息（合并为一条 content_resync），
+  新的光标位置覆盖队列中同一用户的旧位置
+- 只支持全量内容的旧客户端不处理增量操作和 content_resync，它们的队列丢弃 content_op / content_ack，
+  被取代的文档消息合并为一条 content_update
+- 队列超过字节预算时尝试用房间的最新快照取代全部文档消息，仍超出预算一段时间的连接
+  会收到 resync_required 后被断开，客户端重连后重新获取全量内容
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+from cluster import LEGACY_ROOM_PREFIX
+from eventlog import event_log
+
+# 每个连接积压队列的字节预算
+OUTBOUND_BUDGET_BYTES = int(os.environ.get('NETCLIP_OUTBOUND_BUDGET_KB', '1024')) * 1024
+# Engine.IO 队列中未发出的数据包超过该数量时进入积压状态
+OUTBOUND_HIGH_WATER = int(os.environ.get('NETCLIP_OUTBOUND_HIGH_WATER', '32'))
+# 补发时 Engine.IO 队列最多填充到的数据包数。Engine.IO 的发送任务每次取走队列中的全部数据包，
+# 发送阻塞时这些包不再计入队列长度，所以只少量填充，队列迟迟不空说明客户端仍未跟上
+OUTBOUND_LOW_WATER = int(os.environ.get('NETCLIP_OUTBOUND_LOW_WATER', '4'))
+# 检查间隔（毫秒）
+OUTBOUND_CHECK_MS = int(os.environ.get('NETCLIP_OUTBOUND_CHECK_MS', '50'))
+# 持续超出预算多久（秒）后断开连接
+OUTBOUND_GRACE_SECONDS = float(os.environ.get('NETCLIP_OUTBOUND_GRACE', '10'))
+
+# 文档事件都带版本号，客户端按版本顺序处理
+DOC_EVENTS = frozenset(('init_content', 'content_resync', 'content_update', 'content_op', 'content_ack'))
+# 全量内容事件，可以取代之前的文档事件
+FULL_STATE_EVENTS = frozenset(('init_content', 'content_resync', 'content_update'))
+# 增量协议事件，旧客户端无法使用
+OP_EVENTS = frozenset(('content_op', 'content_ack'))
+
+
+def resync_flags(event, data):
+    """content_resync 附带的在途操作状态：acked 表示已包含在内容中，rejected 表示未被应用"""
+    if event != 'content_resync':
+        return {}
+    return {key: True for key in ('acked', 'rejected') if data.get(key)}
+
+
+def message_size(data):
+    """消息的近似字节数"""
+    return len(json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+
+
+class ClientQueue:
+    """单个积压连接的待发送消息"""
+    __slots__ = ('sid', 'messages', 'bytes', 'over_since')
+
+    def __init__(self, sid):
+        self.sid = sid
+        self.messages = deque()   # [事件名, 数据, 字节数]
+        self.bytes = 0
+        self.over_since = None    # 开始超出预算的时间
+
+
+class OutboundQueues:
+    """按连接管理积压消息，取代 socketio.emit 用于房间内的实时事件"""
+
+    def __init__(self, socketio, snapshot=None, recipients=None, full_content_only=None, room_of=None,
+                 budget=OUTBOUND_BUDGET_BYTES):
+        self.socketio = socketio
+        self.snapshot = snapshot   # snapshot(room_id) -> (内容, 版本号)，本进程无法提供时返回 None
+        self.recipients = recipients  # recipients(room_id) -> 本进程中房间内的连接数，用于统计广播范围
+        self.full_content_only = full_content_only  # full_content_only(sid) -> 连接是否只支持全量内容
+        self.room_of = room_of     # room_of(sid) -> 连接所在的房间，不在房间中时返回 None
+        self._broadcasts = 0       # 广播次数，用于抽样测量消息大小
+        self.budget = budget
+        self._queues = {}          # {sid: ClientQueue}，只包含积压中的连接
+        self._lock = threading.Lock()
+        self.backlogged_total = 0  # 进入积压状态的次数
+        self.dropped = 0           # 被全量内容取代而丢弃的文档消息数
+        self.collapsed = 0         # 被合并的光标位置数
+        self.resyncs = 0           # 超出预算时改用快照的次数
+        self.disconnected = 0      # 因持续超出预算被断开的连接数
+        self.engine_supported = True  # 能否读取 Engine.IO 发送队列，见 _engine_backlogs
+
+    # ==================== 发送 ====================
+
+    def send(self, sid, event, data):
+        """发送给单个连接"""
+        with self._lock:
+            queue = self._queues.get(sid)
+            if queue is not None:
+                self._enqueue(queue, event, data)
+                return
+        self.socketio.emit(event, data, to=sid)
+
+    def broadcast(self, event, data, room, skip_sid=None):
+        """
+        发送给房间内的连接，积压中的连接改为入队
+        锁只用于取积压连接的快照和入队，房间成员检查和发送都在锁外进行，各房间的广播互不等待
+        """
+        if metrics.METRICS_ENABLED:
+            self._observe(event, data, room)
+        with self._lock:
+            backlogged = [sid for sid in self._queues if sid != skip_sid]
+        if backlogged:
+            rooms = self.socketio.server.rooms
+            backlogged = [sid for sid in backlogged if room in rooms(sid)]
+        if not backlogged:
+            self.socketio.emit(event, data, to=room, skip_sid=skip_sid)
+            return
+
+        skip = backlogged + [skip_sid] if skip_sid is not None else backlogged
+        self.socketio.emit(event, data, to=room, skip_sid=skip)
+        with self._lock:
+            for sid in backlogged:
+                queue = self._queues.get(sid)
+                if queue is None:
+                    # 快照之后已补发完毕并恢复正常（或已断开）。直接发送可能晚于之后的广播到达，
+                    # 仍然入队，由下一次检查按顺序补发
+                    queue = self._queues[sid] = ClientQueue(sid)
+                self._enqueue(queue, event, data)
+
+    def _observe(self, event, data, room):
+        """记录广播范围，并抽样记录消息大小"""
+        if self.recipients is not None:
+            metrics.BROADCAST_FANOUT.observe(self.recipients(room), event)
+        self._broadcasts += 1
+        if self._broadcasts % metrics.METRICS_PAYLOAD_SAMPLE == 0:
+            metrics.BROADCAST_BYTES.observe(message_size(data), event)
+
+    def discard(self, sid):
+        """连接断开时丢弃其积压消息"""
+        with self._lock:
+            self._queues.pop(sid, None)
+
+    # ==================== 积压队列 ====================
+
+    def _full_content_only(self, sid):
+        return self.full_content_only is not None and self.full_content_only(sid)
+
+    def _enqueue(self, queue, event, data):
+        """加入积压队列（调用方需持有 _lock）"""
+        if event == 'cursor_batch' and self._merge_cursors(queue, data):
+            return
+        if event in DOC_EVENTS and self._full_content_only(queue.sid):
+            if event in OP_EVENTS:
+                self.dropped += 1  # 旧客户端会从同时广播的 content_update 获得完整内容
+                return
+            if self._supersede(queue, data['content'], data['version'], 'content_update', data):
+                return
+        elif event in FULL_STATE_EVENTS:
+            if self._supersede(queue, data['content'], data['version'], flags=resync_flags(event, data)):
+                return
+        size = message_size(data)
+        queue.messages.append([event, data, size])
+        queue.bytes += size
+        if queue.bytes > self.budget:
+            self._compact(queue)
+
+    def _merge_cursors(self, queue, data):
+        """将光标位置合并到队列中尚未发送的 cursor_batch"""
+        for message in reversed(queue.messages):
+            if message[0] != 'cursor_batch':
+                continue
+            cursors = {cursor['id']: cursor for cursor in message[1]['cursors']}
+            for cursor in data['cursors']:
+                if cursor['id'] in cursors:
+                    self.collapsed += 1
+                cursors[cursor['id']] = cursor
+            merged = {'cursors': list(cursors.values())}
+            size = message_size(merged)
+            queue.bytes += size - message[2]
+            message[1], message[2] = merged, size
+            return True
+        return False
+
+    def _supersede(self, queue, content, version, event='content_resync', data=None, flags=None):
+        """
+        丢弃版本不超过 version 的文档消息，在第一条被丢弃的位置放入 content_resync
+        （客户端收到后直接重置，不必等待被丢弃的版本），没有可丢弃的消息时返回 False
+        丢弃了 content_ack 时附带 acked，丢弃了拒绝操作的 content_resync 时附带 rejected，
+        客户端据此判断在途操作是否已包含在全量内容中
+        旧客户端只处理 content_update，此时改为放入 event / data 指定的消息
+        """
+        kept = deque()
+        position = None
+        removed = 0
+        flags = dict(flags or {})
+        for message in queue.messages:
+            if message[0] in DOC_EVENTS and message[1].get('version', 0) <= version:
+                if position is None:
+                    position = len(kept)
+                removed += 1
+                queue.bytes -= message[2]
+                if message[0] == 'content_ack':
+                    flags['acked'] = True
+                else:
+                    flags.update(resync_flags(message[0], message[1]))
+                continue
+            kept.append(message)
+        if position is None:
+            return False
+
+        if data is None:
+            data = dict({'content': content, 'version': version}, **flags)
+        size = message_size(data)
+        kept.insert(position, [event, data, size])
+        queue.messages = kept
+        queue.bytes += size
+        self.dropped += removed
+        return True
+
+    def _room_of(self, sid):
+        """
+        连接所在的房间。Socket.IO 的房间列表还包含连接自身和旧客户端的伪房间，
+        加入、离开并发时顺序不固定，不能直接取第一个
+        """
+        if self.room_of is not None:
+            return self.room_of(sid)
+        rooms = [room for room in self.socketio.server.rooms(sid)
+                 if room != sid and not room.startswith(LEGACY_ROOM_PREFIX)]
+        return rooms[0] if rooms else None
+
+    def _compact(self, queue):
+        """超出预算时用房间最新快照取代全部文档消息"""
+        if self.snapshot is None:
+            return
+        room = self._room_of(queue.sid)
+        if room is None:
+            return
+        snapshot = self.snapshot(room)
+        if snapshot is None:
+            return
+        event = 'content_update' if self._full_content_only(queue.sid) else 'content_resync'
+        if self._supersede(queue, *snapshot, event=event):
+            self.resyncs += 1
+
+    def _engine_backlogs(self):
+        """
+        连接在 Engine.IO 中尚未发出的数据包数 {sid: 数据包数}，只包含超过高水位或积压中的连接，
+        不在结果中的积压连接已关闭（调用方需持有 _lock）
+        Engine.IO 没有公开发送队列的长度，本模块只在这里读取它的内部属性；
+        python-engineio / python-socketio 改变这些属性后返回 None，积压检测随之停用，已入队的消息照常补发
+        """
+        server = self.socketio.server
+        try:
+            backlogs = {}
+            for eio_sid, socket in list(server.eio.sockets.items()):
+                size = socket.queue.qsize()
+                if size <= OUTBOUND_HIGH_WATER and not self._queues:
+                    continue
+                sid = server.manager.sid_from_eio_sid(eio_sid, '/')
+                if sid is not None and (size > OUTBOUND_HIGH_WATER or sid in self._queues):
+                    backlogs[sid] = size
+            return backlogs
+        except AttributeError as e:
+            if self.engine_supported:
+                self.engine_supported = False
+                event_log.warning('outbound_engine_unsupported', '无法读取 Engine.IO 发送队列，停用积压检测: {error}',
+                                  error=str(e))
+            return None
+
+    def _drain(self, queue, backlog, now, outgoing):
+        """
+        取出可以补发的积压消息放入 outgoing，返回连接是否已恢复正常（调用方需持有 _lock）
+        backlog 为连接在 Engine.IO 中尚未发出的数据包数，None 表示连接已关闭
+        取出的消息由调用方释放锁后发送。期间到达的消息仍进入队列（有消息取出时队列不会被删除），
+        由下一次检查发送，不会越过已取出的消息
+        """
+        if backlog is None:
+            return True  # 连接已关闭
+        while queue.messages and backlog < OUTBOUND_LOW_WATER:
+            event, data, size = queue.messages.popleft()
+            queue.bytes -= size
+            outgoing.append((queue.sid, event, data))
+            backlog += 1
+
+        if queue.bytes > self.budget:
+            if queue.over_since is None:
+                queue.over_since = now
+        else:
+            queue.over_since = None
+        return not queue.messages and backlog == 0
+
+    def check(self, now=None):
+        """检查所有连接：标记新的积压连接，补发积压消息，断开持续超出预算的连接"""
+        now = time.monotonic() if now is None else now
+        outgoing = []
+        offenders = []
+        with self._lock:
+            backlogs = self._engine_backlogs()
+            if backlogs is not None:
+                for sid, size in backlogs.items():
+                    if size > OUTBOUND_HIGH_WATER and sid not in self._queues:
+                        self._queues[sid] = ClientQueue(sid)
+                        self.backlogged_total += 1
+
+            for sid, queue in list(self._queues.items()):
+                # 无法读取 Engine.IO 队列时按空队列处理，逐步补发已入队的消息
+                backlog = backlogs.get(sid) if backlogs is not None else 0
+                if self._drain(queue, backlog, now, outgoing):
+                    del self._queues[sid]
+                elif queue.over_since is not None and now - queue.over_since >= OUTBOUND_GRACE_SECONDS:
+                    del self._queues[sid]
+                    offenders.append(sid)
+
+        for sid, event, data in outgoing:
+            self.socketio.emit(event, data, to=sid)
+        for sid in offenders:
+            self.disconnected += 1
+            event_log.warning('outbound_disconnect', '连接 {sid} 持续超出发送预算，断开并要求重新同步', sid=sid)
+            self.socketio.emit('resync_required', {'reason': 'slow_consumer'}, to=sid)
+            self.socketio.server.disconnect(sid)
+
+    def run(self, sleep):
+        """后台任务：定期检查积压连接"""
+        while True:
+            sleep(OUTBOUND_CHECK_MS / 1000)
+            try:
+                self.check()
+            except Exception as e:
+                event_log.error('outbound_check_failed', '检查发送队列失败: {error}', error=str(e))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backlogged': len(self._queues),
+                'queued_messages': sum(len(q.messages) for q in self._queues.values()),
+                'queued_bytes': sum(q.bytes for q in self._queues.values()),
+                'backlogged_total': self.backlogged_total,
+                'dropped': self.dropped,
+                'collapsed': self.collapsed,
+                'resyncs': self.resyncs,
+                'disconnected': self.disconnected,
+                'engine_supported': self.engine_supported,
+                'budget_bytes': self.budget,
+                'high_water': OUTBOUND_HIGH_WATER,
+                'low_water': OUTBOUND_LOW_WATER
+            }
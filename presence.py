@@ -0,0 +1,119 @@
+"""
+在线用户索引
+按连接和房间双向索引在线用户，加入和离开都是 O(1)
+"""
+import os
+import threading
+import uuid
+
+# 每个房间每发生多少次成员变化附带一次完整成员列表，用于客户端校正
+PRESENCE_FULL_SYNC_EVERY = int(os.environ.get('NETCLIP_PRESENCE_FULL_SYNC', '20'))
+
+
+class Member:
+    """在线用户记录"""
+    __slots__ = ('sid', 'member_id', 'username', 'room', 'session_id', 'ops')
+
+    def __init__(self, sid, username, room, session_id, ops=False):
+        self.sid = sid
+        self.member_id = uuid.uuid4().hex[:12]  # 对其他客户端公开的标识，不暴露 sid
+        self.username = username
+        self.room = room
+        self.session_id = session_id
+        self.ops = ops    # 是否支持增量协议（content_op），否则只接收全量内容
+
+    def to_dict(self):
+        return {'id': self.member_id, 'username': self.username}
+
+
+class Presence:
+    """连接 → 用户、房间 → 成员 的索引"""
+
+    def __init__(self):
+        self._members = {}   # {sid: Member}
+        self._rooms = {}     # {room_id: {sid: Member}}，保持加入顺序
+        self._changes = {}   # {room_id: 自上次完整同步以来的变化次数}
+        self._lock = threading.Lock()
+
+    def add(self, sid, username, room, session_id='', ops=False):
+        """记录用户加入房间，返回 (新记录, 该连接之前的记录或 None)"""
+        member = Member(sid, username, room, session_id, ops)
+        with self._lock:
+            previous = self._remove(sid)
+            self._members[sid] = member
+            self._rooms.setdefault(room, {})[sid] = member
+        return member, previous
+
+    def remove(self, sid):
+        """移除连接，返回被移除的记录或 None"""
+        with self._lock:
+            return self._remove(sid)
+
+    def _remove(self, sid):
+        member = self._members.pop(sid, None)
+        if member is not None:
+            room = self._rooms.get(member.room)
+            if room is not None:
+                room.pop(sid, None)
+                if not room:
+                    del self._rooms[member.room]
+                    self._changes.pop(member.room, None)
+        return member
+
+    def get(self, sid):
+        return self._members.get(sid)
+
+    def full_content_only(self, sid):
+        """连接是否为只支持全量内容的旧客户端"""
+        member = self._members.get(sid)
+        return member is not None and not member.ops
+
+    def room_of(self, sid):
+        member = self._members.get(sid)
+        return member.room if member is not None else None
+
+    def username(self, sid, default='Unknown'):
+        member = self._members.get(sid)
+        return member.username if member is not None else default
+
+    def usernames(self, room):
+        """房间内用户名列表"""
+        with self._lock:
+            return [m.username for m in self._rooms.get(room, {}).values()]
+
+    def members(self, room):
+        """房间内成员列表 [{'id', 'username'}]"""
+        with self._lock:
+            return [m.to_dict() for m in self._rooms.get(room, {}).values()]
+
+    def has_legacy(self, room):
+        """房间内是否有只支持全量内容的旧客户端"""
+        with self._lock:
+            return any(not m.ops for m in self._rooms.get(room, {}).values())
+
+    def count(self, room):
+        room_members = self._rooms.get(room)
+        return len(room_members) if room_members else 0
+
+    def room_counts(self):
+        """所有房间的在线人数"""
+        with self._lock:
+            return {room: len(members) for room, members in self._rooms.items()}
+
+    def __len__(self):
+        return len(self._members)
+
+    def full_sync_due(self, room):
+        """记录一次成员变化，返回本次是否应附带完整成员列表"""
+        with self._lock:
+            if room not in self._rooms:
+                return False
+            changes = self._changes.get(room, 0) + 1
+            if changes >= PRESENCE_FULL_SYNC_EVERY:
+                self._changes[room] = 0
+                return True
+            self._changes[room] = changes
+            return False
+
+
+presence = Presence()
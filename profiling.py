@@ -0,0 +1,465 @@
+"""
+性能剖析
+延迟升高时用于定位时间花在哪里（大文档的 JSON 编码、保存内容时的 SQLite 锁等待、上传文件的安全校验等）：
+- 采样剖析（按需）：原生线程每隔几毫秒读取所有线程当前的调用栈，持续 N 秒，
+  结果为 collapsed stack 文本（每行 "帧;帧;帧 次数"），可直接交给 flamegraph.pl、speedscope 等生成火焰图
+- 调用剖析（按需）：对接下来 K 次匹配的 HTTP 路由、Socket.IO 事件或 db.py 函数启用 cProfile，合并为一个 pstats 文件
+- 慢调用记录（始终开启）：每次调用只登记开始时间（约 1 微秒），巡检线程发现超过阈值仍未结束的调用时
+  抓取它当时的调用栈；调用结束后连同参数摘要（只有类型和长度，不含内容）保存到最近记录中
+协程模式下 cProfile 在当前系统线程上启用，剖析期间切换到的其他协程也会计入结果（同一线程同时只剖析一个调用）
+"""
+import cProfile
+import functools
+import io
+import itertools
+import marshal
+import os
+import pstats
+import sys
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+import runtime
+from eventlog import event_log
+
+if runtime.COOPERATIVE:
+    from greenlet import getcurrent as _current_greenlet
+else:
+    def _current_greenlet():
+        return None
+
+# 调用超过该时长（毫秒）时记为慢调用，0 表示不记录
+SLOW_CALL_MS = float(os.environ.get('NETCLIP_SLOW_CALL_MS', '500'))
+# 保留最近的慢调用条数
+SLOW_CALL_KEEP = int(os.environ.get('NETCLIP_SLOW_CALL_KEEP', '100'))
+# 采样剖析的最长时间（秒）
+PROFILE_MAX_SECONDS = float(os.environ.get('NETCLIP_PROFILE_MAX_SECONDS', '300'))
+# 调用剖析最多剖析的调用次数
+PROFILE_MAX_CALLS = int(os.environ.get('NETCLIP_PROFILE_MAX_CALLS', '1000'))
+# 保留最近的剖析结果个数
+PROFILE_KEEP = int(os.environ.get('NETCLIP_PROFILE_KEEP', '10'))
+# 采样间隔的默认值（毫秒）
+PROFILE_SAMPLE_MS = 10
+# 慢调用保存的最大栈深度
+STACK_LIMIT = 60
+
+# 调用剖析支持的调用类型
+CALL_KINDS = ('route', 'event', 'db')
+
+# 栈顶为这些函数的线程视为空闲（等待锁、网络或定时器），采样剖析默认不计入
+IDLE_FRAMES = {
+    ('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'), ('threading.py', 'join'),
+    ('queue.py', 'get'), ('selectors.py', 'select'), ('socket.py', 'accept'), ('socket.py', 'readinto'),
+    ('socketserver.py', 'serve_forever'), ('server.py', 'sleep'), ('runtime.py', 'native_sleep'),
+    ('_threading.py', 'acquire_with_timeout'), ('hub.py', 'run'), ('hub.py', 'switch'), ('hub.py', 'wait'),
+    ('poll.py', 'wait'), ('epolls.py', 'wait')
+}
+
+
+# 代码对象 → collapsed stack 中的帧名称
+_labels = {}
+
+
+def _short_path(filename):
+    """文件路径只保留最后两级"""
+    parts = filename.replace('\\', '/').rsplit('/', 2)
+    return '/'.join(parts[-2:])
+
+
+def _frame_label(code):
+    """collapsed stack 中的帧名称（模块:函数）"""
+    label = _labels.get(code)
+    if label is None:
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        label = _labels[code] = f'{module}:{code.co_name}'
+    return label
+
+
+def _is_idle(frame):
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES
+
+
+def collapse(frame):
+    """调用栈的 collapsed 形式（从外到内，以分号分隔）"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+def format_stack(frame, limit=STACK_LIMIT):
+    """调用栈的 ["文件:行号 函数"] 列表（从外到内，超过 limit 时只保留最内层）"""
+    entries = []
+    while frame is not None and len(entries) < limit:
+        code = frame.f_code
+        entries.append(f'{_short_path(code.co_filename)}:{frame.f_lineno} {code.co_name}')
+        frame = frame.f_back
+    entries.reverse()
+    return entries
+
+
+def summarize(value, depth=0):
+    """参数摘要：保留字典结构和数值，字符串、列表等只记录类型和长度"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return f'str({len(value)})'
+    if isinstance(value, (bytes, bytearray)):
+        return f'bytes({len(value)})'
+    if isinstance(value, dict):
+        if depth >= 2:
+            return f'dict({len(value)})'
+        return {str(key): summarize(item, depth + 1) for key, item in itertools.islice(value.items(), 20)}
+    if isinstance(value, (list, tuple)):
+        if depth == 0:
+            return [summarize(item, depth + 1) for item in value[:10]]
+        return f'{type(value).__name__}({len(value)})'
+    return type(value).__name__
+
+
+class _Call:
+    """进行中的调用"""
+    __slots__ = ('token', 'kind', 'name', 'start', 'thread', 'greenlet', 'args', 'detail', 'stack', 'profile')
+
+    def __init__(self, token, kind, name, args, detail):
+        self.token = token
+        self.kind = kind
+        self.name = name
+        self.detail = detail
+        self.start = time.perf_counter()
+        self.thread = runtime.native_ident()
+        self.greenlet = _current_greenlet()
+        self.args = args
+        self.stack = None
+        self.profile = None
+
+
+class _Session:
+    """一次剖析（采样或调用剖析）"""
+
+    def __init__(self, session_id, kind):
+        self.id = session_id
+        self.kind = kind
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self.finished_at = None
+
+    @property
+    def running(self):
+        return self.finished_at is None
+
+    def finish(self):
+        if self.finished_at is None:
+            self.finished_at = datetime.now().isoformat(timespec='seconds')
+
+    def summary(self):
+        return {'id': self.id, 'kind': self.kind, 'started_at': self.started_at,
+                'finished_at': self.finished_at, 'running': self.running}
+
+
+class SampleSession(_Session):
+    """采样剖析：按调用栈累计的样本数"""
+
+    def __init__(self, session_id, seconds, interval, idle):
+        super().__init__(session_id, 'sample')
+        self.seconds = seconds
+        self.interval = interval
+        self.idle = idle
+        self.counts = {}    # {collapsed stack: 样本数}
+        self.samples = 0    # 采样轮数
+        self.skipped = 0    # 视为空闲而未计入的线程样本数
+
+    def collapsed(self):
+        counts = sorted(dict(self.counts).items(), key=lambda item: item[1], reverse=True)
+        return ''.join(f'{stack} {count}\n' for stack, count in counts)
+
+    def summary(self):
+        return {
+            **super().summary(),
+            'seconds': self.seconds,
+            'interval_ms': self.interval * 1000,
+            'idle': self.idle,
+            'samples': self.samples,
+            'stacks': len(self.counts),
+            'idle_skipped': self.skipped
+        }
+
+
+class CallSession(_Session):
+    """调用剖析：接下来 count 次匹配调用的 cProfile 结果"""
+
+    def __init__(self, session_id, call_kind, name, count):
+        super().__init__(session_id, 'calls')
+        self.call_kind = call_kind
+        self.name = name
+        self.count = count
+        self.started = 0    # 已开始剖析的调用数
+        self.completed = 0  # 已结束的调用数
+        self.skipped = 0    # 同一线程已有剖析进行中而跳过的调用数
+        self.stats = None   # pstats.Stats
+
+    def pstats_bytes(self):
+        """pstats 文件内容（与 cProfile -o 的输出相同，可用 pstats、snakeviz 等打开）"""
+        return marshal.dumps(self.stats.stats if self.stats is not None else {})
+
+    def text(self, limit=50):
+        if self.stats is None:
+            return ''
+        stream = io.StringIO()
+        stats = pstats.Stats(stream=stream).add(self.stats)
+        stats.sort_stats('cumulative').print_stats(limit)
+        return stream.getvalue()
+
+    def summary(self):
+        return {
+            **super().summary(),
+            'call_kind': self.call_kind,
+            'name': self.name,
+            'count': self.count,
+            'started': self.started,
+            'completed': self.completed,
+            'skipped': self.skipped
+        }
+
+
+class Profiler:
+    """慢调用记录、采样剖析和调用剖析"""
+
+    def __init__(self, slow_ms=SLOW_CALL_MS, slow_keep=SLOW_CALL_KEEP, keep=PROFILE_KEEP):
+        self.slow_threshold = slow_ms / 1000
+        self.slow_calls = deque(maxlen=slow_keep)
+        self.slow_total = 0
+        self.keep = keep
+        self._tokens = itertools.count(1)
+        self._inflight = {}                 # {token: _Call}
+        self._sessions = OrderedDict()      # {id: 会话}，按开始时间排序
+        self._session_ids = itertools.count(1)
+        self._sampling = None               # 进行中的采样剖析
+        self._target = None                 # 进行中的调用剖析
+        self._profiled_threads = set()      # 正在执行调用剖析的系统线程
+        self._lock = runtime.native_lock()
+        self._watching = False
+
+    # ==================== 调用登记 ====================
+
+    def begin(self, kind, name, args=None, detail=None):
+        """
+        登记开始的调用，返回值传给 end()。
+        慢调用记录中 args 只保留摘要，detail 原样保留（如请求方法和路径，不能包含敏感内容）
+        """
+        call = _Call(next(self._tokens), kind, name, args, detail)
+        target = self._target
+        if target is not None and target.call_kind == kind and target.name == name:
+            call.profile = self._start_profile(target, call.thread)
+        if self.slow_threshold > 0:
+            self._inflight[call.token] = call
+            if not self._watching:
+                self._start_watchdog()
+        return call
+
+    def end(self, call):
+        """调用结束"""
+        if call is None:
+            return
+        elapsed = time.perf_counter() - call.start
+        self._inflight.pop(call.token, None)
+        if call.profile is not None:
+            self._finish_profile(call)
+        if 0 < self.slow_threshold <= elapsed:
+            self._record_slow(call, elapsed)
+
+    def traced(self, kind, name):
+        """装饰器：登记函数调用，参数用于慢调用的参数摘要"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                call = self.begin(kind, name, args + (kwargs,) if kwargs else args)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.end(call)
+            return wrapper
+        return decorator
+
+    # ==================== 慢调用 ====================
+
+    def _start_watchdog(self):
+        with self._lock:
+            if self._watching:
+                return
+            self._watching = True
+        runtime.native_thread(self._watch)
+
+    def _watch(self):
+        """巡检线程（原生线程）：为超过阈值仍未结束的调用抓取调用栈"""
+        while True:
+            runtime.native_sleep(max(self.slow_threshold / 4, 0.02))
+            threshold = self.slow_threshold
+            if threshold <= 0:
+                continue
+            now = time.perf_counter()
+            pending = [call for call in list(self._inflight.values())
+                       if call.stack is None and now - call.start >= threshold]
+            if not pending:
+                continue
+            frames = sys._current_frames()
+            for call in pending:
+                # 挂起的协程从协程自身取栈，正在运行的调用从所在系统线程取栈
+                frame = call.greenlet.gr_frame if call.greenlet is not None else None
+                if frame is None:
+                    frame = frames.get(call.thread)
+                if frame is not None:
+                    call.stack = format_stack(frame)
+            del frames
+
+    def _record_slow(self, call, elapsed):
+        duration_ms = round(elapsed * 1000, 1)
+        self.slow_calls.append({
+            'kind': call.kind,
+            'name': call.name,
+            'duration_ms': duration_ms,
+            'started_at': datetime.fromtimestamp(time.time() - elapsed).isoformat(timespec='milliseconds'),
+            'args': summarize(call.args),
+            'detail': call.detail,
+            'stack': call.stack
+        })
+        self.slow_total += 1
+        event_log.warning('slow_call', '{kind} {name} 耗时 {duration_ms} ms',
+                          kind=call.kind, name=call.name, duration_ms=duration_ms)
+
+    def recent_slow_calls(self):
+        """最近的慢调用（从新到旧）"""
+        return list(reversed(self.slow_calls))
+
+    # ==================== 剖析会话 ====================
+
+    def _add_session(self, session):
+        """登记会话，超过保留个数时丢弃最早的已结束会话（调用方持有锁）"""
+        self._sessions[session.id] = session
+        for old in [s for s in self._sessions.values() if not s.running][:max(len(self._sessions) - self.keep, 0)]:
+            del self._sessions[old.id]
+
+    def session(self, session_id):
+        return self._sessions.get(session_id)
+
+    def sessions(self):
+        return [session.summary() for session in reversed(list(self._sessions.values()))]
+
+    def start_sampling(self, seconds, interval_ms=PROFILE_SAMPLE_MS, idle=False):
+        """开始采样剖析，已有采样剖析在进行时抛出 RuntimeError"""
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            raise ValueError(f'采样时长须在 0 到 {PROFILE_MAX_SECONDS:g} 秒之间')
+        if not 1 <= interval_ms <= 1000:
+            raise ValueError('采样间隔须在 1 到 1000 毫秒之间')
+        with self._lock:
+            if self._sampling is not None:
+                raise RuntimeError(f'采样剖析 {self._sampling.id} 正在进行')
+            session = self._sampling = SampleSession(str(next(self._session_ids)), seconds, interval_ms / 1000, idle)
+            self._add_session(session)
+        runtime.native_thread(lambda: self._sample(session))
+        return session
+
+    def _sample(self, session):
+        """采样线程（原生线程）"""
+        own = runtime.native_ident()
+        counts = session.counts
+        deadline = time.monotonic() + session.seconds
+        try:
+            while session.running and time.monotonic() < deadline:
+                frames = sys._current_frames()
+                for ident, frame in frames.items():
+                    if ident == own:
+                        continue
+                    if not session.idle and _is_idle(frame):
+                        session.skipped += 1
+                        continue
+                    stack = collapse(frame)
+                    counts[stack] = counts.get(stack, 0) + 1
+                frames = frame = None
+                session.samples += 1
+                runtime.native_sleep(session.interval)
+        finally:
+            with self._lock:
+                self._close(session)
+
+    def start_calls(self, call_kind, name, count):
+        """剖析接下来 count 次匹配的调用，已有调用剖析在进行时抛出 RuntimeError"""
+        if call_kind not in CALL_KINDS:
+            raise ValueError(f'不支持的调用类型: {call_kind}，可选 {", ".join(CALL_KINDS)}')
+        if not name:
+            raise ValueError('缺少路由模板、事件名或函数名')
+        if not 1 <= count <= PROFILE_MAX_CALLS:
+            raise ValueError(f'剖析次数须在 1 到 {PROFILE_MAX_CALLS} 之间')
+        with self._lock:
+            if self._target is not None:
+                raise RuntimeError(f'调用剖析 {self._target.id} 正在进行')
+            session = self._target = CallSession(str(next(self._session_ids)), call_kind, name, count)
+            self._add_session(session)
+        return session
+
+    def _start_profile(self, session, thread):
+        with self._lock:
+            if session.started >= session.count or session is not self._target:
+                return None
+            if thread in self._profiled_threads:
+                session.skipped += 1
+                return None
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # 其他剖析工具已在本线程启用
+                session.skipped += 1
+                return None
+            self._profiled_threads.add(thread)
+            session.started += 1
+            return session, profile
+
+    def _finish_profile(self, call):
+        session, profile = call.profile
+        profile.disable()
+        stats = pstats.Stats(profile)
+        with self._lock:
+            self._profiled_threads.discard(call.thread)
+            if session.stats is None:
+                session.stats = stats
+            else:
+                session.stats.add(stats)
+            session.completed += 1
+            if session.completed >= session.count:
+                self._close(session)
+
+    def _close(self, session):
+        """结束会话（调用方持有锁）"""
+        session.finish()
+        if self._target is session:
+            self._target = None
+        if self._sampling is session:
+            self._sampling = None
+
+    def stop(self, session_id):
+        """提前结束剖析，会话不存在时返回 None"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and session.running:
+                # 采样线程在下一轮检查到后退出；调用剖析中已开始的调用结束时仍会合并结果
+                self._close(session)
+        return session
+
+    def stats(self):
+        return {
+            'slow_threshold_ms': self.slow_threshold * 1000,
+            'slow_total': self.slow_total,
+            'slow_kept': len(self.slow_calls),
+            'inflight': len(self._inflight),
+            'sampling': self._sampling.id if self._sampling is not None else None,
+            'profiling_calls': self._target.id if self._target is not None else None,
+            'max_seconds': PROFILE_MAX_SECONDS,
+            'max_calls': PROFILE_MAX_CALLS
+        }
+
+
+# 全局实例
+profiler = Profiler()
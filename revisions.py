@@ -0,0 +1,379 @@
+"""
+房间历史版本
+每次房间内容写回数据库时记录一个版本。为控制占用空间：
+- 每隔若干版本保存一次压缩的全文（checkpoint），其余版本只保存相对上一个版本的压缩差异（delta）
+- 重建任意版本只需从最近的 checkpoint 依次应用 delta，链长和 delta 总大小都有上限，重建耗时有界
+- 后台任务按时间精简旧版本：最近的版本全部保留，更早的每小时保留一个，再早的每天保留一个
+
+delta 以 UTF-8 字节为单位，由「复制旧文本的一段」和「插入新字节」两种操作组成，zlib 压缩后保存
+"""
+import hashlib
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from difflib import SequenceMatcher
+
+import db
+import runtime
+from eventlog import event_log
+
+# 每条 delta 链的最大长度，超过后保存新的 checkpoint
+REVISION_CHECKPOINT_EVERY = int(os.environ.get('NETCLIP_REVISION_CHECKPOINT_EVERY', '32'))
+# 最近多少小时内的版本全部保留
+REVISION_KEEP_ALL_HOURS = float(os.environ.get('NETCLIP_REVISION_KEEP_ALL_HOURS', '24'))
+# 最近多少天内的版本每小时保留一个，更早的每天保留一个
+REVISION_HOURLY_DAYS = float(os.environ.get('NETCLIP_REVISION_HOURLY_DAYS', '30'))
+# 后台精简间隔（秒）
+REVISION_COMPACT_INTERVAL = float(os.environ.get('NETCLIP_REVISION_COMPACT_INTERVAL', '3600'))
+# 缓存最新版本全文的房间数，避免每次记录都从数据库重建上一版本
+REVISION_CACHE_ROOMS = 128
+# 去掉公共前后缀后，变化区域超过该字节数时再按行比较，找出其中未变的部分
+LINE_DIFF_THRESHOLD = 4096
+
+OP_COPY = 0
+OP_INSERT = 1
+
+
+# ==================== delta 编码 ====================
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _common_prefix(a, b):
+    """公共前缀长度（二分比较切片，避免逐字节循环）"""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[low:mid] == b[low:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def _common_suffix(a, b, limit):
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[len(a) - mid:len(a) - low] == b[len(b) - mid:len(b) - low]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def encode_delta(old, new):
+    """计算把 old 变为 new 的操作序列（字节串），参数均为 bytes"""
+    prefix = _common_prefix(old, new)
+    suffix = _common_suffix(old, new, min(len(old), len(new)) - prefix)
+    old_middle = old[prefix:len(old) - suffix]
+    new_middle = new[prefix:len(new) - suffix]
+
+    ops = []  # [(OP_COPY, 起点, 长度) / (OP_INSERT, 字节)]
+    if prefix:
+        ops.append((OP_COPY, 0, prefix))
+    if len(new_middle) > LINE_DIFF_THRESHOLD and old_middle:
+        old_lines = old_middle.splitlines(keepends=True)
+        new_lines = new_middle.splitlines(keepends=True)
+        offsets = [prefix]
+        for line in old_lines:
+            offsets.append(offsets[-1] + len(line))
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_lines, new_lines).get_opcodes():
+            if tag == 'equal':
+                ops.append((OP_COPY, offsets[i1], offsets[i2] - offsets[i1]))
+            elif j2 > j1:
+                ops.append((OP_INSERT, b''.join(new_lines[j1:j2])))
+    elif new_middle:
+        ops.append((OP_INSERT, new_middle))
+    if suffix:
+        ops.append((OP_COPY, len(old) - suffix, suffix))
+
+    out = bytearray()
+    for op in ops:
+        out.append(op[0])
+        if op[0] == OP_COPY:
+            _write_varint(out, op[1])
+            _write_varint(out, op[2])
+        else:
+            _write_varint(out, len(op[1]))
+            out += op[1]
+    return bytes(out)
+
+
+def apply_delta(old, delta):
+    """对 old 应用 encode_delta 生成的操作序列"""
+    parts = []
+    pos = 0
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op == OP_COPY:
+            start, pos = _read_varint(delta, pos)
+            length, pos = _read_varint(delta, pos)
+            parts.append(old[start:start + length])
+        else:
+            length, pos = _read_varint(delta, pos)
+            parts.append(delta[pos:pos + length])
+            pos += length
+    return b''.join(parts)
+
+
+def _digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+class RevisionError(Exception):
+    """历史版本数据不完整或校验失败"""
+
+
+# ==================== 版本存储 ====================
+
+class RevisionStore:
+    """房间历史版本的记录、查询和精简"""
+
+    def __init__(self):
+        self._cache = OrderedDict()   # {room_id: (版本号, 摘要, 全文 bytes)}，最近使用的在后
+        self._pending = {}            # {room_id: (内容, 写回时间)}，等待后台任务记录
+        self._lock = threading.Lock()
+        self.recorded = 0             # 记录的版本数
+        self.checkpoints = 0          # 其中的 checkpoint 数
+        self.compacted = 0            # 精简时删除的版本数
+
+    def _remember(self, room_id, revision, digest, data):
+        with self._lock:
+            self._cache[room_id] = (revision, digest, data)
+            self._cache.move_to_end(room_id)
+            while len(self._cache) > REVISION_CACHE_ROOMS:
+                self._cache.popitem(last=False)
+
+    def _cached(self, room_id, revision, digest=None):
+        """缓存的版本全文，同时比较摘要，避免房间删除后重建时用到旧房间的内容"""
+        with self._lock:
+            cached = self._cache.get(room_id)
+        if cached and cached[0] == revision and (digest is None or cached[1] == digest):
+            return cached[2]
+        return None
+
+    def forget(self, room_id):
+        with self._lock:
+            self._cache.pop(room_id, None)
+            self._pending.pop(room_id, None)
+
+    def enqueue(self, items, now=None):
+        """
+        登记写回的 (room_id, content)，由后台任务调用 record_pending 记录版本，
+        delta 编码不占用写回锁和离开房间的处理线程；同一房间尚未记录时只保留最新内容
+        """
+        now = now or datetime.now()
+        with self._lock:
+            for room_id, content in items:
+                self._pending[room_id] = (content, now)
+
+    @runtime.blocking
+    def record_pending(self):
+        """记录所有等待中的版本，返回记录的版本数，单个房间失败不影响其他房间"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        recorded = 0
+        for room_id, (content, now) in pending.items():
+            try:
+                if self.record(room_id, content, now) is not None:
+                    recorded += 1
+            except Exception as e:
+                event_log.error('revision_record_failed', '记录房间 {room} 的历史版本失败: {error}',
+                                room=room_id, error=str(e))
+        return recorded
+
+    def record(self, room_id, content, now=None):
+        """记录一个版本，返回新版本号，内容与最新版本相同或房间已被删除时返回 None"""
+        data = content.encode('utf-8')
+        digest = _digest(data)
+        latest = db.get_latest_revision(room_id)
+        if latest is not None and latest['digest'] == digest:
+            return None
+
+        base = None
+        if latest is not None and latest['chain'] + 1 < REVISION_CHECKPOINT_EVERY:
+            base = self._cached(room_id, latest['revision'], latest['digest'])
+            if base is None:
+                base = self._reconstruct(room_id, latest['revision'])
+
+        revision = latest['revision'] + 1 if latest is not None else 1
+        created_at = (now or datetime.now()).isoformat()
+        row = None
+        if base is not None:
+            delta = zlib.compress(encode_delta(base, data))
+            chain_bytes = latest['chain_bytes'] + len(delta)
+            # delta 链累计超过全文大小时，重建读取的数据已多于直接保存全文，改存 checkpoint
+            if chain_bytes <= len(data):
+                row = (room_id, revision, 'delta', created_at, len(data), len(delta),
+                       latest['chain'] + 1, chain_bytes, digest, delta)
+        if row is None:
+            blob = zlib.compress(data)
+            row = (room_id, revision, 'checkpoint', created_at, len(data), len(blob), 0, 0, digest, blob)
+
+        if not db.add_revision(row):
+            # 其他进程已写入同一版本号（下次从数据库重新读取），或房间已被删除
+            self.forget(room_id)
+            return None
+        self._remember(room_id, revision, digest, data)
+        self.recorded += 1
+        if row[2] == 'checkpoint':
+            self.checkpoints += 1
+        return revision
+
+    def _reconstruct(self, room_id, revision):
+        """从最近的 checkpoint 重建指定版本的全文，版本不存在时返回 None"""
+        rows = db.get_revision_chain(room_id, revision)
+        if not rows or rows[-1]['revision'] != revision:
+            return None
+        if rows[0]['kind'] != 'checkpoint':
+            raise RevisionError(f'房间 {room_id} 版本 {revision} 缺少 checkpoint')
+        data = zlib.decompress(rows[0]['data'])
+        for row in rows[1:]:
+            data = apply_delta(data, zlib.decompress(row['data']))
+        if _digest(data) != rows[-1]['digest']:
+            raise RevisionError(f'房间 {room_id} 版本 {revision} 校验失败')
+        return data
+
+    @runtime.blocking
+    def get(self, room_id, revision):
+        """获取指定版本 {'revision', 'created_at', 'size', 'content'}，不存在时返回 None"""
+        data = self._cached(room_id, revision)
+        if data is None:
+            data = self._reconstruct(room_id, revision)
+            if data is None:
+                return None
+        rows = db.list_revisions(room_id, limit=1, before=revision + 1)
+        return {
+            'revision': revision,
+            'created_at': rows[0]['created_at'] if rows else None,
+            'size': len(data),
+            'content': data.decode('utf-8')
+        }
+
+    def list(self, room_id, limit=50, before=None):
+        """按版本号倒序列出历史版本（不含内容）"""
+        return db.list_revisions(room_id, limit, before)
+
+    @runtime.blocking
+    def collect(self, room_id, extract):
+        """依次重建房间保留的每个版本，返回 extract(内容) 结果的并集（如内容中引用的图片）"""
+        rows = db.get_revisions(room_id)
+        if rows and rows[0]['kind'] != 'checkpoint':
+            raise RevisionError(f'房间 {room_id} 版本 {rows[0]["revision"]} 缺少 checkpoint')
+        result = set()
+        data = None
+        for row in rows:
+            if row['kind'] == 'checkpoint':
+                data = zlib.decompress(row['data'])
+            else:
+                data = apply_delta(data, zlib.decompress(row['data']))
+            if _digest(data) != row['digest']:
+                raise RevisionError(f'房间 {room_id} 版本 {row["revision"]} 校验失败')
+            result |= extract(data.decode('utf-8'))
+        return result
+
+    # ==================== 精简 ====================
+
+    @runtime.blocking
+    def compact(self, now=None):
+        """按时间精简所有房间的旧版本，返回删除的版本数"""
+        now = now or datetime.now()
+        hourly_before = (now - timedelta(hours=REVISION_KEEP_ALL_HOURS)).isoformat()
+        daily_before = (now - timedelta(days=REVISION_HOURLY_DAYS)).isoformat()
+        removed = 0
+        for room_id in db.get_compactable_revision_rooms(hourly_before, daily_before):
+            try:
+                removed += self._compact_room(room_id, hourly_before, daily_before)
+            except Exception as e:
+                event_log.error('revisions_compact_failed', '精简房间 {room} 的历史版本失败: {error}',
+                                room=room_id, error=str(e))
+        self.compacted += removed
+        return removed
+
+    def _compact_room(self, room_id, hourly_before, daily_before):
+        """
+        重写房间在 hourly_before 之前的版本：每个时间分组只保留最新的一个版本，
+        保留的版本重新编码为新的 checkpoint / delta 链，版本号、时间和内容不变
+        """
+        rows = db.get_revisions_before(room_id, hourly_before)
+        if not rows or rows[0]['kind'] != 'checkpoint':
+            return 0
+
+        def bucket(row):
+            created_at = row['created_at']
+            return created_at[:10] if created_at < daily_before else created_at[:13]
+
+        last = rows[-1]
+        # 之后的版本是 delta 时，它以最后一个保留的版本为基准，该版本改存 checkpoint，
+        # 这样后续 delta 链的实际长度不超过已记录的 chain，重建耗时上限不变
+        next_kind = db.get_next_revision_kind(room_id, last['revision'])
+
+        new_rows = []
+        data = None
+        previous = None      # 上一个保留版本的全文
+        chain = chain_bytes = 0
+        for index, row in enumerate(rows):
+            if row['kind'] == 'checkpoint':
+                data = zlib.decompress(row['data'])
+            else:
+                data = apply_delta(data, zlib.decompress(row['data']))
+            if row is not last and bucket(rows[index + 1]) == bucket(row):
+                continue
+
+            blob = None
+            force_checkpoint = row is last and next_kind == 'delta'
+            if previous is not None and chain + 1 < REVISION_CHECKPOINT_EVERY and not force_checkpoint:
+                delta = zlib.compress(encode_delta(previous, data))
+                if chain_bytes + len(delta) <= len(data):
+                    chain += 1
+                    chain_bytes += len(delta)
+                    blob, kind = delta, 'delta'
+            if blob is None:
+                blob, kind = zlib.compress(data), 'checkpoint'
+                chain = chain_bytes = 0
+            new_rows.append((room_id, row['revision'], kind, row['created_at'], len(data), len(blob),
+                             chain, chain_bytes, row['digest'], blob))
+            previous = data
+
+        if _digest(data) != last['digest']:
+            raise RevisionError(f'房间 {room_id} 版本 {last["revision"]} 校验失败')
+        db.replace_revisions(room_id, last['revision'], new_rows)
+        return len(rows) - len(new_rows)
+
+    def stats(self):
+        stats = db.get_revision_stats()
+        stats['compression_ratio'] = round(stats['logical_bytes'] / stats['stored_bytes'], 2) if stats['stored_bytes'] else None
+        with self._lock:
+            pending = len(self._pending)
+        stats.update({
+            'recorded': self.recorded,
+            'pending': pending,
+            'checkpoints_recorded': self.checkpoints,
+            'compacted': self.compacted,
+            'checkpoint_every': REVISION_CHECKPOINT_EVERY,
+            'keep_all_hours': REVISION_KEEP_ALL_HOURS,
+            'hourly_days': REVISION_HOURLY_DAYS
+        })
+        return stats
+
+
+revision_store = RevisionStore()
@@ -0,0 +1,143 @@
+"""
+房间元数据缓存
+加入房间、上传文件、验证密码和管理操作都需要房间是否存在、密码哈希等信息，
+这里在进程内按 LRU 缓存房间元数据（不含内容），并缓存不存在的房间 ID，
+随机 URL 探测不会每次都查询数据库。同一房间并发的未命中只由第一个请求读库，其余等待它的结果，
+部署后大量连接同时重连加入同一房间时每个房间只查询一次。
+创建房间、修改密码和删除房间时由 Cluster.room_changed 主动失效（多进程部署时通知所有进程），
+过期时间只是兜底
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import db
+
+# 最多缓存的房间数
+ROOM_CACHE_SIZE = int(os.environ.get('NETCLIP_ROOM_CACHE_SIZE', '10000'))
+# 房间元数据的缓存时间（秒）
+ROOM_CACHE_TTL = float(os.environ.get('NETCLIP_ROOM_CACHE_TTL', '60'))
+# 不存在的房间的缓存时间（秒）
+ROOM_CACHE_NEGATIVE_TTL = float(os.environ.get('NETCLIP_ROOM_CACHE_NEGATIVE_TTL', '10'))
+
+
+class _Load:
+    """一次进行中的读库，同一房间的并发请求共享结果"""
+    __slots__ = ('done', 'meta', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.meta = None
+        self.error = None
+
+
+class RoomCache:
+    """room_id → 房间元数据 {room_id, password_hash, password_epoch, created_at}，不存在时为 None"""
+
+    def __init__(self, size=ROOM_CACHE_SIZE, ttl=ROOM_CACHE_TTL, negative_ttl=ROOM_CACHE_NEGATIVE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()  # {room_id: (元数据或 None, 到期时间)}，按最近使用排序
+        self._lock = threading.Lock()
+        self._generation = 0           # 每次失效加一，读库期间发生失效时不写入缓存
+        self._loading = {}             # {room_id: _Load}，进行中的读库
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0             # 等待其他请求读库结果的未命中次数
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, room_id):
+        """房间元数据，房间不存在时返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(room_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(room_id)
+                if entry[0] is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return entry[0]
+            load = self._loading.get(room_id)
+            if load is None:
+                load = self._loading[room_id] = _Load()
+                self.misses += 1
+                generation = self._generation
+            else:
+                self.coalesced += 1
+                generation = None
+
+        if generation is None:
+            # 其他请求正在读库，等待它的结果
+            load.done.wait()
+            if load.error is not None:
+                raise load.error
+            return load.meta
+
+        try:
+            load.meta = db.get_room_meta(room_id)
+        except Exception as e:
+            load.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._loading.get(room_id) is load:
+                    del self._loading[room_id]
+                if load.error is None and generation == self._generation:
+                    meta = load.meta
+                    self._entries[room_id] = (meta, now + (self.ttl if meta is not None else self.negative_ttl))
+                    self._entries.move_to_end(room_id)
+                    while len(self._entries) > self.size:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+            load.done.set()
+        return load.meta
+
+    def exists(self, room_id):
+        return self.get(room_id) is not None
+
+    def verify_password(self, room_id, password):
+        """验证房间密码（与 db.verify_room_password 相同的规则）"""
+        meta = self.get(room_id)
+        if meta is None:
+            return False
+        if meta['password_hash'] is None:
+            # 公开房间，无需密码
+            return True
+        if not password:
+            return False
+        return meta['password_hash'] == db.hash_room_password(password)
+
+    def invalidate(self, room_id):
+        """房间被创建、修改密码或删除后丢弃缓存"""
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._entries.pop(room_id, None)
+            # 进行中的读库可能读到修改前的数据，之后的请求重新读库
+            self._loading.pop(room_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.size,
+                'ttl': self.ttl,
+                'negative_ttl': self.negative_ttl,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hit_ratio': round((self.hits + self.negative_hits) / lookups, 4) if lookups else None,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions
+            }
+
+
+# 全局实例
+room_cache = RoomCache()
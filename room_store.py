@@ -0,0 +1,254 @@
+"""
+房间文档内存存储
+活跃房间的文档以内存为准，编辑只修改内存，合并后按间隔批量写回 rooms 表
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import db
+import ot
+from revisions import revision_store
+
+# 后台刷新线程的检查间隔（秒）
+FLUSH_INTERVAL = float(os.environ.get('NETCLIP_FLUSH_INTERVAL', '1.0'))
+# 文档停止编辑超过该时间（秒）即写回
+FLUSH_IDLE_DELAY = float(os.environ.get('NETCLIP_FLUSH_IDLE', '2.0'))
+# 脏数据最长保留时间（秒），持续编辑时也保证按此间隔落盘，即最大丢失窗口
+FLUSH_MAX_DELAY = float(os.environ.get('NETCLIP_FLUSH_MAX_DELAY', '5.0'))
+# 无人持有且已落盘的文档在内存中保留的时间（秒）
+EVICT_IDLE_SECONDS = float(os.environ.get('NETCLIP_EVICT_IDLE', '300'))
+# 每个房间保留的最近操作数，落后更多版本的客户端需要全量重新同步
+OP_HISTORY_SIZE = int(os.environ.get('NETCLIP_OP_HISTORY', '500'))
+
+
+class RoomDocument:
+    """单个房间的内存文档"""
+    __slots__ = ('room_id', 'content', 'version', 'history', 'holders', 'legacy_holders',
+                 'dirty_since', 'last_change', 'last_access')
+
+    def __init__(self, room_id, content):
+        self.room_id = room_id
+        self.content = content
+        self.version = 0          # 每次修改加一
+        self.history = deque(maxlen=OP_HISTORY_SIZE)  # [(version, ops)]
+        self.holders = 0          # 当前持有该文档的连接数
+        self.legacy_holders = 0   # 其中只支持全量内容的旧客户端数
+        self.dirty_since = None   # 第一次未落盘修改的时间
+        self.last_change = 0.0    # 最后一次修改时间
+        self.last_access = time.monotonic()
+
+
+class RoomStore:
+    """活跃房间文档的写回缓存"""
+
+    def __init__(self):
+        self._docs = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # 保证写回按快照顺序执行
+        self.updates = 0          # 收到的内容更新次数
+        self.rows_written = 0     # 实际写入数据库的次数
+        self.flushes = 0          # 批量写回次数
+
+    def _load(self, room_id):
+        """获取内存文档，不存在时从数据库加载"""
+        with self._lock:
+            doc = self._docs.get(room_id)
+        if doc is None:
+            content = db.get_room_content(room_id)
+            with self._lock:
+                doc = self._docs.setdefault(room_id, RoomDocument(room_id, content))
+        return doc
+
+    def open(self, room_id, legacy=False):
+        """连接加入房间时持有文档，返回 (内容, 版本号)；legacy 表示只支持全量内容的旧客户端"""
+        while True:
+            doc = self._load(room_id)
+            with self._lock:
+                # 加载后文档可能已被移出内存，此时重新加载，避免持有不在 _docs 中的文档
+                if self._docs.get(room_id) is not doc:
+                    continue
+                doc.holders += 1
+                if legacy:
+                    doc.legacy_holders += 1
+                doc.last_access = time.monotonic()
+                return doc.content, doc.version
+
+    def release(self, room_id, legacy=False):
+        """连接离开房间，最后一个连接离开时立即写回并移出内存"""
+        with self._lock:
+            doc = self._docs.get(room_id)
+            if doc is None:
+                return
+            doc.holders = max(doc.holders - 1, 0)
+            if legacy:
+                doc.legacy_holders = max(doc.legacy_holders - 1, 0)
+            if doc.holders > 0:
+                return
+        self.flush_room(room_id, evict=True)
+
+    def get_content(self, room_id):
+        """获取房间内容，未加载的房间直接读数据库且不缓存"""
+        with self._lock:
+            doc = self._docs.get(room_id)
+            if doc is not None:
+                doc.last_access = time.monotonic()
+                return doc.content
+        return db.get_room_content(room_id)
+
+    def set_content(self, room_id, content):
+        """整体替换房间内容（只修改内存，稍后写回），返回新版本号"""
+        now = time.monotonic()
+        with self._lock:
+            doc = self._docs.get(room_id)
+            if doc is None:
+                doc = self._docs[room_id] = RoomDocument(room_id, content)
+            # 整体替换也按差异记入历史，基于旧版本的操作仍可变换到替换之后
+            ops = ot.diff(doc.content, content)
+            doc.content = content
+            doc.version += 1
+            doc.history.append((doc.version, ops))
+            self._mark_dirty(doc, now)
+            return doc.version
+
+    def apply_ops(self, room_id, base_version, ops):
+        """
+        将基于 base_version 的操作变换到最新版本后应用
+        返回 (新版本号, 实际应用的操作, 新内容)，房间内没有旧客户端时新内容为 None；
+        base_version 已不在历史范围内时返回 None
+        操作无法应用时抛出 ot.OperationError
+        """
+        doc = self._load(room_id)
+        now = time.monotonic()
+        with self._lock:
+            if base_version > doc.version:
+                return None
+            if base_version < doc.version:
+                if not doc.history or doc.history[0][0] > base_version + 1:
+                    return None
+                for version, applied in doc.history:
+                    if version > base_version:
+                        ops, _ = ot.transform(ops, applied)
+            doc.content = ot.apply_ops(doc.content, ops)
+            doc.version += 1
+            doc.history.append((doc.version, ops))
+            self._mark_dirty(doc, now)
+            return doc.version, ops, doc.content if doc.legacy_holders else None
+
+    def snapshot(self, room_id):
+        """获取房间当前 (内容, 版本号)"""
+        doc = self._load(room_id)
+        with self._lock:
+            return doc.content, doc.version
+
+    def _mark_dirty(self, doc, now):
+        """记录一次修改，调用方需持有 _lock"""
+        doc.last_change = now
+        doc.last_access = now
+        if doc.dirty_since is None:
+            doc.dirty_since = now
+        self.updates += 1
+
+    def content_lengths(self, room_ids):
+        """内存中房间的当前内容长度（可能尚未写回），未加载的房间不包含在结果中"""
+        with self._lock:
+            return {room_id: len(self._docs[room_id].content) for room_id in room_ids if room_id in self._docs}
+
+    def room_ids(self):
+        """内存中的房间"""
+        with self._lock:
+            return list(self._docs)
+
+    def evict(self, room_id):
+        """丢弃房间文档（房间被删除时使用，不写回）"""
+        with self._lock:
+            self._docs.pop(room_id, None)
+
+    def flush_room(self, room_id, evict=False):
+        """立即写回单个房间，evict 时在写入提交后移出内存（期间加入的连接仍使用内存文档）"""
+        with self._flush_lock:
+            with self._lock:
+                doc = self._docs.get(room_id)
+                if doc is None:
+                    return
+                pending = [(room_id, doc.content)] if doc.dirty_since is not None else []
+                doc.dirty_since = None
+            self._write(pending)
+            if evict:
+                with self._lock:
+                    # 写入期间有新连接加入或新的修改时保留
+                    if self._docs.get(room_id) is doc and doc.holders == 0 and doc.dirty_since is None:
+                        del self._docs[room_id]
+
+    def flush_due(self, now=None):
+        """写回已空闲或超过最大延迟的文档，并清理长时间无人使用的文档"""
+        now = time.monotonic() if now is None else now
+        pending = []
+        with self._flush_lock:
+            with self._lock:
+                for room_id, doc in list(self._docs.items()):
+                    if doc.dirty_since is not None:
+                        if (now - doc.last_change >= FLUSH_IDLE_DELAY
+                                or now - doc.dirty_since >= FLUSH_MAX_DELAY):
+                            pending.append((room_id, doc.content))
+                            doc.dirty_since = None
+                    elif doc.holders == 0 and now - doc.last_access >= EVICT_IDLE_SECONDS:
+                        del self._docs[room_id]
+            self._write(pending)
+        return len(pending)
+
+    def flush_all(self):
+        """写回所有脏文档（关闭服务时调用）"""
+        pending = []
+        with self._flush_lock:
+            with self._lock:
+                for room_id, doc in self._docs.items():
+                    if doc.dirty_since is not None:
+                        pending.append((room_id, doc.content))
+                        doc.dirty_since = None
+            self._write(pending)
+        return len(pending)
+
+    def _write(self, pending):
+        """写入数据库，调用方需持有 _flush_lock"""
+        if not pending:
+            return
+        try:
+            saved = set(db.save_room_contents(pending))
+        except Exception:
+            # 写入失败时重新标记为脏数据，等待下一次写回
+            now = time.monotonic()
+            with self._lock:
+                for room_id, content in pending:
+                    doc = self._docs.get(room_id)
+                    if doc is None:
+                        doc = self._docs[room_id] = RoomDocument(room_id, content)
+                    if doc.dirty_since is None:
+                        doc.dirty_since = now
+            raise
+        with self._lock:
+            self.rows_written += len(saved)
+            self.flushes += 1
+
+        # 每次写回记录一个历史版本，由后台任务编码和写入（见 revisions.py 的 record_pending）；
+        # 已被删除的房间没有写入，也不记录版本，否则同名房间重新创建后会看到删除前的内容
+        revision_store.enqueue([(room_id, content) for room_id, content in pending if room_id in saved])
+
+    def stats(self):
+        """写回统计"""
+        with self._lock:
+            return {
+                'active_rooms': len(self._docs),
+                'dirty_rooms': sum(1 for d in self._docs.values() if d.dirty_since is not None),
+                'updates': self.updates,
+                'rows_written': self.rows_written,
+                'flushes': self.flushes,
+                'writes_saved': self.updates - self.rows_written,
+                'flush_interval': FLUSH_INTERVAL,
+                'idle_delay': FLUSH_IDLE_DELAY,
+                'max_delay': FLUSH_MAX_DELAY
+            }
+
+
+room_store = RoomStore()
@@ -0,0 +1,91 @@
+"""
+房间访问令牌
+验证房间密码后签发一个绑定房间和密码版本的 HMAC 令牌，客户端加入房间时出示令牌，
+服务端只需校验签名和缓存的密码版本（见 room_cache.py），不必每次读库、重新计算密码哈希，
+也不必保存明文密码。修改密码时更换密码版本（见 db.admin_reset_room_password），之前签发的令牌立即失效
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+
+import db
+from room_cache import room_cache
+
+# 令牌有效期（秒），每次成功加入房间时签发新令牌
+ROOM_TOKEN_TTL = int(os.environ.get('NETCLIP_ROOM_TOKEN_TTL', str(12 * 3600)))
+# 签名密钥，未设置时生成一个保存在数据库中，共享同一数据库的进程使用同一密钥
+ROOM_TOKEN_SECRET = os.environ.get('NETCLIP_ROOM_TOKEN_SECRET', '')
+
+
+class RoomAccess:
+    """签发和校验房间令牌"""
+
+    def __init__(self, secret=ROOM_TOKEN_SECRET, ttl=ROOM_TOKEN_TTL):
+        self._secret = secret.encode() if secret else None
+        self.ttl = ttl
+        self.issued = 0
+        self.accepted = 0
+        self.rejected = 0
+
+    def _key(self):
+        if self._secret is None:
+            self._secret = db.get_or_create_setting('room_token_secret', lambda: secrets.token_hex(32)).encode()
+        return self._secret
+
+    def _sign(self, room_id, epoch, expires):
+        message = f'{room_id}\n{epoch}\n{expires}'.encode()
+        digest = hmac.new(self._key(), message, hashlib.sha256).digest()[:16]
+        return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+    def lookup(self, room_id):
+        """房间的 (是否公开, 密码版本)，房间不存在时返回 None"""
+        meta = room_cache.get(room_id)
+        if meta is None:
+            return None
+        return meta['password_hash'] is None, meta['password_epoch']
+
+    def issue(self, room_id, now=None):
+        """为房间当前的密码版本签发令牌，房间不存在时返回 None"""
+        access = self.lookup(room_id)
+        if access is None:
+            return None
+        expires = int(now if now is not None else time.time()) + self.ttl
+        self.issued += 1
+        return f'{access[1]:x}.{expires:x}.{self._sign(room_id, access[1], expires)}'
+
+    def allows(self, room_id, token, now=None):
+        """令牌是否允许加入房间（公开房间无需令牌）"""
+        access = self.lookup(room_id)
+        if access is None:
+            return False
+        if access[0]:
+            return True
+
+        try:
+            epoch, expires, signature = token.split('.')
+            epoch, expires = int(epoch, 16), int(expires, 16)
+        except (AttributeError, ValueError):
+            self.rejected += 1
+            return False
+        now = now if now is not None else time.time()
+        if (epoch != access[1] or expires < now
+                or not hmac.compare_digest(signature, self._sign(room_id, epoch, expires))):
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    def stats(self):
+        return {
+            'token_ttl': self.ttl,
+            'issued': self.issued,
+            'accepted': self.accepted,
+            'rejected': self.rejected
+        }
+
+
+# 全局实例
+room_access = RoomAccess()
@@ -0,0 +1,123 @@
+"""
+异步运行时
+NETCLIP_ASYNC_MODE 选择 Socket.IO 的并发模型：
+    threading  每个连接一个系统线程（开发默认）
+    gevent     协程，单进程可维持数千个空闲 WebSocket 连接
+    eventlet   协程，同上
+协程模式下 sqlite3 和大块文件读写会阻塞事件循环，通过 blocking()/offload() 放到原生线程池执行
+"""
+import functools
+import os
+import threading
+
+ASYNC_MODES = ('threading', 'gevent', 'eventlet')
+
+ASYNC_MODE = os.environ.get('NETCLIP_ASYNC_MODE', 'threading').lower()
+if ASYNC_MODE not in ASYNC_MODES:
+    raise ValueError(f'不支持的 NETCLIP_ASYNC_MODE: {ASYNC_MODE}，可选 {", ".join(ASYNC_MODES)}')
+
+# 是否为协程模式
+COOPERATIVE = ASYNC_MODE != 'threading'
+
+# 协程模式下执行阻塞调用的原生线程数
+BLOCKING_THREADS = int(os.environ.get('NETCLIP_BLOCKING_THREADS', '16'))
+
+_patched = False
+_hub_thread = None
+_native_get_ident = threading.get_ident
+
+
+def patch():
+    """
+    协程模式下替换标准库的阻塞实现（monkey patch），必须在导入 server 等模块之前调用
+    threading 模式下不做任何事
+    """
+    global _patched, _hub_thread, _native_get_ident
+    if _patched or not COOPERATIVE:
+        return
+    _patched = True
+
+    if ASYNC_MODE == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+        from gevent import get_hub
+        get_hub().threadpool.maxsize = BLOCKING_THREADS
+        _native_get_ident = monkey.get_original('_thread', 'get_ident')
+        try:
+            import geventwebsocket  # noqa: F401
+        except ImportError:
+            # 退回 simple-websocket 时，发送缓冲区满会只写出部分帧，网络慢的客户端会收到损坏的数据
+            print('[Runtime] 未安装 gevent-websocket，建议 pip install gevent-websocket')
+    else:
+        os.environ.setdefault('EVENTLET_THREADPOOL_SIZE', str(BLOCKING_THREADS))
+        import eventlet
+        eventlet.monkey_patch()
+        _native_get_ident = eventlet.patcher.original('_thread').get_ident
+
+    # 所有协程都运行在调用 patch() 的线程中
+    _hub_thread = _native_get_ident()
+
+
+def native_lock():
+    """不受 monkey patch 影响的锁，用于在原生线程池中共享的数据结构"""
+    if ASYNC_MODE == 'gevent':
+        from gevent import monkey
+        return monkey.get_original('_thread', 'allocate_lock')()
+    if ASYNC_MODE == 'eventlet':
+        import eventlet.patcher
+        return eventlet.patcher.original('_thread').allocate_lock()
+    return threading.Lock()
+
+
+def native_ident():
+    """当前系统线程的 ID（协程模式下 threading.get_ident 返回的是协程 ID）"""
+    return _native_get_ident()
+
+
+def native_thread(func):
+    """启动不受 monkey patch 影响的系统线程，线程内只能使用原生的阻塞调用（如 native_sleep），不能使用协程 API"""
+    if ASYNC_MODE == 'gevent':
+        from gevent import monkey
+        start = monkey.get_original('_thread', 'start_new_thread')
+    elif ASYNC_MODE == 'eventlet':
+        import eventlet.patcher
+        start = eventlet.patcher.original('_thread').start_new_thread
+    else:
+        import _thread
+        start = _thread.start_new_thread
+    start(func, ())
+
+
+def native_sleep(seconds):
+    """在 native_thread() 启动的线程中休眠"""
+    if ASYNC_MODE == 'gevent':
+        from gevent import monkey
+        return monkey.get_original('time', 'sleep')(seconds)
+    if ASYNC_MODE == 'eventlet':
+        import eventlet.patcher
+        return eventlet.patcher.original('time').sleep(seconds)
+    import time
+    return time.sleep(seconds)
+
+
+def offload(func, *args, **kwargs):
+    """在原生线程中执行阻塞调用，当前协程等待结果期间事件循环继续运行"""
+    if not _patched or _native_get_ident() != _hub_thread:
+        # threading 模式，或已经在原生线程中
+        return func(*args, **kwargs)
+    if ASYNC_MODE == 'gevent':
+        from gevent import get_hub
+        return get_hub().threadpool.apply(func, args, kwargs)
+    from eventlet import tpool
+    return tpool.execute(func, *args, **kwargs)
+
+
+def blocking(func):
+    """装饰器：协程模式下调用 func 时自动 offload"""
+    if not COOPERATIVE:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return offload(func, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,40 @@
+"""
+生产环境启动入口
+
+用法：
+    python serve.py --mode gevent --host 0.0.0.0 --port 8080
+
+--mode 可选 threading / gevent / eventlet，也可通过 NETCLIP_ASYNC_MODE 环境变量设置。
+默认的 gevent 模式所需的 gevent 和 gevent-websocket 已列在 requirements.txt 中，eventlet 模式需要另外安装 eventlet，
+单进程即可维持数千个空闲 WebSocket 连接，不再为每个连接占用一个系统线程
+"""
+import argparse
+import os
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Netclip 服务器')
+    parser.add_argument('--mode', choices=('threading', 'gevent', 'eventlet'),
+                        default=os.environ.get('NETCLIP_ASYNC_MODE', 'gevent'),
+                        help='并发模型（默认 gevent）')
+    parser.add_argument('--host', default=os.environ.get('NETCLIP_HOST', '0.0.0.0'), help='监听地址')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('NETCLIP_PORT', '8080')), help='监听端口')
+    parser.add_argument('--blocking-threads', type=int,
+                        help='协程模式下执行数据库和文件读写的原生线程数（NETCLIP_BLOCKING_THREADS）')
+    args = parser.parse_args()
+
+    # 运行时配置必须在导入 runtime 和 server 之前确定
+    os.environ['NETCLIP_ASYNC_MODE'] = args.mode
+    if args.blocking_threads:
+        os.environ['NETCLIP_BLOCKING_THREADS'] = str(args.blocking_threads)
+
+    import runtime
+    runtime.patch()
+
+    import server
+    print(f'Netclip 以 {runtime.ASYNC_MODE} 模式监听 http://{args.host}:{args.port}')
+    server.run_server(host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,43 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file, make_response, redirect
+import runtime
+runtime.patch()  # gevent/eventlet 模式下必须在导入其他模块之前替换标准库
+
+from flask import Flask, Request, request, jsonify, make_response, redirect, g
 from flask_cors import CORS
 from flask_socketio import SocketIO, join_room, leave_room, emit
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.security import safe_join
+import mimetypes
+import base64
+import json
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
+import atexit
+import signal
+import sys
+import time
 import db
+import metrics
+import ot
+from room_store import room_store, FLUSH_INTERVAL
+from revisions import revision_store, REVISION_COMPACT_INTERVAL
+from presence import presence
+from room_cache import room_cache
+from room_tokens import room_access
+from cluster import Cluster, legacy_room, LEGACY_ROOM_PREFIX
+from cursors import CursorBatcher
+from outbound import OutboundQueues
+from file_responses import send_stored_file, IMMUTABLE_CACHE_CONTROL
+from html_shells import ShellCache
+from static_assets import StaticAssets
+from blob_store import blob_store, HashingWriter, hash_file, blob_extension, FILES_FOLDER, IMAGES_FOLDER
+from cleanup import Cleanup, image_references
+from eventlog import event_log, DEBUG
+from profiling import profiler, PROFILE_SAMPLE_MS
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=runtime.ASYNC_MODE)
 
 # 获取当前目录
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -59,8 +88,8 @@ ALLOWED_EXTENSIONS = {
     'wmv': {'mime': 'video/x-ms-wmv', 'max_size': 100 * 1024 * 1024, 'headers': [b'RIFF', b'WMVF']}
 }
 
-def validate_file_security(filename, file_content, mime_type):
-    """验证文件安全性"""
+def validate_file_metadata(filename, mime_type):
+    """验证文件名、扩展名和MIME类型（不需要文件内容）"""
     # 获取文件扩展名
     if '.' not in filename:
         return False, "文件必须包含扩展名"
@@ -77,17 +106,6 @@ def validate_file_security(filename, file_content, mime_type):
     if mime_type and mime_type != file_config['mime']:
         return False, f"MIME类型不匹配: 期望 {file_config['mime']}, 实际 {mime_type}"
 
-    # 检查文件头（Magic Number）
-    if file_config['headers'] and len(file_content) > 0:
-        file_header = file_content[:16]  # 读取前16字节
-        is_valid_header = False
-        for header in file_config['headers']:
-            if file_header.startswith(header):
-                is_valid_header = True
-                break
-        if not is_valid_header:
-            return False, "文件头验证失败，文件可能已损坏或被篡改"
-
     # 检查文件名安全性
     dangerous_chars = ['..', '/', '\\', ':', '*', '?', '"', '<', '>', '|', '~', '$']
     for char in dangerous_chars:
@@ -100,13 +118,241 @@ def validate_file_security(filename, file_content, mime_type):
 
     return True, "验证通过"
 
-# 存储实时用户信息（不持久化）
-users = {}  # {socket_id: {'username': str, 'room': str, 'session_id': str}}
+def validate_file_header(filename, file_header):
+    """检查文件头（Magic Number），file_header 为文件开头至少16字节（文件更短时为全部内容）"""
+    file_config = ALLOWED_EXTENSIONS[filename.split('.').pop().lower()]
+    if file_config['headers'] and len(file_header) > 0:
+        file_header = file_header[:16]  # 读取前16字节
+        for header in file_config['headers']:
+            if file_header.startswith(header):
+                return True, "验证通过"
+        return False, "文件头验证失败，文件可能已损坏或被篡改"
+    return True, "验证通过"
+
+def validate_file_security(filename, file_content, mime_type):
+    """验证文件安全性"""
+    is_valid, message = validate_file_metadata(filename, mime_type)
+    if not is_valid:
+        return is_valid, message
+    return validate_file_header(filename, file_content)
+
+def format_size_limit(max_size):
+    return f'文件大小超出限制，最大允许 {max_size / 1024 / 1024:.0f}MB'
+
+# ==================== 流式上传 ====================
+
+# 上传数据分块大小
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# multipart 请求中除文件内容外允许的额外字节（边界、表单字段等）
+MULTIPART_OVERHEAD = 64 * 1024
+
+class UploadRejected(Exception):
+    """上传在接收过程中被拒绝（不继承 ValueError，避免被表单解析器静默吞掉）"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+class StreamingUploadFile(HashingWriter):
+    """
+    上传文件的接收容器：数据到达时直接写入 files/ 下的临时文件并计算 SHA-256，
+    首个分块进行文件头校验，超过大小限制立即中止，内存占用与文件大小无关
+    """
 
-# 配置图片保存路径
-UPLOAD_FOLDER = 'images'
+    def __init__(self, filename, directory):
+        super().__init__(directory)
+        self.filename = filename
+        self.max_size = ALLOWED_EXTENSIONS[filename.split('.').pop().lower()]['max_size']
+        self._header = b''
+        self._header_checked = False
+
+    def write(self, data):
+        if self.size + len(data) > self.max_size:
+            raise UploadRejected(format_size_limit(self.max_size), 413)
+        if not self._header_checked:
+            self._header += data[:16 - len(self._header)]
+            if len(self._header) >= 16:
+                self._check_header()
+        super().write(data)
+        return len(data)
+
+    def _check_header(self):
+        self._header_checked = True
+        is_valid, error_msg = validate_file_header(self.filename, self._header)
+        if not is_valid:
+            raise UploadRejected(f'文件验证失败: {error_msg}')
+
+    def finish(self):
+        """接收完成后的最终校验（不足16字节的小文件在此检查文件头）"""
+        if not self._header_checked:
+            self._check_header()
+        self.close()
+
+class UploadRequest(Request):
+    """房间文件上传直接流式写入磁盘，其他请求使用默认处理"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint != 'upload_room_file' or not filename:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+        # 在接收任何文件数据之前先校验文件名、扩展名和MIME类型
+        is_valid, error_msg = validate_file_metadata(filename, content_type)
+        if not is_valid:
+            raise UploadRejected(f'文件验证失败: {error_msg}')
+
+        max_size = ALLOWED_EXTENSIONS[filename.split('.').pop().lower()]['max_size']
+        if total_content_length and total_content_length > max_size + MULTIPART_OVERHEAD:
+            raise UploadRejected(format_size_limit(max_size), 413)
+
+        container = StreamingUploadFile(filename, app.config['FILES_FOLDER'])
+        g.setdefault('upload_files', []).append(container)
+        return container
+
+app.request_class = UploadRequest
+
+@app.teardown_request
+def cleanup_upload_files(exc):
+    """请求结束时删除未被保存的上传临时文件"""
+    for container in g.pop('upload_files', []):
+        container.discard()
+
+def request_route():
+    """请求匹配的路由模板（而不是实际路径，避免房间 ID 等产生大量序列）"""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profile_call = profiler.begin('route', request_route(), detail={
+        'method': request.method,
+        'path': request.path,
+        'content_length': request.content_length
+    })
+
+@app.teardown_request
+def finish_profile_call(exc):
+    """慢请求记录和调用剖析，见 profiling.py"""
+    profiler.end(g.pop('profile_call', None))
+
+@app.after_request
+def record_request_metrics(response):
+    """按路由模板记录请求耗时和状态码"""
+    started = g.get('request_started')
+    if metrics.METRICS_ENABLED and started is not None:
+        route = request_route()
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route, request.method)
+        metrics.HTTP_REQUESTS.inc(route, request.method, str(response.status_code))
+    return response
+
+# 实时在线用户信息（不持久化），按连接和房间双向索引，见 presence.py
+# 房间事件经过连接级发送队列，网络慢的连接只保留最新状态，见 outbound.py
+outbound = OutboundQueues(
+    socketio,
+    snapshot=lambda room_id: room_store.snapshot(room_id) if cluster.owns(room_id) else None,
+    recipients=presence.count,
+    full_content_only=presence.full_content_only,
+    room_of=presence.room_of
+)
+
+# 多进程部署时通过消息总线共享成员和文档，见 cluster.py
+cluster = Cluster(socketio, outbound, room_store, presence, room_cache)
+
+# 光标位置按房间合并，每个周期广播一条 cursor_batch，见 cursors.py
+cursor_batcher = CursorBatcher(
+    send=lambda room_id, payload: cluster.broadcast('cursor_batch', payload, room_id),
+    recipients=presence.count
+)
+
+# 已启动的后台任务
+_background_tasks = set()
+
+def ensure_background_task(task):
+    """按需启动后台任务（每个任务只启动一次）"""
+    if task not in _background_tasks:
+        _background_tasks.add(task)
+        socketio.start_background_task(task)
+
+def outbound_checker():
+    """后台检查连接发送队列的积压"""
+    outbound.run(socketio.sleep)
+
+def cursor_sender():
+    """后台合并发送光标位置"""
+    cursor_batcher.run(socketio.sleep)
+
+def content_flusher():
+    """后台定期将内存中的房间文档写回数据库"""
+    while True:
+        socketio.sleep(FLUSH_INTERVAL)
+        try:
+            room_store.flush_due()
+        except Exception as e:
+            event_log.error('flush_failed', '写回房间内容失败: {error}', error=str(e))
+
+def revision_recorder():
+    """后台记录写回产生的历史版本（delta 编码不在写回锁内进行）"""
+    while True:
+        socketio.sleep(FLUSH_INTERVAL)
+        try:
+            revision_store.record_pending()
+        except Exception as e:
+            event_log.error('revision_record_failed', '记录历史版本失败: {error}', error=str(e))
+
+def revision_compactor():
+    """后台定期精简房间历史版本"""
+    while True:
+        socketio.sleep(REVISION_COMPACT_INTERVAL)
+        try:
+            removed = revision_store.compact()
+            if removed:
+                event_log.info('revisions_compacted', '精简历史版本 {removed} 个', removed=removed)
+        except Exception as e:
+            event_log.error('revisions_compact_failed', '精简历史版本失败: {error}', error=str(e))
+
+def purge_room(room_id):
+    """删除房间及其文件记录、历史版本，丢弃所有进程中的文档和缓存，返回是否删除"""
+    if not db.delete_room(room_id):
+        return False
+    cluster.evict_document(room_id)
+    cluster.room_changed(room_id)
+    revision_store.forget(room_id)
+    return True
+
+# 文件和图片的实际删除、孤立文件回收和房间过期由后台任务分批执行，见 cleanup.py
+cleanup = Cleanup(
+    blob_store,
+    live_contents=lambda: [(room_id, room_store.get_content(room_id)) for room_id in room_store.room_ids()],
+    room_active=lambda room_id: cluster.count(room_id) > 0,
+    delete_room=purge_room,
+    upload_active=lambda upload_id: db.get_upload_session(upload_id) is not None,
+    revision_references=lambda room_id: revision_store.collect(room_id, image_references),
+    sleep=socketio.sleep
+)
+
+def cleanup_worker():
+    """后台处理删除队列并定期清理"""
+    cleanup.run()
+
+def schedule_cleanup():
+    """有文件等待删除时唤醒后台清理任务"""
+    ensure_background_task(cleanup_worker)
+    cleanup.wake()
+
+# 关闭服务时写回所有未保存的内容，再记录等待中的历史版本（atexit 按注册的相反顺序执行）
+atexit.register(revision_store.record_pending)
+atexit.register(room_store.flush_all)
+
+# 配置图片保存路径（图片和房间文件均按内容摘要存储，见 blob_store.py）
+UPLOAD_FOLDER = IMAGES_FOLDER
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# 配置房间文件保存路径
+app.config['FILES_FOLDER'] = FILES_FOLDER
+
+# 所有扩展名中最大的上传限制，超出的请求体在解析前直接拒绝
+app.config['MAX_CONTENT_LENGTH'] = max(c['max_size'] for c in ALLOWED_EXTENSIONS.values()) + MULTIPART_OVERHEAD
+
 # 确保目录存在
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
@@ -127,19 +373,11 @@ def upload_image():
         if file.filename == '':
             return jsonify({'error': 'No image selected'}), 400
 
-        # 获取文件扩展名
-        file_extension = os.path.splitext(file.filename)[1]
-
-        # 生成文件名：uuid + 时间戳 + 扩展名
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
-        unique_filename = f"{uuid.uuid4()}_{timestamp}{file_extension}"
-
-        # 保存文件
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(file_path)
+        # 按内容摘要保存，相同图片只保存一份
+        blob_name, _ = blob_store.store('image', file.stream, blob_extension(file.filename))
 
         # 返回图片URL
-        image_url = f"/images/{unique_filename}"
+        image_url = f"/images/{blob_name}"
         return jsonify({'url': image_url}), 200
 
     except Exception as e:
@@ -148,9 +386,45 @@ def upload_image():
 @app.route('/images/<filename>')
 def serve_image(filename):
     """
-    提供图片访问服务
+    提供图片访问服务（文件名为内容摘要，内容不可变，可长期缓存）
     """
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    file_path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+    if file_path is None or not os.path.isfile(file_path):
+        return jsonify({'error': '图片不存在'}), 404
+
+    stat = os.stat(file_path)
+    etag = f'{os.path.splitext(filename)[0]}-{stat.st_size:x}-{int(stat.st_mtime):x}'
+    return send_stored_file(file_path, etag, cache_control=IMMUTABLE_CACHE_CONTROL)
+
+# 静态资源按内容摘要发布（启动时如有变化自动构建，见 static_assets.py）
+static_assets = StaticAssets(os.path.join(BASE_DIR, 'static'))
+static_assets.ensure_built()
+
+# 页面在内存中缓存并预压缩，资源引用改写为带摘要的 URL，
+# 设置 NETCLIP_DEV_RELOAD=1 时文件修改后自动重新加载
+html_shells = ShellCache(BASE_DIR, transform=static_assets.rewrite_html)
+html_shells.preload('tuieditor.html', 'admin.html')
+
+@app.route('/assets/<filename>')
+def serve_asset(filename):
+    """
+    提供带摘要的静态资源（内容不可变，按最佳压缩编码返回并永久缓存）
+    """
+    resolved = static_assets.resolve(filename, request.accept_encodings)
+    if resolved is None:
+        return jsonify({'error': '资源不存在'}), 404
+
+    path, encoding, entry = resolved
+    response = send_stored_file(
+        path,
+        f"{entry['digest'][:16]}-{encoding}",
+        mimetype=mimetypes.guess_type(filename)[0],
+        cache_control=IMMUTABLE_CACHE_CONTROL
+    )
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    return response
 
 @app.route('/')
 def index():
@@ -164,175 +438,254 @@ def public_room():
     """
     提供默认public房间
     """
-    try:
-        with open(os.path.join(BASE_DIR, 'tuieditor.html'), 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        return "tuieditor.html not found", 404
+    return html_shells.response('tuieditor.html')
 
 @app.route('/<room_id>')
 def room_page(room_id):
     """
     房间页面 - /room_id 形式访问
     """
-    try:
-        with open(os.path.join(BASE_DIR, 'tuieditor.html'), 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        return "tuieditor.html not found", 404
+    return html_shells.response('tuieditor.html')
 
 @app.route('/tuieditor.html')
 def editor():
     """
     提供编辑器页面
     """
-    try:
-        with open(os.path.join(BASE_DIR, 'tuieditor.html'), 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        return "tuieditor.html not found", 404
+    return html_shells.response('tuieditor.html')
 
 @app.route('/admin')
 def admin():
     """
     提供管理员页面
     """
-    try:
-        with open(os.path.join(BASE_DIR, 'admin.html'), 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        return "admin.html not found", 404
+    return html_shells.response('admin.html')
 
 # ==================== WebSocket 协作功能 ====================
 
-@socketio.on('join')
+def socket_event(event):
+    """注册 Socket.IO 事件处理函数，记录处理耗时，并登记为可剖析的调用"""
+    def decorator(handler):
+        handler = profiler.traced('event', event)(handler)
+        return socketio.on(event)(metrics.timed(metrics.SOCKET_EVENT_SECONDS, event)(handler))
+    return decorator
+
+@socket_event('join')
 def handle_join(data):
     """用户加入房间"""
     room_id = data.get('room', 'default')
     username = data.get('username', '')
     session_id = data.get('session_id', '')
-
-    # 验证密码
-    password = data.get('password', None)
-
-    # 从Cookie或会话中获取已保存的密码
-    if not password and session_id:
-        saved_password = db.get_session_password(session_id, room_id)
-        if saved_password:
-            password = saved_password
-
-    if not db.verify_room_password(room_id, password):
-        emit('auth_failed', {'message': '密码错误'})
+    # 客户端声明支持增量协议时只接收 content_op，否则另外接收全量的 content_update
+    supports_ops = data.get('ops') is True
+    if not isinstance(room_id, str) or room_id.startswith(LEGACY_ROOM_PREFIX):
+        emit('auth_failed', {'message': '房间ID无效'})
         return
+    cluster.start()
 
-    # 记录用户信息
-    users[request.sid] = {'username': username, 'room': room_id, 'session_id': session_id}
+    # 校验 /api/room/verify 签发的令牌（只在内存中校验签名和密码版本），
+    # 没有有效令牌时才按密码验证（兼容旧客户端）
+    token = data.get('token')
+    password = data.get('password')
+    if not room_access.allows(room_id, token):
+        if not room_cache.verify_password(room_id, password):
+            emit('auth_failed', {'message': '密码错误'})
+            return
+    is_public, _ = room_access.lookup(room_id) or (True, None)
+    if not is_public:
+        # 续期令牌，长时间在线的连接断线重连后仍可直接加入
+        emit('room_token', {'room': room_id, 'token': room_access.issue(room_id)})
+
+    # 记录用户信息，同一连接重复加入时先离开之前的房间
+    start_background_tasks()
+    member, previous = presence.add(request.sid, username, room_id, session_id, supports_ops)
+    if previous:
+        leave_member_rooms(previous)
+        cluster.remove_member(previous)
+        cluster.release_document(previous.room, legacy=not previous.ops)
+        broadcast_user_left(previous)
 
     # 加入房间
     join_room(room_id)
-
-    # 获取房间当前内容（从数据库）
-    room_content = db.get_room_content(room_id)
-
-    # 向新用户发送当前内容
-    emit('init_content', {'content': room_content})
-
-    # 获取当前房间所有用户列表（包括自己）
-    user_list = [u['username'] for u in users.values() if u['room'] == room_id]
-
-    # 向新用户发送当前用户列表
-    emit('user_list_update', {'users': user_list})
-
-    # 通知房间内其他用户有新用户加入
-    emit('user_joined', {
-        'username': username,
-        'users': user_list
-    }, to=room_id, include_self=False)
-
-    print(f"[WebSocket] 用户 {username} 加入房间 {room_id}, 当前在线人数: {len(user_list)}")
-
-@socketio.on('leave')
+    if not supports_ops:
+        join_room(legacy_room(room_id))
+    cluster.add_member(member)
+
+    # 向新用户发送当前内容及版本号（增量协议以此为基准），
+    # 由房间文档的持有进程发送（首次加入时从数据库加载）
+    cluster.open_document(room_id, request.sid, legacy=not supports_ops)
+
+    # 向新用户发送当前完整成员列表（包括自己）
+    members = cluster.members(room_id)
+    outbound.send(request.sid, 'user_list_update', {
+        'users': [m['username'] for m in members],
+        'members': members,
+        'self_id': member.member_id
+    })
+
+    # 通知房间内其他用户有新用户加入（增量事件，定期附带完整列表；
+    # 房间内有旧客户端时附带用户名列表 users，旧客户端据此刷新在线列表）
+    payload = {'id': member.member_id, 'username': username, 'count': len(members)}
+    if presence.full_sync_due(room_id):
+        payload['members'] = members
+    if cluster.has_legacy_members(room_id):
+        payload['users'] = [m['username'] for m in members]
+    cluster.broadcast('user_joined', payload, room_id, skip_sid=request.sid)
+
+    event_log.info('join', '用户 {user} 加入房间 {room}, 当前在线人数: {online}',
+                   room=room_id, sid=request.sid, user=username, online=len(members))
+
+def leave_member_rooms(member):
+    """离开成员加入的 Socket.IO 房间（旧客户端还加入了全量内容房间）"""
+    leave_room(member.room)
+    if not member.ops:
+        leave_room(legacy_room(member.room))
+
+def broadcast_user_left(member):
+    """通知房间内其他用户有用户离开"""
+    cursor_batcher.discard(member.room, member.member_id)
+    payload = {
+        'id': member.member_id,
+        'username': member.username,
+        'count': cluster.count(member.room)
+    }
+    full_sync = presence.full_sync_due(member.room)
+    legacy = cluster.has_legacy_members(member.room)
+    if full_sync or legacy:
+        members = cluster.members(member.room)
+        if full_sync:
+            payload['members'] = members
+        if legacy:
+            payload['users'] = [m['username'] for m in members]
+    cluster.broadcast('user_left', payload, member.room)
+
+def leave_current_room(member):
+    """已从 presence 移除的成员离开房间，释放文档并通知房间内其他用户"""
+    leave_member_rooms(member)
+    cluster.remove_member(member)
+    cluster.release_document(member.room, legacy=not member.ops)
+    broadcast_user_left(member)
+
+@socket_event('leave')
 def handle_leave(data):
     """用户离开房间"""
-    if request.sid in users:
-        user = users[request.sid]
-        room_id = user['room']
-        username = user['username']
-
-        # 离开房间
-        leave_room(room_id)
-
-        # 移除用户信息
-        del users[request.sid]
-
-        # 通知房间内其他用户
-        user_list = [u['username'] for u in users.values() if u['room'] == room_id]
-        emit('user_left', {
-            'username': username,
-            'users': user_list
-        }, to=room_id)
+    member = presence.remove(request.sid)
+    if member:
+        leave_current_room(member)
+        event_log.info('leave', '用户 {user} 离开房间 {room}', room=member.room, sid=request.sid, user=member.username)
 
-        print(f"[WebSocket] 用户 {username} 离开房间 {room_id}")
-
-@socketio.on('content_change')
+def editing_member():
+    """
+    发送编辑的成员，未加入房间时返回 None
+    房间已被删除时（删除不会断开已加入的连接）让成员离开并通知客户端，不再接受编辑，
+    否则编辑会在内存中重建一个空文档，写回和历史版本会泄露给之后同名的新房间
+    """
+    member = presence.get(request.sid)
+    if member is None or room_cache.exists(member.room):
+        return member
+    if presence.remove(request.sid) is member:
+        leave_current_room(member)
+    emit('auth_failed', {'message': '房间已被删除'})
+    event_log.info('edit_deleted_room', '用户 {user} 编辑已删除的房间 {room}，已离开',
+                   room=member.room, sid=request.sid, user=member.username)
+    return None
+
+@socket_event('content_change')
 def handle_content_change(data):
-    """处理内容变更"""
-    room_id = data.get('room', 'default')
+    """处理内容变更（全量内容，兼容旧客户端）"""
+    # 只接受发送者已加入（已通过密码或令牌校验）且仍存在的房间，不信任客户端提供的房间号
+    member = editing_member()
+    if member is None:
+        return
+    room_id = member.room
     content = data.get('content', '')
-    username = users.get(request.sid, {}).get('username', 'Unknown')
+    username = member.username
 
-    # 保存房间内容到数据库
-    db.save_room_content(room_id, content)
+    # 由持有进程更新内存文档（后台线程合并写回数据库）并广播给房间内其他用户
+    cluster.submit_content(room_id, request.sid, username, content, datetime.now().isoformat())
 
-    # 广播给房间内其他用户
-    emit('content_update', {
-        'content': content,
-        'username': username,
-        'timestamp': datetime.now().isoformat()
-    }, to=room_id, include_self=False)
+    event_log.info('content_change', '房间 {room} - {user} 更新内容 (长度: {size})',
+                   room=room_id, sid=request.sid, user=username, size=len(content))
 
-    print(f"[WebSocket] 房间 {room_id} - {username} 更新内容 (长度: {len(content)})")
+@socket_event('content_op')
+def handle_content_op(data):
+    """处理增量编辑操作"""
+    member = editing_member()
+    if member is None:
+        return
+    room_id = member.room
+    base_version = data.get('version')
+    username = member.username
 
-@socketio.on('cursor_move')
+    try:
+        if not isinstance(base_version, int) or isinstance(base_version, bool):
+            raise ot.OperationError('缺少基准版本号')
+        ops = ot.normalize_ops(data.get('ops'))
+    except ot.OperationError as e:
+        event_log.warning('content_op_invalid', '房间 {room} - {user} 的编辑操作无效: {error}',
+                          room=room_id, sid=request.sid, user=username, error=str(e))
+        ops = None
+
+    if ops is not None and event_log.enabled('content_op', DEBUG):
+        # 插入文本的总长度作为负载大小
+        event_log.debug('content_op', '房间 {room} - {user} 提交 {ops} 个操作 (基准版本: {version})',
+                        room=room_id, sid=request.sid, user=username, version=base_version, ops=len(ops),
+                        size=sum(len(op['text']) for op in ops if op['op'] == 'insert'))
+
+    # 由持有进程变换并应用，确认发送者的操作并向其他用户广播操作本身；
+    # 基准版本过旧或操作无效时向发送者发送全量内容重新同步
+    cluster.submit_ops(room_id, request.sid, username, base_version, ops)
+
+@socket_event('cursor_move')
 def handle_cursor_move(data):
-    """处理光标位置同步"""
-    room_id = data.get('room', 'default')
-    cursor_position = data.get('position', 0)
-    username = users.get(request.sid, {}).get('username', 'Unknown')
+    """处理光标位置同步（合并后按周期广播，见 cursors.py）"""
+    member = presence.get(request.sid)
+    position = data.get('position', 0)
+    if member is None or not isinstance(position, int) or isinstance(position, bool):
+        return
 
-    # 广播光标位置给其他用户
-    emit('cursor_update', {
-        'username': username,
-        'position': cursor_position
-    }, to=room_id, include_self=False)
+    event_log.debug('cursor_move', '房间 {room} - {user} 光标位置 {position}',
+                    room=member.room, sid=request.sid, user=member.username, position=position)
+    ensure_background_task(cursor_sender)
+    cursor_batcher.update(member.room, member.member_id, member.username, position)
 
-@socketio.on('disconnect')
+@socket_event('disconnect')
 def handle_disconnect():
     """用户断开连接"""
-    if request.sid in users:
-        user = users[request.sid]
-        room_id = user['room']
-        username = user['username']
-
-        # 移除用户信息
-        del users[request.sid]
+    outbound.discard(request.sid)
+    member = presence.remove(request.sid)
+    if member:
+        cluster.remove_member(member)
+        cluster.release_document(member.room, legacy=not member.ops)
 
         # 通知房间内其他用户
-        user_list = [u['username'] for u in users.values() if u['room'] == room_id]
-        emit('user_left', {
-            'username': username,
-            'users': user_list
-        }, to=room_id)
+        broadcast_user_left(member)
 
-        print(f"[WebSocket] 用户 {username} 断开连接")
+        event_log.info('disconnect', '用户 {user} 断开连接', room=member.room, sid=request.sid, user=member.username)
 
 # 房间管理API
+# 房间过期时间的范围（秒）
+ROOM_TTL_MIN = 60
+ROOM_TTL_MAX = 365 * 24 * 3600
+
+def parse_room_ttl(value):
+    """房间过期时间（秒），未设置时返回 None，无效时抛出 ValueError"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or not ROOM_TTL_MIN <= value <= ROOM_TTL_MAX:
+        raise ValueError(f'过期时间应为 {ROOM_TTL_MIN} 到 {ROOM_TTL_MAX} 之间的秒数')
+    return value
+
 @app.route('/api/room/create', methods=['POST'])
 def create_room():
-    """创建新房间"""
+    """创建新房间，ttl 为无活动后自动删除的秒数（可选，剪贴板式的临时房间）"""
     data = request.get_json() or {}
     password = data.get('password')
     custom_room_id = data.get('room_id')
+    try:
+        ttl_seconds = parse_room_ttl(data.get('ttl'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     # 如果提供了自定义room_id，使用它；否则生成8位房间ID
     if custom_room_id:
@@ -341,16 +694,18 @@ def create_room():
         # 生成8位房间ID
         room_id = str(uuid.uuid4())[:8]
 
-    # 创建房间（数据库中）
-    if db.create_room(room_id, password):
-        return jsonify({
-            'room_id': room_id,
-            'url': f'/{room_id}'
-        }), 200
+    # 创建房间（数据库中），私密房间同时签发令牌，创建者无需再次验证密码
+    if db.create_room(room_id, password, ttl_seconds):
+        # 丢弃各进程中该 ID 不存在的缓存
+        cluster.room_changed(room_id)
+        result = {'room_id': room_id, 'url': f'/{room_id}'}
+        if password:
+            result['token'] = room_access.issue(room_id)
+        return jsonify(result), 200
     else:
         error_msg = '房间创建失败'
         # 检查是否是room_id已存在
-        if db.get_room(room_id):
+        if room_cache.exists(room_id):
             error_msg = f'房间ID "{room_id}" 已存在，请使用其他ID'
         return jsonify({'error': error_msg}), 500
 
@@ -360,13 +715,13 @@ def verify_room():
     data = request.get_json() or {}
     room_id = data.get('room_id')
     password = data.get('password')
-    session_id = data.get('session_id')
 
     if not room_id:
         return jsonify({'error': '缺少房间ID'}), 400
+    cluster.start()
 
     # 首先检查房间是否存在
-    room_info = db.get_room(room_id)
+    room_info = room_cache.get(room_id)
     if not room_info:
         return jsonify({
             'verified': False,
@@ -374,20 +729,18 @@ def verify_room():
             'message': '房间不存在'
         }), 200
 
-    # 房间存在，验证密码
-    if db.verify_room_password(room_id, password):
-        # 保存密码到会话
-        if session_id:
-            db.set_session_password(session_id, room_id, password)
-
+    # 房间存在，验证密码，私密房间签发令牌（加入房间时出示，服务端不保存密码）
+    if room_cache.verify_password(room_id, password):
         is_public = room_info['password_hash'] is None
-
-        return jsonify({
+        result = {
             'verified': True,
             'exists': True,
             'room_id': room_id,
             'is_public': is_public
-        }), 200
+        }
+        if not is_public:
+            result['token'] = room_access.issue(room_id)
+        return jsonify(result), 200
     else:
         return jsonify({
             'verified': False,
@@ -398,8 +751,7 @@ def verify_room():
 @app.route('/api/room/<room_id>/users', methods=['GET'])
 def get_room_users(room_id):
     """获取房间内用户列表"""
-    user_list = [u['username'] for u in users.values() if u['room'] == room_id]
-    return jsonify({'users': user_list}), 200
+    return jsonify({'users': cluster.usernames(room_id)}), 200
 
 @app.route('/api/room/reset-password', methods=['POST'])
 def reset_password():
@@ -412,13 +764,17 @@ def reset_password():
     if not room_id:
         return jsonify({'error': '缺少房间ID'}), 400
 
-    # 重置密码
+    # 重置密码，之前签发的令牌失效，为修改者签发新令牌
     if db.reset_room_password(room_id, old_password, new_password):
-        return jsonify({
+        cluster.room_changed(room_id)
+        result = {
             'success': True,
             'message': '密码重置成功',
             'room_id': room_id
-        }), 200
+        }
+        if new_password:
+            result['token'] = room_access.issue(room_id)
+        return jsonify(result), 200
     else:
         return jsonify({
             'success': False,
@@ -433,6 +789,33 @@ def admin_get_rooms():
     rooms = db.get_all_rooms()
     return jsonify({'rooms': rooms}), 200
 
+@app.route('/api/admin/overview', methods=['GET'])
+def admin_overview():
+    """
+    管理后台概览（管理员功能）：按创建时间倒序分页的房间及其文件数、文件总大小、内容长度、
+    最后活动时间和在线人数，第一页附带统计信息。参数 limit、after（上一页的 next_after）
+    """
+    try:
+        after = request.args.get('after')
+        after = decode_page_cursor(after) if after else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = max(min(request.args.get('limit', FILE_PAGE_DEFAULT, type=int), FILE_PAGE_MAX), 1)
+
+    rooms, next_after = db.get_rooms_overview(limit, after)
+    room_ids = [room['room_id'] for room in rooms]
+    online = cluster.room_counts(room_ids)
+    # 内存中的文档可能尚未写回，以内存中的长度为准
+    lengths = room_store.content_lengths(room_ids)
+    for room in rooms:
+        room['online'] = online[room['room_id']]
+        room['content_length'] = lengths.get(room['room_id'], room['content_length'])
+
+    result = {'rooms': rooms, 'next_after': encode_page_cursor(next_after) if next_after else None}
+    if after is None:
+        result['totals'] = {**db.get_overview_totals(), 'online': cluster.online_total()}
+    return jsonify(result), 200
+
 @app.route('/api/admin/reset-password', methods=['POST'])
 def admin_reset_password():
     """管理员重置房间密码（无需旧密码）"""
@@ -443,32 +826,13 @@ def admin_reset_password():
     if not room_id:
         return jsonify({'error': '缺少房间ID'}), 400
 
-    # 管理员重置密码（绕过旧密码验证）
-    conn = db.get_db()
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT room_id FROM rooms WHERE room_id = ?', (room_id,))
-    result = cursor.fetchone()
-
-    if not result:
-        conn.close()
+    # 管理员重置密码（绕过旧密码验证），之前签发的令牌全部失效
+    if not db.admin_reset_room_password(room_id, new_password):
         return jsonify({
             'success': False,
             'message': '房间不存在'
         }), 404
-
-    # 设置新密码
-    new_password_hash = None
-    if new_password:
-        import hashlib
-        new_password_hash = hashlib.sha256(new_password.encode()).hexdigest()
-
-    cursor.execute('UPDATE rooms SET password_hash = ? WHERE room_id = ?', (new_password_hash, room_id))
-    conn.commit()
-    conn.close()
-
-    # 清除所有保存的密码会话
-    db.delete_all_room_sessions(room_id)
+    cluster.room_changed(room_id)
 
     return jsonify({
         'success': True,
@@ -485,8 +849,9 @@ def admin_delete_room():
     if not room_id:
         return jsonify({'error': '缺少房间ID'}), 400
 
-    # 删除房间
-    if db.delete_room(room_id):
+    # 删除房间，实际文件由后台清理任务删除
+    if purge_room(room_id):
+        schedule_cleanup()
         return jsonify({
             'success': True,
             'message': '房间已删除',
@@ -498,77 +863,332 @@ def admin_delete_room():
             'message': '房间不存在'
         }), 404
 
+# ==================== 列表分页 ====================
+
+FILE_PAGE_DEFAULT = 50
+FILE_PAGE_MAX = 500
+
+def encode_page_cursor(after):
+    """
+    将上一页最后一行的排序键（如 (uploaded_at, file_id)）编码为不透明的分页游标
+    第二项是唯一列，排序值相同的行按它区分，翻页时不会重复或遗漏
+    """
+    raw = json.dumps(list(after), ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_page_cursor(token):
+    """解析分页游标，格式错误时抛出 ValueError（接口返回 400）"""
+    try:
+        after = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode())
+    except ValueError:
+        raise ValueError('无效的分页游标')
+    if not isinstance(after, list) or len(after) != 2 or not all(isinstance(key, str) for key in after):
+        raise ValueError('无效的分页游标')
+    return tuple(after)
+
+def parse_file_filters():
+    """解析文件列表的过滤参数：ext（逗号分隔）、min_size、max_size"""
+    extensions = [ext.strip().lstrip('.').lower() for ext in request.args.get('ext', '').split(',') if ext.strip()]
+    if any(not ext.isascii() or not ext.isalnum() or len(ext) > 16 for ext in extensions):
+        raise ValueError('无效的扩展名')
+    sizes = {}
+    for name in ('min_size', 'max_size'):
+        value = request.args.get(name)
+        if value is None or value == '':
+            continue
+        if not value.isdigit():
+            raise ValueError(f'无效的 {name}')
+        sizes[name] = int(value)
+    return {'extensions': extensions, **sizes}
+
+def file_listing(room_id=None):
+    """
+    按查询参数返回一页文件列表：limit、after（上一页的 next_after）、过滤参数，
+    lite=1 时只返回列表展示需要的字段；第一页同时返回符合条件的文件总数和总大小
+    """
+    try:
+        filters = parse_file_filters()
+        after = request.args.get('after')
+        after = decode_page_cursor(after) if after else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = max(min(request.args.get('limit', FILE_PAGE_DEFAULT, type=int), FILE_PAGE_MAX), 1)
+    lite = request.args.get('lite') in ('1', 'true')
+
+    files, next_after = db.list_files(room_id, limit, after, lite=lite, **filters)
+    result = {'files': files, 'next_after': encode_page_cursor(next_after) if next_after else None}
+    if after is None:
+        result['total'], result['total_size'] = db.count_files(room_id, **filters)
+    return jsonify(result), 200
+
 # ==================== 文件共享 API ====================
 
 @app.route('/api/room/<room_id>/content', methods=['GET'])
 def get_room_content_api(room_id):
     """获取房间剪贴板内容"""
-    content = db.get_room_content(room_id)
+    content = room_store.get_content(room_id)
     return jsonify({'content': content}), 200
 
+@app.route('/api/room/<room_id>/revisions', methods=['GET'])
+def get_room_revisions(room_id):
+    """列出房间历史版本（按版本号倒序分页，before 为上一页的 next_before）"""
+    limit = max(min(request.args.get('limit', 50, type=int), 200), 1)
+    before = request.args.get('before', type=int)
+    revisions = revision_store.list(room_id, limit, before)
+    return jsonify({
+        'revisions': revisions,
+        'next_before': revisions[-1]['revision'] if len(revisions) == limit else None
+    }), 200
+
+@app.route('/api/room/<room_id>/revisions/<int:revision>', methods=['GET'])
+def get_room_revision(room_id, revision):
+    """获取房间指定历史版本的内容"""
+    result = revision_store.get(room_id, revision)
+    if result is None:
+        return jsonify({'error': '版本不存在'}), 404
+    return jsonify(result), 200
+
+@app.route('/api/admin/revisions', methods=['GET'])
+def admin_revision_stats():
+    """历史版本存储统计（管理员功能）"""
+    return jsonify(revision_store.stats()), 200
+
+@app.route('/api/admin/content-store', methods=['GET'])
+def admin_content_store_stats():
+    """房间文档写回统计（管理员功能）"""
+    return jsonify(room_store.stats()), 200
+
+@app.route('/api/admin/outbound', methods=['GET'])
+def admin_outbound_stats():
+    """连接发送队列积压统计（管理员功能）"""
+    return jsonify(outbound.stats()), 200
+
+@app.route('/api/admin/cursors', methods=['GET'])
+def admin_cursor_stats():
+    """光标合并广播统计（管理员功能）"""
+    return jsonify(cursor_batcher.stats()), 200
+
+@app.route('/api/admin/cluster', methods=['GET'])
+def admin_cluster_stats():
+    """多进程协作状态（管理员功能）"""
+    return jsonify(cluster.stats()), 200
+
+@app.route('/api/admin/room-access', methods=['GET'])
+def admin_room_access_stats():
+    """房间令牌签发、校验和缓存统计（管理员功能）"""
+    return jsonify(room_access.stats()), 200
+
+@app.route('/api/admin/room-cache', methods=['GET'])
+def admin_room_cache_stats():
+    """房间元数据缓存命中统计（管理员功能）"""
+    return jsonify(room_cache.stats()), 200
+
+@app.route('/api/admin/storage', methods=['GET'])
+def admin_storage_stats():
+    """文件存储去重统计（管理员功能）"""
+    return jsonify(blob_store.stats()), 200
+
+@app.route('/api/admin/cleanup', methods=['GET'])
+def admin_cleanup_stats():
+    """后台清理统计：待删除的文件数、已回收的文件和过期房间等（管理员功能）"""
+    return jsonify(cleanup.stats()), 200
+
+@app.route('/api/admin/logging', methods=['GET'])
+def admin_logging_stats():
+    """事件日志统计：已写出、队列满丢弃和采样丢弃的记录数（管理员功能）"""
+    return jsonify(event_log.stats()), 200
+
+# ==================== 运行指标 ====================
+
+def top_room_connections():
+    """本进程中连接数最多的房间 {(room_id,): 连接数}"""
+    counts = sorted(presence.room_counts().items(), key=lambda item: item[1], reverse=True)
+    return {(room_id,): count for room_id, count in counts[:metrics.METRICS_TOP_ROOMS]}
+
+def labelled(stats, keys):
+    """将统计字典中的若干项转为 {(键,): 值}"""
+    return {(key,): stats[key] for key in keys}
+
+# 以下指标在抓取时计算
+metrics.registry.gauge('netclip_connections', '本进程中已加入房间的连接数', lambda: len(presence))
+metrics.registry.gauge('netclip_active_rooms', '本进程中有连接的房间数', lambda: len(presence.room_counts()))
+metrics.registry.gauge('netclip_room_connections', '房间在本进程中的连接数（只输出连接最多的房间）',
+                       top_room_connections, ('room',))
+metrics.registry.gauge('netclip_loaded_documents', '内存中的房间文档数', lambda: len(room_store.room_ids()))
+metrics.registry.gauge('netclip_document_updates_total', '房间文档修改次数',
+                       lambda: room_store.stats()['updates'], kind='counter')
+metrics.registry.gauge('netclip_outbound_backlogged_connections', '发送积压中的连接数',
+                       lambda: outbound.stats()['backlogged'])
+metrics.registry.gauge('netclip_outbound_queued_bytes', '积压队列中等待发送的字节数',
+                       lambda: outbound.stats()['queued_bytes'])
+metrics.registry.gauge('netclip_room_cache_lookups_total', '房间元数据缓存查询次数',
+                       lambda: labelled(room_cache.stats(), ('hits', 'negative_hits', 'misses', 'coalesced')),
+                       ('result',), kind='counter')
+metrics.registry.gauge('netclip_log_records_total', '事件日志记录数（已写出、队列满丢弃、采样跳过）',
+                       lambda: labelled(event_log.stats(), ('written', 'dropped', 'suppressed')),
+                       ('outcome',), kind='counter')
+metrics.registry.gauge('netclip_blob_pending_deletions', '等待后台删除的文件数', db.count_unreferenced_blobs)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 文本格式的运行指标"""
+    response = make_response(metrics.registry.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+@app.route('/api/admin/metrics', methods=['GET'])
+def admin_metrics():
+    """运行指标的 JSON 摘要：直方图给出次数、总耗时、平均值和估算的分位数（管理员功能）"""
+    return jsonify(metrics.registry.summary()), 200
+
+# ==================== 性能剖析 ====================
+
+@app.route('/api/admin/profile', methods=['GET'])
+def admin_profile_sessions():
+    """剖析会话列表和慢调用统计（管理员功能）"""
+    return jsonify({'sessions': profiler.sessions(), **profiler.stats()}), 200
+
+@app.route('/api/admin/profile/sample', methods=['POST'])
+def admin_start_sampling():
+    """开始采样剖析：seconds 秒内每隔 interval_ms 毫秒采集所有线程的调用栈，idle 为真时包括空闲线程（管理员功能）"""
+    data = request.get_json() or {}
+    try:
+        session = profiler.start_sampling(float(data.get('seconds', 10)),
+                                          float(data.get('interval_ms', PROFILE_SAMPLE_MS)),
+                                          bool(data.get('idle')))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'success': True, 'profile': session.summary()}), 202
+
+@app.route('/api/admin/profile/calls', methods=['POST'])
+def admin_start_call_profile():
+    """剖析接下来 count 次匹配的调用：kind 为 route（name 为路由模板）、event（事件名）或 db（函数名）（管理员功能）"""
+    data = request.get_json() or {}
+    try:
+        session = profiler.start_calls(data.get('kind'), data.get('name'), int(data.get('count', 10)))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'success': True, 'profile': session.summary()}), 202
+
+@app.route('/api/admin/profile/<session_id>/stop', methods=['POST'])
+def admin_stop_profile(session_id):
+    """提前结束剖析，已采集的结果仍可下载（管理员功能）"""
+    session = profiler.stop(session_id)
+    if session is None:
+        return jsonify({'error': '剖析不存在'}), 404
+    return jsonify({'success': True, 'profile': session.summary()}), 200
+
+@app.route('/api/admin/profile/<session_id>/download', methods=['GET'])
+def admin_download_profile(session_id):
+    """
+    下载剖析结果（管理员功能），format 可选：
+        collapsed  采样剖析的 collapsed stack 文本（默认），可用 flamegraph.pl、speedscope 生成火焰图
+        pstats     调用剖析的 pstats 文件（默认），可用 python -m pstats、snakeviz 打开
+        text       调用剖析按累计耗时排序的文本报告
+    """
+    session = profiler.session(session_id)
+    if session is None:
+        return jsonify({'error': '剖析不存在'}), 404
+    fmt = request.args.get('format', 'collapsed' if session.kind == 'sample' else 'pstats')
+    if session.kind == 'sample' and fmt == 'collapsed':
+        response = make_response(session.collapsed())
+        response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+        filename = f'netclip-profile-{session_id}.collapsed.txt'
+    elif session.kind == 'calls' and fmt == 'pstats':
+        response = make_response(session.pstats_bytes())
+        response.headers['Content-Type'] = 'application/octet-stream'
+        filename = f'netclip-profile-{session_id}.pstats'
+    elif session.kind == 'calls' and fmt == 'text':
+        response = make_response(session.text())
+        response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+        filename = f'netclip-profile-{session_id}.txt'
+    else:
+        return jsonify({'error': f'该剖析不支持 {fmt} 格式'}), 400
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/admin/slow-calls', methods=['GET'])
+def admin_slow_calls():
+    """最近的慢调用（从新到旧）：耗时、参数摘要和超过阈值时的调用栈（管理员功能）"""
+    return jsonify({**profiler.stats(), 'calls': profiler.recent_slow_calls()}), 200
+
+@app.route('/api/admin/room-ttl', methods=['POST'])
+def admin_set_room_ttl():
+    """设置房间无活动后自动删除的秒数，ttl 为空表示永久保留（管理员功能）"""
+    data = request.get_json() or {}
+    room_id = data.get('room_id')
+
+    if not room_id:
+        return jsonify({'error': '缺少房间ID'}), 400
+    if room_id == 'public':
+        return jsonify({'error': '默认房间不能设置过期时间'}), 400
+    try:
+        ttl_seconds = parse_room_ttl(data.get('ttl'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if not db.set_room_ttl(room_id, ttl_seconds):
+        return jsonify({'error': '房间不存在'}), 404
+    ensure_background_task(cleanup_worker)
+    return jsonify({'success': True, 'room_id': room_id, 'ttl': ttl_seconds}), 200
+
 @app.route('/api/room/<room_id>/files', methods=['GET'])
 def get_room_files(room_id):
-    """获取房间文件列表"""
-    files = db.get_all_files(room_id)
-    return jsonify({'files': files}), 200
+    """获取房间文件列表（分页，参数见 file_listing）"""
+    return file_listing(room_id)
 
 @app.route('/api/room/<room_id>/upload', methods=['POST'])
 def upload_room_file(room_id):
     """上传文件到指定房间"""
     try:
         # 检查房间是否存在
-        room_info = db.get_room(room_id)
-        if not room_info:
+        if not room_cache.exists(room_id):
             return jsonify({'error': '房间不存在'}), 404
 
+        # 解析上传内容：文件数据边接收边写入临时文件并校验
+        try:
+            files = request.files
+        except UploadRejected as e:
+            return jsonify({'error': e.message}), e.status
+        except RequestEntityTooLarge:
+            return jsonify({'error': format_size_limit(app.config['MAX_CONTENT_LENGTH'] - MULTIPART_OVERHEAD)}), 413
+
         # 检查是否有文件
-        if 'file' not in request.files:
+        if 'file' not in files:
             return jsonify({'error': '没有选择文件'}), 400
 
-        file = request.files['file']
+        file = files['file']
         description = request.form.get('description', '')
 
         # 检查文件是否为空
         if file.filename == '':
             return jsonify({'error': '没有选择文件'}), 400
 
-        # 获取文件原始名称和MIME类型
+        # 获取文件原始名称
         original_filename = file.filename
-        mime_type = file.content_type
-
-        # 先读取文件内容进行安全验证
-        file_content = file.stream.read()
-        file.stream.seek(0)  # 重置文件指针
-
-        # 验证文件安全性
-        is_valid, error_msg = validate_file_security(original_filename, file_content, mime_type)
-        if not is_valid:
-            return jsonify({'error': f'文件验证失败: {error_msg}'}), 400
+        upload = file.stream
+        if not isinstance(upload, StreamingUploadFile):
+            return jsonify({'error': '文件验证失败'}), 400
 
-        # 检查文件大小
-        file_size = len(file_content)
-        file_extension = original_filename.split('.').pop().lower()
-        if file_size > ALLOWED_EXTENSIONS[file_extension]['max_size']:
-            return jsonify({'error': f'文件大小超出限制，最大允许 {ALLOWED_EXTENSIONS[file_extension]["max_size"] / 1024 / 1024:.0f}MB'}), 400
+        # 校验不足16字节的小文件的文件头
+        try:
+            upload.finish()
+        except UploadRejected as e:
+            return jsonify({'error': e.message}), e.status
 
-        # 获取文件扩展名
-        file_extension = os.path.splitext(original_filename)[1]
+        file_size = upload.size
 
-        # 生成文件ID和唯一文件名
+        # 按上传过程中计算的摘要登记，相同内容的文件共用一份数据
         file_id = str(uuid.uuid4())
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        unique_filename = f"{room_id}_{file_id}_{timestamp}{file_extension}"
-
-        # 保存文件
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], '..', 'files', unique_filename)
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-
-        # 重新写入文件内容
-        with open(file_path, 'wb') as f:
-            f.write(file_content)
+        blob_name = blob_store.commit('file', upload.name, upload.hexdigest(), file_size)
 
         # 保存文件记录到数据库
-        if db.add_file(file_id, room_id, unique_filename, original_filename, file_size, description):
+        if db.add_file(file_id, room_id, blob_name, original_filename, file_size, description):
             return jsonify({
                 'success': True,
                 'file_id': file_id,
@@ -577,14 +1197,227 @@ def upload_room_file(room_id):
                 'message': '文件上传成功'
             }), 200
         else:
-            # 如果数据库保存失败，删除已上传的文件
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            # 如果数据库保存失败，释放刚登记的引用
+            blob_store.release('file', blob_name)
+            schedule_cleanup()
             return jsonify({'error': '文件记录保存失败'}), 500
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# ==================== 断点续传上传 API ====================
+
+# 建议的分块大小与单个分块的上限
+RESUMABLE_CHUNK_SIZE = 4 * 1024 * 1024
+RESUMABLE_MAX_CHUNK_SIZE = 16 * 1024 * 1024
+# 上传会话在最后一次写入后保留的时间（秒）
+UPLOAD_SESSION_TTL = int(os.environ.get('NETCLIP_UPLOAD_SESSION_TTL', str(24 * 3600)))
+
+def upload_part_path(upload_id):
+    """上传会话的分块数据文件"""
+    return os.path.join(app.config['FILES_FOLDER'], f'.resumable_{upload_id}.part')
+
+def get_room_upload_session(room_id, upload_id):
+    """获取属于该房间的上传会话"""
+    session = db.get_upload_session(upload_id)
+    if not session or session['room_id'] != room_id:
+        return None
+    return session
+
+def discard_upload_session(upload_id):
+    """删除上传会话及其分块数据"""
+    part_path = upload_part_path(upload_id)
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    db.delete_upload_session(upload_id)
+
+def upload_session_reaper():
+    """后台定期清理过期的上传会话（启动时先清理一次，回收重启前遗留的会话）"""
+    while True:
+        try:
+            cutoff = (datetime.now() - timedelta(seconds=UPLOAD_SESSION_TTL)).isoformat()
+            for session in db.get_expired_upload_sessions(cutoff):
+                discard_upload_session(session['upload_id'])
+        except Exception as e:
+            event_log.error('upload_reap_failed', '清理过期上传会话失败: {error}', error=str(e))
+        socketio.sleep(min(UPLOAD_SESSION_TTL, 3600))
+
+@app.route('/api/room/<room_id>/uploads', methods=['POST'])
+def create_upload_session(room_id):
+    """创建断点续传上传会话"""
+    if not room_cache.exists(room_id):
+        return jsonify({'error': '房间不存在'}), 404
+
+    data = request.get_json() or {}
+    original_filename = data.get('filename') or ''
+    mime_type = data.get('mime_type') or None
+    description = data.get('description', '')
+    total_size = data.get('size')
+
+    if not original_filename:
+        return jsonify({'error': '没有选择文件'}), 400
+    if not isinstance(total_size, int) or isinstance(total_size, bool) or total_size < 0:
+        return jsonify({'error': '缺少文件大小'}), 400
+
+    # 创建会话时即校验文件名、类型和大小，避免传输完成后才被拒绝
+    is_valid, error_msg = validate_file_metadata(original_filename, mime_type)
+    if not is_valid:
+        return jsonify({'error': f'文件验证失败: {error_msg}'}), 400
+
+    max_size = ALLOWED_EXTENSIONS[original_filename.split('.').pop().lower()]['max_size']
+    if total_size > max_size:
+        return jsonify({'error': format_size_limit(max_size)}), 413
+
+    upload_id = str(uuid.uuid4())
+    os.makedirs(app.config['FILES_FOLDER'], exist_ok=True)
+    open(upload_part_path(upload_id), 'wb').close()
+    db.create_upload_session(upload_id, room_id, original_filename, mime_type, total_size, description)
+    ensure_background_task(upload_session_reaper)
+
+    return jsonify({
+        'upload_id': upload_id,
+        'offset': 0,
+        'size': total_size,
+        'chunk_size': RESUMABLE_CHUNK_SIZE,
+        'expires_in': UPLOAD_SESSION_TTL
+    }), 201
+
+@app.route('/api/room/<room_id>/uploads/<upload_id>', methods=['GET'])
+def get_upload_status(room_id, upload_id):
+    """查询上传会话已接收的字节数"""
+    session = get_room_upload_session(room_id, upload_id)
+    if not session:
+        return jsonify({'error': '上传会话不存在或已过期'}), 404
+
+    return jsonify({
+        'upload_id': upload_id,
+        'filename': session['original_filename'],
+        'offset': session['received'],
+        'size': session['total_size']
+    }), 200
+
+@app.route('/api/room/<room_id>/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(room_id, upload_id):
+    """
+    写入一个分块，请求体为原始二进制数据
+    分块位置由查询参数 offset 指定，必须不大于已接收的字节数（允许重传已接收的部分）
+    """
+    session = get_room_upload_session(room_id, upload_id)
+    if not session:
+        return jsonify({'error': '上传会话不存在或已过期'}), 404
+    ensure_background_task(upload_session_reaper)
+
+    offset = request.args.get('offset', type=int)
+    chunk_length = request.content_length
+    if offset is None or offset < 0:
+        return jsonify({'error': '缺少分块偏移 offset'}), 400
+    if chunk_length is None:
+        return jsonify({'error': '缺少 Content-Length'}), 411
+    if chunk_length > RESUMABLE_MAX_CHUNK_SIZE:
+        return jsonify({'error': f'分块不能超过 {RESUMABLE_MAX_CHUNK_SIZE // 1024 // 1024}MB'}), 413
+    if offset > session['received']:
+        # 中间缺少数据，客户端应从已接收的位置继续
+        return jsonify({'error': '分块偏移不连续', 'offset': session['received']}), 409
+    if offset + chunk_length > session['total_size']:
+        return jsonify({'error': '分块超出文件大小'}), 400
+
+    # 分块直接写入磁盘，不在内存中缓存
+    written = 0
+    with open(upload_part_path(upload_id), 'r+b') as f:
+        f.seek(offset)
+        while written < chunk_length:
+            chunk = request.stream.read(min(UPLOAD_CHUNK_SIZE, chunk_length - written))
+            if not chunk:
+                break
+            f.write(chunk)
+            written += len(chunk)
+
+    received = db.update_upload_progress(upload_id, offset + written)
+    if written < chunk_length:
+        return jsonify({'error': '分块数据不完整', 'offset': received}), 400
+
+    return jsonify({'upload_id': upload_id, 'offset': received, 'size': session['total_size']}), 200
+
+@app.route('/api/room/<room_id>/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(room_id, upload_id):
+    """完成上传：校验文件并登记到房间文件列表"""
+    session = get_room_upload_session(room_id, upload_id)
+    if not session:
+        return jsonify({'error': '上传会话不存在或已过期'}), 404
+
+    if session['received'] < session['total_size']:
+        return jsonify({'error': '文件尚未上传完成', 'offset': session['received']}), 409
+
+    # 先领取会话（从数据库中删除），重复或并发的完成请求只有一个能继续，之后分块数据由本请求负责清理
+    session = db.claim_upload_session(upload_id, room_id)
+    if not session:
+        return jsonify({'error': '上传会话已完成或正在处理'}), 409
+
+    part_path = upload_part_path(upload_id)
+    blob_name = None
+    try:
+        if not room_cache.exists(room_id):
+            return jsonify({'error': '房间不存在'}), 404
+
+        original_filename = session['original_filename']
+        with open(part_path, 'rb') as f:
+            file_header = f.read(16)
+
+        # 完整性与安全校验在合并完成后进行
+        is_valid, error_msg = validate_file_security(original_filename, file_header, session['mime_type'])
+        if not is_valid:
+            return jsonify({'error': f'文件验证失败: {error_msg}'}), 400
+
+        file_size = os.path.getsize(part_path)
+        if file_size != session['total_size']:
+            return jsonify({'error': '文件大小与声明不一致'}), 400
+
+        # 分块可能乱序重传，摘要在合并完成后顺序读取计算
+        file_id = str(uuid.uuid4())
+        blob_name = blob_store.commit('file', part_path, hash_file(part_path), file_size)
+
+        if not db.add_file(file_id, room_id, blob_name, original_filename, file_size, session['description'] or ''):
+            return jsonify({'error': '文件记录保存失败'}), 500
+
+        blob_name = None
+        return jsonify({
+            'success': True,
+            'file_id': file_id,
+            'filename': original_filename,
+            'file_size': file_size,
+            'message': '文件上传成功'
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    finally:
+        # 未成功登记文件记录时释放 blob 引用，并删除仍留在原处的分块数据
+        if blob_name is not None:
+            blob_store.release('file', blob_name)
+            schedule_cleanup()
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+@app.route('/api/room/<room_id>/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(room_id, upload_id):
+    """取消上传并删除已接收的数据"""
+    session = get_room_upload_session(room_id, upload_id)
+    if not session:
+        return jsonify({'error': '上传会话不存在或已过期'}), 404
+
+    discard_upload_session(upload_id)
+    return jsonify({'success': True}), 200
+
+def file_etag(file_info):
+    """根据文件记录生成 ETag（文件写入后不再修改，file_id 与大小即可唯一标识内容）"""
+    return f"{file_info['file_id']}-{file_info['file_size']:x}"
+
+def file_mimetype(filename):
+    """根据扩展名确定下载的 MIME 类型"""
+    file_config = ALLOWED_EXTENSIONS.get(filename.split('.').pop().lower())
+    return file_config['mime'] if file_config else None
+
 @app.route('/api/room/<room_id>/download/<file_id>', methods=['GET'])
 def download_room_file(room_id, file_id):
     """下载房间文件"""
@@ -600,16 +1433,17 @@ def download_room_file(room_id, file_id):
             return jsonify({'error': '文件不属于该房间'}), 403
 
         # 构建文件路径
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], '..', 'files', file_info['filename'])
+        file_path = os.path.join(app.config['FILES_FOLDER'], file_info['filename'])
 
         # 检查文件是否存在
         if not os.path.exists(file_path):
             return jsonify({'error': '文件不存在'}), 404
 
-        # 发送文件
-        return send_file(
+        # 发送文件（支持 Range 断点续传和 ETag 缓存验证）
+        return send_stored_file(
             file_path,
-            as_attachment=True,
+            file_etag(file_info),
+            mimetype=file_mimetype(file_info['original_filename']),
             download_name=file_info['original_filename']
         )
 
@@ -630,13 +1464,9 @@ def delete_room_file(room_id, file_id):
         if file_info['room_id'] != room_id:
             return jsonify({'error': '文件不属于该房间'}), 403
 
-        # 删除物理文件
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], '..', 'files', file_info['filename'])
-        if os.path.exists(file_path):
-            os.remove(file_path)
-
-        # 从数据库删除记录
+        # 删除记录，实际文件在最后一个引用被删除后由后台清理任务回收
         if db.delete_file(file_id):
+            schedule_cleanup()
             return jsonify({
                 'success': True,
                 'message': '文件删除成功'
@@ -651,9 +1481,8 @@ def delete_room_file(room_id, file_id):
 
 @app.route('/api/admin/files', methods=['GET'])
 def admin_get_all_files():
-    """获取所有文件列表（管理员功能）"""
-    files = db.get_all_files()
-    return jsonify({'files': files}), 200
+    """获取所有文件列表（管理员功能，分页，参数见 file_listing）"""
+    return file_listing()
 
 @app.route('/api/admin/delete-file/<file_id>', methods=['DELETE'])
 def admin_delete_file(file_id):
@@ -665,13 +1494,9 @@ def admin_delete_file(file_id):
         if not file_info:
             return jsonify({'error': '文件不存在'}), 404
 
-        # 删除物理文件
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], '..', 'files', file_info['filename'])
-        if os.path.exists(file_path):
-            os.remove(file_path)
-
-        # 从数据库删除记录
+        # 删除记录，实际文件在最后一个引用被删除后由后台清理任务回收
         if db.delete_file(file_id):
+            schedule_cleanup()
             return jsonify({
                 'success': True,
                 'message': '文件删除成功',
@@ -694,22 +1519,45 @@ def admin_download_file(file_id):
             return jsonify({'error': '文件不存在'}), 404
 
         # 构建文件路径
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], '..', 'files', file_info['filename'])
+        file_path = os.path.join(app.config['FILES_FOLDER'], file_info['filename'])
 
         # 检查文件是否存在
         if not os.path.exists(file_path):
             return jsonify({'error': '文件不存在'}), 404
 
-        # 发送文件
-        return send_file(
+        # 发送文件（支持 Range 断点续传和 ETag 缓存验证）
+        return send_stored_file(
             file_path,
-            as_attachment=True,
+            file_etag(file_info),
+            mimetype=file_mimetype(file_info['original_filename']),
             download_name=file_info['original_filename']
         )
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def start_background_tasks():
+    """启动所有定期执行的后台任务（已启动的不会重复启动）"""
+    ensure_background_task(content_flusher)
+    ensure_background_task(revision_recorder)
+    ensure_background_task(revision_compactor)
+    ensure_background_task(outbound_checker)
+    ensure_background_task(cleanup_worker)
+    ensure_background_task(upload_session_reaper)
+
+def run_server(host='0.0.0.0', port=8080, debug=False):
+    """启动服务，并发模型由 NETCLIP_ASYNC_MODE 决定（生产环境入口见 serve.py）"""
+    # 收到 SIGTERM 时正常退出，确保 atexit 写回内容
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # 后台任务在启动时即运行，不等第一个连接或上传（如重启前遗留的过期上传会话）
+    start_background_tasks()
+
+    if runtime.COOPERATIVE:
+        socketio.run(app, host=host, port=port, debug=debug, use_reloader=False)
+    else:
+        socketio.run(app, host=host, port=port, debug=debug, allow_unsafe_werkzeug=True)
+
 if __name__ == '__main__':
-    # 使用SocketIO运行应用
-    socketio.run(app, debug=True, host='0.0.0.0', port=8080, allow_unsafe_werkzeug=True)
+    # 使用SocketIO运行应用（开发模式）
+    run_server(debug=not runtime.COOPERATIVE)
@@ -0,0 +1,197 @@
+"""
+静态资源构建与发布
+将 static/ 下的 JS/CSS 按内容摘要重命名输出到 static/dist/，同时生成 .gz 和 .br 版本，
+页面中的 /static/<文件名> 引用改写为 /assets/<带摘要的文件名>，可按不可变资源永久缓存
+
+用法（部署前构建，服务启动时若资源有变化也会自动构建）：
+    python static_assets.py
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+
+try:
+    import brotli
+except ImportError:  # brotli 已列在 requirements.txt 中，缺失时退回只生成 gzip
+    brotli = None
+
+# 参与构建的资源类型
+ASSET_EXTENSIONS = ('.js', '.css')
+# 构建输出目录（相对 static/）和清单文件
+DIST_DIRNAME = 'dist'
+MANIFEST_NAME = 'manifest.json'
+# 发布资源的 URL 前缀
+ASSETS_URL_PREFIX = '/assets/'
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# 压缩后的文件后缀
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+# 当前环境可以生成的编码，之后安装 brotli 时按此重新构建，补上 .br 版本
+AVAILABLE_ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+# 页面中对 static/ 下资源的引用，如 "/static/socket.io.min.js"
+STATIC_REFERENCE = re.compile(r'''(["'])/static/([\w.\-]+)\1''')
+
+
+def fingerprint_name(name, digest):
+    """socket.io.min.js -> socket.io.min.<摘要>.js"""
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{digest[:12]}{ext}'
+
+
+def _write_atomic(path, data):
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class StaticAssets:
+    """static/ 目录的构建清单"""
+
+    def __init__(self, static_dir):
+        self.static_dir = static_dir
+        self.dist_dir = os.path.join(static_dir, DIST_DIRNAME)
+        self.manifest_path = os.path.join(self.dist_dir, MANIFEST_NAME)
+        self.assets = {}          # {源文件名: 清单条目}
+        self.files = {}           # {带摘要的文件名: 清单条目}
+        self._lock = threading.Lock()
+
+    def _sources(self):
+        if not os.path.isdir(self.static_dir):
+            return []
+        return sorted(name for name in os.listdir(self.static_dir)
+                      if name.endswith(ASSET_EXTENSIONS)
+                      and os.path.isfile(os.path.join(self.static_dir, name)))
+
+    def _set_manifest(self, assets):
+        self.assets = assets
+        self.files = {entry['file']: entry for entry in assets.values()}
+
+    def load_manifest(self):
+        """读取构建清单，不存在或损坏时返回 {}"""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('assets', {})
+        except (OSError, ValueError):
+            return {}
+
+    def is_stale(self, assets):
+        """源文件增删或修改、输出文件缺失、可用的压缩编码变化时需要重新构建"""
+        sources = self._sources()
+        if sorted(assets) != sources:
+            return True
+        for name in sources:
+            entry = assets[name]
+            stat = os.stat(os.path.join(self.static_dir, name))
+            if stat.st_size != entry['source_size'] or stat.st_mtime != entry['source_mtime']:
+                return True
+            if entry.get('compressed_with') != AVAILABLE_ENCODINGS:
+                return True
+            output = os.path.join(self.dist_dir, entry['file'])
+            if not os.path.exists(output):
+                return True
+            for encoding in entry['encodings']:
+                if not os.path.exists(output + ENCODING_SUFFIXES[encoding]):
+                    return True
+        return False
+
+    def build(self):
+        """构建所有资源并写入清单，返回清单条目"""
+        os.makedirs(self.dist_dir, exist_ok=True)
+        assets = {}
+        for name in self._sources():
+            source = os.path.join(self.static_dir, name)
+            with open(source, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()
+            output_name = fingerprint_name(name, digest)
+            output = os.path.join(self.dist_dir, output_name)
+
+            variants = {'gzip': gzip.compress(data, GZIP_LEVEL, mtime=0)}
+            if brotli is not None:
+                variants['br'] = brotli.compress(data, quality=BROTLI_QUALITY)
+
+            if not os.path.exists(output):
+                _write_atomic(output, data)
+            encodings = []
+            sizes = {'identity': len(data)}
+            for encoding, compressed in variants.items():
+                # 压缩无收益时不提供该编码
+                if len(compressed) >= len(data):
+                    continue
+                _write_atomic(output + ENCODING_SUFFIXES[encoding], compressed)
+                encodings.append(encoding)
+                sizes[encoding] = len(compressed)
+
+            assets[name] = {
+                'file': output_name,
+                'digest': digest,
+                'source_size': stat.st_size,
+                'source_mtime': stat.st_mtime,
+                'encodings': sorted(encodings, key=['br', 'gzip'].index),
+                'compressed_with': AVAILABLE_ENCODINGS,
+                'sizes': sizes
+            }
+
+        _write_atomic(self.manifest_path, json.dumps({'assets': assets}, indent=2).encode('utf-8'))
+        self._remove_outdated(assets)
+        return assets
+
+    def _remove_outdated(self, assets):
+        """删除旧版本的构建输出"""
+        keep = {MANIFEST_NAME}
+        for entry in assets.values():
+            keep.add(entry['file'])
+            keep.update(entry['file'] + ENCODING_SUFFIXES[e] for e in entry['encodings'])
+        for name in os.listdir(self.dist_dir):
+            if name not in keep and '.tmp' not in name:
+                os.remove(os.path.join(self.dist_dir, name))
+
+    def ensure_built(self):
+        """加载清单，资源有变化时重新构建"""
+        with self._lock:
+            assets = self.load_manifest()
+            if self.is_stale(assets):
+                assets = self.build()
+            self._set_manifest(assets)
+        return self.assets
+
+    def url(self, name):
+        """源文件名对应的发布 URL，未构建的资源返回 None"""
+        entry = self.assets.get(name)
+        return ASSETS_URL_PREFIX + entry['file'] if entry else None
+
+    def rewrite_html(self, html):
+        """将页面中的 /static/ 引用改写为带摘要的 URL"""
+        def replace(match):
+            url = self.url(match.group(2))
+            return f'{match.group(1)}{url}{match.group(1)}' if url else match.group(0)
+        return STATIC_REFERENCE.sub(replace, html)
+
+    def resolve(self, filename, accept_encodings):
+        """
+        选择带摘要文件的最佳编码，返回 (路径, 编码, 清单条目)
+        accept_encodings 为请求的 Accept-Encoding（werkzeug Accept 对象），文件不存在时返回 None
+        """
+        entry = self.files.get(filename)
+        if entry is None:
+            return None
+        path = os.path.join(self.dist_dir, filename)
+        for encoding in entry['encodings']:
+            if accept_encodings[encoding] > 0:
+                return path + ENCODING_SUFFIXES[encoding], encoding, entry
+        return path, 'identity', entry
+
+
+if __name__ == '__main__':
+    static_assets = StaticAssets(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+    for source, entry in static_assets.ensure_built().items():
+        sizes = ', '.join(f'{encoding} {size / 1024:.1f}KB' for encoding, size in entry['sizes'].items())
+        print(f"{source} -> {entry['file']} ({sizes})")
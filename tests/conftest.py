@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# 模块都在仓库根目录，直接运行 pytest 时也能导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """使用临时目录中的空数据库"""
+    monkeypatch.setattr(db, 'DATABASE_FILE', str(tmp_path / 'collab.db'))
+    db.init_db()
@@ -0,0 +1,100 @@
+"""blob_store.py 内容去重和引用计数：只有最后一个引用被删除后才删除实际文件"""
+import io
+import os
+
+import pytest
+
+import db
+from blob_store import BlobStore
+
+
+@pytest.fixture
+def store(database, tmp_path):
+    folders = {'file': str(tmp_path / 'files'), 'image': str(tmp_path / 'images')}
+    for folder in folders.values():
+        os.makedirs(folder)
+    for room_id in ('a', 'b', 'c'):
+        db.create_room(room_id)
+    return BlobStore(folders)
+
+
+def upload(store, room_id, file_id, data):
+    """同上传接口：写入 blob 后登记文件记录"""
+    name, size = store.store('file', io.BytesIO(data))
+    assert db.add_file(file_id, room_id, name, file_id + '.txt', size)
+    return name
+
+
+def refcount(name):
+    with db.connection() as conn:
+        row = conn.execute("SELECT refcount FROM blobs WHERE kind = 'file' AND name = ?", (name,)).fetchone()
+    return row['refcount'] if row else None
+
+
+def stored_files(store):
+    return sorted(os.listdir(store.folders['file']))
+
+
+def test_same_content_in_two_rooms_survives_deleting_one(store):
+    name = upload(store, 'a', 'fa', b'shared report')
+    assert upload(store, 'b', 'fb', b'shared report') == name
+    assert stored_files(store) == [name]
+    assert refcount(name) == 2
+    assert store.deduplicated == 1 and store.bytes_saved == len(b'shared report')
+
+    # 删除房间 a 只释放它的引用，房间 b 的文件仍可下载
+    assert db.delete_room('a')
+    assert refcount(name) == 1
+    assert store.collect() == 0
+    assert stored_files(store) == [name]
+    with open(store.path('file', name), 'rb') as f:
+        assert f.read() == b'shared report'
+
+    # 最后一个引用被删除后由 collect 删除实际文件
+    assert db.delete_file('fb')
+    assert refcount(name) == 0
+    assert store.collect() == 1
+    assert stored_files(store) == []
+    assert refcount(name) is None
+
+
+def test_delete_file_releases_one_reference(store):
+    name = upload(store, 'a', 'f1', b'twice')
+    upload(store, 'a', 'f2', b'twice')
+    assert db.delete_file('f1')
+    assert not db.delete_file('f1')
+    assert refcount(name) == 1
+    assert store.collect() == 0
+    assert stored_files(store) == [name]
+
+
+def test_delete_room_files_releases_each_reference(store):
+    shared = upload(store, 'a', 'f1', b'shared')
+    upload(store, 'a', 'f2', b'shared')
+    only_a = upload(store, 'a', 'f3', b'only in a')
+    upload(store, 'c', 'f4', b'shared')
+
+    db.delete_room_files('a')
+    assert refcount(shared) == 1
+    assert refcount(only_a) == 0
+    assert db.count_files('a') == (0, 0)
+    assert store.collect() == 1
+    assert stored_files(store) == [shared]
+
+
+def test_reupload_before_collect_keeps_file(store):
+    name = upload(store, 'a', 'f1', b'content')
+    assert db.delete_file('f1')
+    # 引用计数归零但尚未回收时再次上传相同内容，回收不会删除重新被引用的文件
+    upload(store, 'b', 'f2', b'content')
+    assert refcount(name) == 1
+    assert store.collect() == 0
+    assert stored_files(store) == [name]
+
+
+def test_release_after_failed_record(store):
+    # 文件记录保存失败时释放刚登记的引用，临时文件不会留下
+    name, _ = store.store('file', io.BytesIO(b'orphan'))
+    store.release('file', name)
+    assert store.collect() == 1
+    assert stored_files(store) == []
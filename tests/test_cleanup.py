@@ -0,0 +1,67 @@
+"""cleanup.py 的图片回收：仍被保留的历史版本引用的图片不会被释放"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+from cleanup import Cleanup, image_references
+from revisions import RevisionStore
+
+
+@pytest.fixture
+def revisions(database):
+    return RevisionStore()
+
+
+@pytest.fixture
+def cleanup(revisions):
+    calls = []
+
+    def references(room_id):
+        calls.append(room_id)
+        return revisions.collect(room_id, image_references)
+
+    cleanup = Cleanup(blob_store=None, revision_references=references, sleep=lambda seconds: None)
+    cleanup.calls = calls
+    return cleanup
+
+
+def blob_refcount(name):
+    with db.connection() as conn:
+        row = conn.execute("SELECT refcount FROM blobs WHERE kind = 'image' AND name = ?", (name,)).fetchone()
+    return row['refcount']
+
+
+def test_images_in_retained_revisions_are_kept(revisions, cleanup):
+    db.create_room('notes')
+    for name in ('old.png', 'gone.png', 'live.png'):
+        db.acquire_blob('image', name, None, 10)
+    # old.png 只出现在较早的版本中，当前内容只引用 live.png
+    revisions.record('notes', 'see /images/old.png')
+    revisions.record('notes', 'see /images/old.png and more')
+    revisions.record('notes', 'now /images/live.png')
+    db.save_room_content('notes', 'now /images/live.png')
+
+    later = datetime.now() + timedelta(days=365)
+    assert cleanup.release_images(later) == 1
+    assert blob_refcount('gone.png') == 0
+    assert blob_refcount('old.png') == 1
+    assert blob_refcount('live.png') == 1
+    assert cleanup.calls == ['notes']
+
+    # 历史版本没有变化时沿用上一轮的结果，新增版本后重新扫描
+    assert cleanup.release_images(later) == 0
+    assert cleanup.calls == ['notes']
+    revisions.record('notes', 'cleared')
+    cleanup.release_images(later)
+    assert cleanup.calls == ['notes', 'notes']
+    assert blob_refcount('old.png') == 1
+
+
+def test_collect_reconstructs_every_revision(revisions):
+    db.create_room('room')
+    contents = ['a /images/1.png', 'b /images/1.png /images/2.png', 'c', 'd /images/3.png']
+    for content in contents:
+        revisions.record('room', content)
+    assert revisions.collect('room', image_references) == {'1.png', '2.png', '3.png'}
+    assert revisions.collect('missing', image_references) == set()
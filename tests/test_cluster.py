@@ -0,0 +1,189 @@
+"""两个 Cluster 通过 RESP 替身（benchmarks/resp_standin.py）协作：广播、文档归属转移和在线成员"""
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import pytest
+
+import cluster
+import room_store
+from cluster import Cluster
+from message_bus import RedisBus
+from presence import Presence
+from room_store import RoomStore
+
+STANDIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'resp_standin.py')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+class FakeSocketIO:
+    """只提供 Cluster 用到的后台任务接口"""
+
+    @staticmethod
+    def start_background_task(target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        return thread
+
+    @staticmethod
+    def sleep(seconds):
+        time.sleep(seconds)
+
+
+class RecordingOutbound:
+    """记录发给本进程连接的消息"""
+
+    def __init__(self):
+        self.sent = []        # [(sid, event, data)]
+        self.broadcasts = []  # [(event, data, room, skip_sid)]
+
+    def send(self, sid, event, data):
+        self.sent.append((sid, event, data))
+
+    def broadcast(self, event, data, room, skip_sid=None):
+        self.broadcasts.append((event, data, room, skip_sid))
+
+
+@pytest.fixture(scope='module')
+def bus_url():
+    port = free_port()
+    process = subprocess.Popen([sys.executable, STANDIN, '--port', str(port)],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        process.stdout.readline()  # 输出监听地址后即可连接
+        yield f'redis://127.0.0.1:{port}/0'
+    finally:
+        process.terminate()
+        process.wait(timeout=5)
+
+
+@pytest.fixture
+def workers(bus_url, monkeypatch):
+    # 文档只在内存中，不访问数据库
+    monkeypatch.setattr(room_store.db, 'get_room_content', lambda room_id: 'hello')
+    started = []
+
+    def make(count=2):
+        batch = [Cluster(FakeSocketIO(), RecordingOutbound(), RoomStore(), Presence(), bus=RedisBus(bus_url))
+                for _ in range(count)]
+        for worker in batch:
+            worker.start()
+            started.append(worker)
+        # 启动后各自刷新一次存活进程，不依赖心跳间隔
+        for worker in batch:
+            worker._refresh_alive()
+        return batch
+
+    yield make
+    for worker in started:
+        worker.bus.close()
+
+
+def room():
+    return 'test-' + uuid.uuid4().hex[:8]
+
+
+def test_broadcast_reaches_other_worker_once(workers):
+    a, b = workers()
+    room_id = room()
+    a.broadcast('content_op', {'version': 1}, room_id, skip_sid='sid-a')
+
+    expected = ('content_op', {'version': 1}, room_id, 'sid-a')
+    assert a.outbound.broadcasts == [expected]
+    assert wait_for(lambda: b.outbound.broadcasts == [expected])
+    # 本进程发布的消息不会再次分发给自己的连接
+    time.sleep(0.1)
+    assert a.outbound.broadcasts == [expected]
+    assert b.remote_events == 1
+
+
+def test_non_owner_forwards_open_and_ops_to_owner(workers):
+    a, b = workers()
+    room_id = room()
+    a.open_document(room_id, 'sid-a')
+    assert a.owns(room_id)
+    assert a.outbound.sent == [('sid-a', 'init_content', {'content': 'hello', 'version': 0})]
+
+    # B 不持有文档，加入和编辑都由 A 处理，结果经总线发回 B 的连接
+    assert b.owner_of(room_id) == a.worker_id
+    b.open_document(room_id, 'sid-b')
+    assert wait_for(lambda: ('sid-b', 'init_content', {'content': 'hello', 'version': 0}) in b.outbound.sent)
+    b.submit_ops(room_id, 'sid-b', 'bob', 0, [{'op': 'insert', 'pos': 5, 'text': '!'}])
+    assert wait_for(lambda: ('sid-b', 'content_ack', {'version': 1}) in b.outbound.sent)
+
+    assert a.room_store.snapshot(room_id) == ('hello!', 1)
+    assert room_id not in b.room_store.room_ids()
+    # A 先经总线确认再在本进程广播，B 收到确认时 A 的广播可能还未执行
+    assert wait_for(lambda: any(event[0] == 'content_op' for event in a.outbound.broadcasts))
+    ops = [event for event in a.outbound.broadcasts if event[0] == 'content_op']
+    assert ops[0][1]['ops'] == [{'op': 'insert', 'pos': 5, 'text': '!'}] and ops[0][3] == 'sid-b'
+    assert b.forwarded == 2
+
+
+def test_owner_lease_moves_to_live_worker(workers):
+    a, b = workers()
+    room_id = room()
+    a.open_document(room_id, 'sid-a')
+    assert b.owner_of(room_id) == a.worker_id
+
+    # A 停止心跳，超时后 B 接管文档并改由自己处理请求
+    a.bus.hset(cluster.WORKERS_KEY, a.worker_id, int(time.time() * 1000 - cluster.WORKER_TIMEOUT * 2000))
+    b._refresh_alive()
+    assert b.owner_of(room_id, refresh=True) == b.worker_id
+    assert b.bus.get(cluster.owner_key(room_id)) == b.worker_id
+    b.submit_ops(room_id, 'sid-b', 'bob', 0, [{'op': 'insert', 'pos': 0, 'text': '>'}])
+    assert b.outbound.sent[-1] == ('sid-b', 'content_ack', {'version': 1})
+    assert b.room_store.snapshot(room_id) == ('>hello', 1)
+
+    # 仍把请求发给 A 的进程会由 A 转发给新的持有者
+    a._owned.discard(room_id)
+    a._owners.pop(room_id, None)
+    a._forward(a.worker_id, {'type': 'ops', 'room': room_id, 'origin': a.worker_id, 'sid': 'sid-a',
+                             'username': 'alice', 'base_version': 1, 'ops': [{'op': 'insert', 'pos': 6, 'text': '<'}]})
+    assert wait_for(lambda: ('sid-a', 'content_ack', {'version': 2}) in a.outbound.sent)
+    assert b.room_store.snapshot(room_id) == ('>hello<', 2)
+
+
+def test_presence_spans_workers(workers):
+    a, b = workers()
+    room_id = room()
+    alice, _ = a.presence.add('sid-a', 'alice', room_id, ops=True)
+    a.add_member(alice)
+    time.sleep(0.01)  # 成员按加入时间排序
+    bob, _ = b.presence.add('sid-b', 'bob', room_id, ops=False)
+    b.add_member(bob)
+
+    for worker in (a, b):
+        assert worker.usernames(room_id) == ['alice', 'bob']
+        assert worker.count(room_id) == 2
+        assert worker.has_legacy_members(room_id)
+    assert a.room_counts([room_id]) == {room_id: 2}
+
+    b.remove_member(bob)
+    assert a.members(room_id) == [alice.to_dict()]
+    assert not a.has_legacy_members(room_id)
+
+    # 失联进程的成员被忽略并清理
+    b.add_member(bob)
+    b.bus.hset(cluster.WORKERS_KEY, b.worker_id, int(time.time() * 1000 - cluster.WORKER_TIMEOUT * 2000))
+    a._refresh_alive()
+    assert a.usernames(room_id) == ['alice']
+    assert list(a.bus.hgetall(cluster.members_key(room_id))) == [alice.member_id]
@@ -0,0 +1,77 @@
+"""cursors.py 光标合并：每个房间每周期一条 cursor_batch，同一成员只保留最新位置"""
+from cursors import CursorBatcher
+
+
+def make_batcher(recipients=3):
+    sent = []
+    batcher = CursorBatcher(send=lambda room_id, payload: sent.append((room_id, payload)),
+                            recipients=lambda room_id: recipients)
+    return batcher, sent
+
+
+def test_moves_coalesce_per_room():
+    batcher, sent = make_batcher()
+    batcher.update('r1', 'a', 'alice', 1)
+    batcher.update('r1', 'b', 'bob', 7)
+    batcher.update('r1', 'a', 'alice', 2)
+    batcher.update('r1', 'a', 'alice', 3)
+    batcher.update('r2', 'c', 'carol', 5)
+
+    assert batcher.flush() == 2
+    assert sorted(sent) == [
+        ('r1', {'cursors': [{'id': 'a', 'username': 'alice', 'position': 3},
+                            {'id': 'b', 'username': 'bob', 'position': 7}]}),
+        ('r2', {'cursors': [{'id': 'c', 'username': 'carol', 'position': 5}]}),
+    ]
+    stats = batcher.stats()
+    assert stats['received'] == 5 and stats['collapsed'] == 2 and stats['batches'] == 2
+    # r1：4 次移动逐条广播需 4 × 2 条，合并后 3 条；r2：1 次移动 2 条，合并后 3 条（不计为节省）
+    assert stats['messages_sent'] == 6 and stats['messages_saved'] == 5
+
+    # 没有新的移动时不发送
+    sent.clear()
+    assert batcher.flush() == 0 and sent == []
+    assert batcher.stats()['pending_rooms'] == 0
+
+
+def test_discard_drops_pending_cursor_of_leaving_member():
+    batcher, sent = make_batcher()
+    batcher.update('r1', 'a', 'alice', 1)
+    batcher.update('r1', 'b', 'bob', 2)
+    batcher.discard('r1', 'a')
+    batcher.discard('r2', 'a')
+    batcher.flush()
+    assert sent == [('r1', {'cursors': [{'id': 'b', 'username': 'bob', 'position': 2}]})]
+
+    # 房间内只剩离开成员的位置时不发送空批次
+    sent.clear()
+    batcher.update('r1', 'a', 'alice', 4)
+    batcher.discard('r1', 'a')
+    assert batcher.flush() == 0 and sent == []
+
+
+def test_run_flushes_moves_arriving_within_the_tick():
+    class Stop(BaseException):
+        """结束后台循环（不被 run 中记录错误的 except Exception 捕获）"""
+
+    sent = []
+
+    def send(room_id, payload):
+        sent.append((room_id, payload))
+        raise Stop
+
+    batcher = CursorBatcher(send=send, recipients=lambda room_id: 2)
+    ticks = []
+
+    def sleep(seconds):
+        ticks.append(seconds)
+        # 等待周期内到达的移动合并进同一批
+        batcher.update('r1', 'a', 'alice', 9)
+
+    batcher.update('r1', 'a', 'alice', 1)
+    try:
+        batcher.run(sleep)
+    except Stop:
+        pass
+    assert ticks == [batcher.tick]
+    assert sent == [('r1', {'cursors': [{'id': 'a', 'username': 'alice', 'position': 9}]})]
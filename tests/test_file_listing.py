@@ -0,0 +1,80 @@
+"""文件列表的 keyset 分页：游标编码、上传时间相同时的翻页和格式错误的游标"""
+import base64
+import importlib
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def server(database, tmp_path, monkeypatch):
+    # 导入 server 时会创建 images/ 等目录，放在临时目录中
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module('server')
+
+
+@pytest.fixture
+def files(database):
+    """同一房间的 5 个文件，上传时间完全相同"""
+    db.create_room('drop')
+    file_ids = [f'file-{i}' for i in range(5)]
+    for file_id in file_ids:
+        db.add_file(file_id, 'drop', file_id + '.txt', file_id + '.txt', 10)
+    with db.connection() as conn, conn:
+        conn.execute("UPDATE files SET uploaded_at = '2026-01-01T00:00:00'")
+    return file_ids
+
+
+def test_cursor_round_trip(server):
+    for after in [('2026-01-01T00:00:00', 'abc'), ('', ''), ('2026\n01', 'room\nwith,"odd" chars 中文')]:
+        token = server.encode_page_cursor(after)
+        assert '=' not in token
+        assert server.decode_page_cursor(token) == after
+
+
+@pytest.mark.parametrize('token', [
+    'not base64!', '中文', 'A', base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+    base64.urlsafe_b64encode(b'{"a": 1}').decode(), base64.urlsafe_b64encode(b'["only one"]').decode(),
+    base64.urlsafe_b64encode(b'["a", 1]').decode(), base64.urlsafe_b64encode(b'["a", "b", "c"]').decode(),
+])
+def test_malformed_cursor_is_rejected(server, token):
+    with pytest.raises(ValueError):
+        server.decode_page_cursor(token)
+    client = server.app.test_client()
+    for url in ('/api/room/public/files', '/api/admin/files', '/api/admin/overview'):
+        response = client.get(url, query_string={'after': token})
+        assert response.status_code == 400
+        assert response.get_json()['error'] == '无效的分页游标'
+
+
+def test_pages_break_ties_on_file_id(files):
+    seen = []
+    after = None
+    while True:
+        page, after = db.list_files('drop', limit=2, after=after)
+        seen.extend(f['file_id'] for f in page)
+        if after is None:
+            break
+    assert seen == sorted(files, reverse=True)
+
+
+def test_listing_endpoint_pages_through_ties(server, files):
+    client = server.app.test_client()
+    seen = []
+    after = None
+    while True:
+        query = {'limit': 2, 'lite': 1}
+        if after:
+            query['after'] = after
+        data = client.get('/api/room/drop/files', query_string=query).get_json()
+        if after is None:
+            assert data['total'] == 5
+        else:
+            assert 'total' not in data
+        seen.extend(f['file_id'] for f in data['files'])
+        assert all(set(f) == set(db.FILE_LITE_COLUMNS) for f in data['files'])
+        after = data['next_after']
+        if after is None:
+            break
+    assert seen == sorted(files, reverse=True)
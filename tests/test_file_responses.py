@@ -0,0 +1,123 @@
+"""file_responses.py 的 Range / ETag 解析和文件响应"""
+import pytest
+from flask import Flask
+from werkzeug.http import http_date
+from werkzeug.wsgi import FileWrapper
+
+import file_responses
+from file_responses import etag_matches, parse_byte_ranges, send_stored_file, _if_range_matches
+
+
+@pytest.mark.parametrize('header, ranges', [
+    ('bytes=0-99', [(0, 100)]),
+    ('bytes=10-', [(10, 1000)]),
+    ('bytes=990-2000', [(990, 1000)]),
+    # 后缀区间，超过长度时取整个文件，长度为 0 的被忽略
+    ('bytes=-100', [(900, 1000)]),
+    ('bytes=-5000', [(0, 1000)]),
+    ('bytes=-0, 0-0', [(0, 1)]),
+    # 重叠和相邻的区间合并，结果按起点排序
+    ('bytes=500-599, 0-99, 50-149, 150-199', [(0, 200), (500, 600)]),
+    ('bytes=0-10, -10', [(0, 11), (990, 1000)]),
+    # 全部不可满足
+    ('bytes=1000-', []),
+    ('bytes=1000-1100, 2000-', []),
+    ('bytes=-0', []),
+])
+def test_parse_byte_ranges(header, ranges):
+    assert parse_byte_ranges(header, 1000) == ranges
+
+
+@pytest.mark.parametrize('header', [
+    None, '', 'items=0-1', 'bytes=', 'bytes=abc', 'bytes=5', 'bytes=10-5', 'bytes=0-1,,2-3', 'bytes=x-1',
+])
+def test_parse_byte_ranges_ignores_malformed(header):
+    assert parse_byte_ranges(header, 1000) is None
+
+
+def test_parse_byte_ranges_ignores_too_many():
+    ranges = ', '.join(f'{i * 10}-{i * 10}' for i in range(file_responses.MAX_RANGES + 1))
+    assert parse_byte_ranges('bytes=' + ranges, 1000) is None
+    ranges = ', '.join(f'{i * 10}-{i * 10}' for i in range(file_responses.MAX_RANGES))
+    assert len(parse_byte_ranges('bytes=' + ranges, 1000)) == file_responses.MAX_RANGES
+
+
+def test_etag_matches():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc"', '"abc"')
+    assert etag_matches('"x", "abc"', '"abc"')
+    assert etag_matches(' * ', '"abc"')
+    assert not etag_matches('"abcd"', '"abc"')
+    assert not etag_matches(None, '"abc"')
+
+
+def test_if_range_matches():
+    mtime = 1700000000.5
+    assert _if_range_matches('"abc"', '"abc"', mtime)
+    # 弱标签不能用于 If-Range
+    assert not _if_range_matches('W/"abc"', '"abc"', mtime)
+    assert _if_range_matches(http_date(mtime), '"abc"', mtime)
+    assert not _if_range_matches(http_date(mtime - 10), '"abc"', mtime)
+    assert not _if_range_matches('not a date', '"abc"', mtime)
+
+
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.fixture(params=[False, True], ids=['chunked', 'file_wrapper'])
+def client(request, tmp_path):
+    path = tmp_path / 'blob'
+    path.write_bytes(CONTENT)
+    app = Flask(__name__)
+
+    @app.route('/file')
+    def serve():
+        return send_stored_file(str(path), 'abc', mimetype='application/octet-stream')
+
+    environ = {'wsgi.file_wrapper': FileWrapper} if request.param else {}
+    test_client = app.test_client()
+    return lambda **headers: test_client.get('/file', headers=headers, environ_overrides=environ)
+
+
+def test_full_response(client):
+    response = client()
+    assert response.status_code == 200
+    assert response.data == CONTENT
+    assert response.headers['ETag'] == '"abc"'
+    assert client(**{'If-None-Match': '"abc"'}).status_code == 304
+
+
+@pytest.mark.parametrize('header, start, stop', [('bytes=100-199', 100, 200), ('bytes=1000-', 1000, 1024)])
+def test_single_range_sends_exact_bytes(client, header, start, stop):
+    response = client(Range=header)
+    assert response.status_code == 206
+    assert response.data == CONTENT[start:stop]
+    assert response.headers['Content-Range'] == f'bytes {start}-{stop - 1}/{len(CONTENT)}'
+    assert response.headers['Content-Length'] == str(stop - start)
+
+
+def test_multi_range_and_unsatisfiable(client):
+    response = client(Range='bytes=0-1, 10-11')
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    assert len(response.data) == int(response.headers['Content-Length'])
+    assert CONTENT[10:12] in response.data
+
+    response = client(Range='bytes=5000-')
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(CONTENT)}'
+
+
+def test_stale_if_range_returns_full_content(client):
+    response = client(Range='bytes=0-9', **{'If-Range': '"other"'})
+    assert response.status_code == 200
+    assert response.data == CONTENT
+
+
+def test_range_file_reads_only_its_bytes(tmp_path):
+    path = tmp_path / 'blob'
+    path.write_bytes(CONTENT)
+    chunks = file_responses._FileRange(open(path, 'rb'), 10, 30)
+    assert not hasattr(chunks, 'fileno')
+    assert chunks.read(15) + chunks.read(15) + chunks.read() == CONTENT[10:30]
+    chunks.close()
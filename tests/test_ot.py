@@ -0,0 +1,130 @@
+"""ot.py 操作变换和 RoomStore.apply_ops 的并发编辑行为"""
+import pytest
+
+import ot
+import room_store
+from room_store import RoomStore
+
+
+def insert(pos, text):
+    return {'op': 'insert', 'pos': pos, 'text': text}
+
+
+def delete(pos, length):
+    return {'op': 'delete', 'pos': pos, 'length': length}
+
+
+def converge(content, a_ops, b_ops):
+    """两个基于同一版本的并发编辑按两种顺序应用，结果必须一致"""
+    a_after_b, b_after_a = ot.transform(a_ops, b_ops, a_wins=True)
+    left = ot.apply_ops(ot.apply_ops(content, b_ops), a_after_b)
+    right = ot.apply_ops(ot.apply_ops(content, a_ops), b_after_a)
+    assert left == right
+    return left
+
+
+def test_insert_insert_same_position_tie_break():
+    # a_wins 的插入排在前面，两端结果一致
+    assert converge('abc', [insert(1, 'X')], [insert(1, 'Y')]) == 'aXYbc'
+    assert converge('abc', [insert(1, 'Y')], [insert(1, 'X')]) == 'aYXbc'
+
+
+def test_delete_overlapping_delete():
+    # 重叠部分只删除一次
+    assert converge('abcdefgh', [delete(1, 4)], [delete(3, 4)]) == 'ah'
+    assert converge('abcdefgh', [delete(2, 2)], [delete(1, 5)]) == 'agh'
+    assert converge('abcdefgh', [delete(2, 3)], [delete(2, 3)]) == 'abfgh'
+
+
+def test_insert_inside_deleted_range_is_kept():
+    # 删除范围被拆成两段，并发插入的文本保留下来
+    assert converge('abcdefgh', [delete(1, 5)], [insert(3, 'XY')]) == 'aXYgh'
+    assert converge('abcdefgh', [insert(3, 'XY')], [delete(1, 5)]) == 'aXYgh'
+
+
+def test_multi_op_edits_converge():
+    assert converge('hello world', [delete(0, 6), insert(5, '!')],
+                    [insert(5, ','), delete(6, 5), insert(6, 'there')]) == ',thered!'
+
+
+@pytest.mark.parametrize('ops', [
+    [{'op': 'insert', 'pos': True, 'text': 'x'}],
+    [{'op': 'insert', 'pos': -1, 'text': 'x'}],
+    [{'op': 'insert', 'pos': '0', 'text': 'x'}],
+    [{'op': 'insert', 'pos': 0}],
+    [{'op': 'delete', 'pos': 0, 'length': -1}],
+    [{'op': 'delete', 'pos': 0, 'length': False}],
+    [{'op': 'replace', 'pos': 0}],
+    ['insert'],
+    {'op': 'insert', 'pos': 0, 'text': 'x'},
+])
+def test_normalize_rejects_malformed_ops(ops):
+    with pytest.raises(ot.OperationError):
+        ot.normalize_ops(ops)
+
+
+def test_normalize_drops_empty_ops():
+    assert ot.normalize_ops([insert(0, ''), delete(0, 0), insert(0, 'a')]) == [insert(0, 'a')]
+
+
+def test_apply_rejects_out_of_range():
+    with pytest.raises(ot.OperationError):
+        ot.apply_ops('abc', [insert(4, 'x')])
+    with pytest.raises(ot.OperationError):
+        ot.apply_ops('abc', [delete(2, 2)])
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(room_store, 'OP_HISTORY_SIZE', 3)
+    store = RoomStore()
+    # set_content 在内存中创建文档，不访问数据库
+    assert store.set_content('room', 'abc') == 1
+    return store
+
+
+def test_store_transforms_stale_ops(store):
+    assert store.apply_ops('room', 1, [insert(3, 'd')]) == (2, [insert(3, 'd')], None)
+    # 基于版本 1 的插入变换到版本 2 之后
+    version, applied, _ = store.apply_ops('room', 1, [insert(0, 'X')])
+    assert version == 3
+    assert store.snapshot('room') == ('Xabcd', 3)
+
+
+def test_store_returns_legacy_content(store):
+    store.open('room', legacy=True)
+    assert store.apply_ops('room', 1, [delete(0, 1)]) == (2, [delete(0, 1)], 'bc')
+
+
+def test_store_stale_base_beyond_history_requires_resync(store):
+    for base in range(1, 6):
+        store.apply_ops('room', base, [insert(0, 'x')])
+    assert store.snapshot('room') == ('xxxxxabc', 6)
+    # 历史只保留版本 4-6，基于版本 3 的操作仍可变换，更早的需要重新同步
+    assert store.apply_ops('room', 3, [insert(0, 'y')])[0] == 7
+    assert store.apply_ops('room', 2, [insert(0, 'z')]) is None
+    # 基准版本超过当前版本同样需要重新同步
+    assert store.apply_ops('room', 99, [insert(0, 'z')]) is None
+    assert store.snapshot('room')[1] == 7
+
+
+@pytest.mark.parametrize('old, new', [
+    ('abc', 'abc'), ('', 'abc'), ('abc', ''), ('abcd', 'aXd'), ('aa', 'aaa'), ('a😀b', 'a😁b'),
+])
+def test_diff_reproduces_new_content(old, new):
+    assert ot.apply_ops(old, ot.diff(old, new)) == new
+
+
+def test_store_full_content_keeps_inflight_ops(store):
+    # 增量客户端基于版本 1 发出插入，确认前旧客户端整体替换了内容
+    assert store.set_content('room', 'abc!') == 2
+    version, applied, _ = store.apply_ops('room', 1, [insert(0, 'X')])
+    assert version == 3 and applied == [insert(0, 'X')]
+    assert store.snapshot('room') == ('Xabc!', 3)
+
+    # 客户端把在途操作按同样的差异变换到全量内容之后，结果与服务器一致
+    local, _ = ot.transform([insert(3, 'Y')], ot.diff('Xabc!', 'X!'))
+    assert store.set_content('room', 'X!') == 4
+    version, applied, _ = store.apply_ops('room', 3, [insert(3, 'Y')])
+    assert applied == local
+    assert store.snapshot('room') == (ot.apply_ops('X!', local), 5)
@@ -0,0 +1,218 @@
+"""outbound.py 积压队列：取代顺序、旧客户端的事件选择、字节预算和断开"""
+import pytest
+
+import outbound
+from outbound import OutboundQueues
+
+
+class FakeQueue:
+    def __init__(self, size=0):
+        self.size = size
+
+    def qsize(self):
+        return self.size
+
+
+class FakeEngineSocket:
+    def __init__(self):
+        self.queue = FakeQueue()
+
+
+class FakeServer:
+    """Socket.IO 服务器：每个连接的 Engine.IO sid 为 'eio-' + sid，所有连接都在房间 room 中"""
+
+    def __init__(self):
+        self.eio = type('Engine', (), {})()
+        self.eio.sockets = {}
+        self.manager = self
+        self.disconnected = []
+
+    def connect(self, sid):
+        socket = self.eio.sockets['eio-' + sid] = FakeEngineSocket()
+        return socket.queue
+
+    def sid_from_eio_sid(self, eio_sid, namespace):
+        return eio_sid[4:] if eio_sid in self.eio.sockets else None
+
+    def rooms(self, sid):
+        return [sid, 'room']
+
+    def disconnect(self, sid):
+        self.disconnected.append(sid)
+        self.eio.sockets.pop('eio-' + sid, None)
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.server = FakeServer()
+        self.emitted = []    # [(事件名, 数据, 接收者)]
+
+    def emit(self, event, data, to=None, skip_sid=None):
+        self.emitted.append((event, data, to))
+
+
+@pytest.fixture
+def socketio():
+    return FakeSocketIO()
+
+
+def backlogged(queues, sid='slow'):
+    """让连接进入积压状态，返回它的 Engine.IO 队列"""
+    engine_queue = queues.socketio.server.connect(sid)
+    engine_queue.size = outbound.OUTBOUND_HIGH_WATER + 1
+    queues.check(now=0)
+    queues.socketio.emitted.clear()
+    return engine_queue
+
+
+def queued(queues, sid='slow'):
+    return [(event, data) for event, data, _ in queues._queues[sid].messages]
+
+
+def test_full_content_supersedes_older_doc_events_in_place(socketio):
+    queues = OutboundQueues(socketio)
+    backlogged(queues)
+    queues.broadcast('content_op', {'ops': [], 'version': 2}, 'room')
+    queues.broadcast('cursor_batch', {'cursors': [{'id': 'a', 'position': 1}]}, 'room')
+    queues.broadcast('content_ack', {'version': 3}, 'room')
+    queues.broadcast('user_joined', {'id': 'b', 'username': 'bob'}, 'room')
+    queues.broadcast('cursor_batch', {'cursors': [{'id': 'a', 'position': 5}]}, 'room')
+    queues.broadcast('content_op', {'ops': [], 'version': 6}, 'room')
+    queues.broadcast('content_update', {'content': 'x', 'version': 5, 'username': 'c'}, 'room')
+
+    # 版本不超过 5 的文档消息合并为一条 content_resync，放在第一条被丢弃的位置；
+    # 之后的版本和其他事件保持原来的顺序，同一成员的光标只保留最新位置
+    assert queued(queues) == [
+        ('content_resync', {'content': 'x', 'version': 5, 'acked': True}),
+        ('cursor_batch', {'cursors': [{'id': 'a', 'position': 5}]}),
+        ('user_joined', {'id': 'b', 'username': 'bob'}),
+        ('content_op', {'ops': [], 'version': 6}),
+    ]
+    assert queues.dropped == 2 and queues.collapsed == 1
+    # 正常的连接直接发送
+    assert len(socketio.emitted) == 7
+
+
+def test_rejected_resync_keeps_its_flag_when_superseded(socketio):
+    queues = OutboundQueues(socketio)
+    backlogged(queues)
+    queues.send('slow', 'content_resync', {'content': 'a', 'version': 4, 'rejected': True})
+    queues.broadcast('content_update', {'content': 'ab', 'version': 5, 'username': 'c'}, 'room')
+    assert queued(queues) == [('content_resync', {'content': 'ab', 'version': 5, 'rejected': True})]
+
+
+def test_legacy_client_gets_content_updates_only(socketio):
+    queues = OutboundQueues(socketio, full_content_only=lambda sid: True)
+    backlogged(queues)
+    queues.broadcast('content_op', {'ops': [], 'version': 2}, 'room')
+    queues.broadcast('content_ack', {'version': 3}, 'room')
+    first = {'content': 'a', 'version': 2, 'username': 'c'}
+    queues.broadcast('content_update', first, 'room')
+    assert queued(queues) == [('content_update', first)]
+
+    latest = {'content': 'ab', 'version': 4, 'username': 'd'}
+    queues.broadcast('content_update', latest, 'room')
+    assert queued(queues) == [('content_update', latest)]
+    assert queues.dropped == 3
+
+
+def test_over_budget_compacts_to_snapshot(socketio):
+    queues = OutboundQueues(socketio, snapshot=lambda room: ('snapshot', 9), budget=200)
+    backlogged(queues)
+    for version in range(1, 10):
+        queues.broadcast('content_op', {'ops': [{'op': 'insert', 'pos': 0, 'text': 'x' * 20}], 'version': version},
+                         'room')
+    assert queued(queues) == [('content_resync', {'content': 'snapshot', 'version': 9})]
+    assert queues.resyncs > 0
+    assert queues._queues['slow'].bytes == outbound.message_size({'content': 'snapshot', 'version': 9})
+
+
+def test_compact_ignores_legacy_pseudo_room(socketio):
+    # 加入、离开并发时旧客户端的伪房间可能排在实际房间之前
+    socketio.server.rooms = lambda sid: [sid, 'netclip:full:room', 'room']
+    requested = []
+
+    def snapshot(room):
+        requested.append(room)
+        return ('snapshot', 9)
+    queues = OutboundQueues(socketio, snapshot=snapshot, budget=200)
+    backlogged(queues)
+    for version in range(1, 10):
+        queues.broadcast('content_op', {'ops': [{'op': 'insert', 'pos': 0, 'text': 'x' * 20}], 'version': version},
+                         'room')
+    assert requested and set(requested) == {'room'}
+
+
+def test_compact_uses_room_of(socketio):
+    requested = []
+
+    def snapshot(room):
+        requested.append(room)
+        return ('snapshot', 9)
+    # 由在线用户索引确定房间，不依赖 Socket.IO 房间列表的顺序
+    socketio.server.rooms = lambda sid: [sid, 'other', 'room']
+    queues = OutboundQueues(socketio, snapshot=snapshot, room_of=lambda sid: 'room', budget=200)
+    backlogged(queues)
+    for version in range(1, 10):
+        queues.broadcast('content_op', {'ops': [{'op': 'insert', 'pos': 0, 'text': 'x' * 20}], 'version': version},
+                         'room')
+    assert requested and set(requested) == {'room'}
+    assert queued(queues) == [('content_resync', {'content': 'snapshot', 'version': 9})]
+
+
+def test_drains_in_order_when_engine_queue_falls(socketio):
+    queues = OutboundQueues(socketio)
+    engine_queue = backlogged(queues)
+    for i in range(outbound.OUTBOUND_LOW_WATER + 1):
+        queues.broadcast('user_joined', {'id': str(i)}, 'room')
+    socketio.emitted.clear()
+
+    engine_queue.size = 0
+    queues.check(now=1)
+    sent = [data['id'] for _, data, to in socketio.emitted if to == 'slow']
+    assert sent == [str(i) for i in range(outbound.OUTBOUND_LOW_WATER)]
+
+    socketio.emitted.clear()
+    queues.check(now=2)
+    assert socketio.emitted == [('user_joined', {'id': str(outbound.OUTBOUND_LOW_WATER)}, 'slow')]
+    # 补发完毕且 Engine.IO 队列已空，恢复直接发送
+    queues.check(now=3)
+    assert 'slow' not in queues._queues
+
+
+def test_disconnects_after_grace_over_budget(socketio):
+    queues = OutboundQueues(socketio, budget=100)
+    backlogged(queues)
+    for i in range(10):
+        queues.broadcast('user_joined', {'id': str(i), 'username': 'user-%d' % i}, 'room')
+
+    queues.check(now=10)
+    assert socketio.server.disconnected == []
+    queues.check(now=10 + outbound.OUTBOUND_GRACE_SECONDS)
+    assert socketio.server.disconnected == ['slow']
+    assert socketio.emitted[-1] == ('resync_required', {'reason': 'slow_consumer'}, 'slow')
+    assert queues.disconnected == 1 and 'slow' not in queues._queues
+
+
+def test_closed_connection_queue_is_discarded(socketio):
+    queues = OutboundQueues(socketio)
+    backlogged(queues)
+    queues.broadcast('user_joined', {'id': 'a'}, 'room')
+    socketio.server.eio.sockets.clear()
+    queues.check(now=1)
+    assert 'slow' not in queues._queues
+
+
+def test_falls_back_without_engine_internals(socketio):
+    queues = OutboundQueues(socketio)
+    backlogged(queues)
+    queues.broadcast('user_joined', {'id': 'a'}, 'room')
+    socketio.emitted.clear()
+
+    # Engine.IO 的内部属性不存在时停用积压检测，已入队的消息照常补发
+    del socketio.server.eio.sockets
+    queues.check(now=1)
+    assert socketio.emitted == [('user_joined', {'id': 'a'}, 'slow')]
+    queues.check(now=2)
+    assert 'slow' not in queues._queues
+    assert queues.stats()['engine_supported'] is False
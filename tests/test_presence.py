@@ -0,0 +1,118 @@
+"""presence.py 在线用户索引，以及加入、离开时发送的增量 user_joined / user_left"""
+import importlib
+
+import pytest
+
+import db
+import presence as presence_module
+from presence import Presence
+
+
+def test_add_remove_and_rejoin():
+    presence = Presence()
+    alice, previous = presence.add('s1', 'alice', 'r1', ops=True)
+    assert previous is None
+    bob, _ = presence.add('s2', 'bob', 'r1')
+    assert presence.usernames('r1') == ['alice', 'bob']
+    assert presence.members('r1') == [alice.to_dict(), bob.to_dict()]
+    assert presence.has_legacy('r1') and presence.full_content_only('s2')
+    assert presence.room_counts() == {'r1': 2} and len(presence) == 2
+
+    # 同一连接加入另一个房间时返回之前的记录，并从原房间移除
+    moved, previous = presence.add('s1', 'alice', 'r2', ops=True)
+    assert previous is alice and moved.member_id != alice.member_id
+    assert presence.usernames('r1') == ['bob'] and presence.count('r2') == 1
+
+    assert presence.remove('s2') is bob
+    assert presence.remove('s2') is None
+    assert presence.count('r1') == 0 and 'r1' not in presence.room_counts()
+    assert not presence.has_legacy('r2')
+
+
+def test_full_sync_every_n_changes(monkeypatch):
+    monkeypatch.setattr(presence_module, 'PRESENCE_FULL_SYNC_EVERY', 3)
+    presence = Presence()
+    presence.add('s1', 'alice', 'r1')
+    assert [presence.full_sync_due('r1') for _ in range(6)] == [False, False, True, False, False, True]
+    # 房间已空时不计数
+    assert not presence.full_sync_due('empty')
+
+
+@pytest.fixture
+def server(database, tmp_path, monkeypatch):
+    # 导入 server 时会创建 images/ 等目录，放在临时目录中；后台任务不在测试中运行
+    monkeypatch.chdir(tmp_path)
+    server = importlib.import_module('server')
+    monkeypatch.setattr(server, 'start_background_tasks', lambda: None)
+    monkeypatch.setattr(server, 'ensure_background_task', lambda task: None)
+    db.create_room('lobby')
+    server.room_cache.invalidate('lobby')
+    return server
+
+
+@pytest.fixture
+def connect(server):
+    clients = []
+
+    def join(username, ops=True):
+        client = server.socketio.test_client(server.app)
+        client.emit('join', {'room': 'lobby', 'username': username, 'ops': ops})
+        clients.append(client)
+        return client
+    yield join
+    for client in clients:
+        if client.is_connected():
+            client.disconnect()
+
+
+def received(client, name):
+    return [event['args'][0] for event in client.get_received() if event['name'] == name]
+
+
+def test_join_and_leave_send_incremental_events(server, connect, monkeypatch):
+    monkeypatch.setattr(presence_module, 'PRESENCE_FULL_SYNC_EVERY', 1000)
+    alice = connect('alice')
+    listing = received(alice, 'user_list_update')[0]
+    assert listing['users'] == ['alice'] and listing['members'][0]['id'] == listing['self_id']
+
+    bob = connect('bob')
+    bob_id = received(bob, 'user_list_update')[0]['self_id']
+    # 只支持增量协议的房间只发送加入的成员本身，不附带完整列表
+    assert received(alice, 'user_joined') == [{'id': bob_id, 'username': 'bob', 'count': 2}]
+
+    # 离开时丢弃尚未发送的光标，只通知离开的成员
+    alice.emit('cursor_move', {'position': 1})
+    bob.emit('cursor_move', {'position': 3})
+    bob.emit('leave', {})
+    assert server.cursor_batcher.flush() == 1
+    events = alice.get_received()
+    assert [e['args'][0] for e in events if e['name'] == 'user_left'] == [{'id': bob_id, 'username': 'bob', 'count': 1}]
+    batches = [e['args'][0]['cursors'] for e in events if e['name'] == 'cursor_batch']
+    assert [[c['username'] for c in cursors] for cursors in batches] == [['alice']]
+    assert server.presence.usernames('lobby') == ['alice']
+
+
+def test_legacy_member_gets_users_list(server, connect, monkeypatch):
+    monkeypatch.setattr(presence_module, 'PRESENCE_FULL_SYNC_EVERY', 1000)
+    alice = connect('alice')
+    alice.get_received()
+    old = connect('old', ops=False)
+    old_id = received(old, 'user_list_update')[0]['self_id']
+    # 房间内有旧客户端时附带用户名列表，旧客户端据此刷新在线列表
+    assert received(alice, 'user_joined') == [{'id': old_id, 'username': 'old', 'count': 2, 'users': ['alice', 'old']}]
+
+    carol = connect('carol')
+    carol.get_received()
+    carol.disconnect()
+    assert received(old, 'user_left')[-1]['users'] == ['alice', 'old']
+
+
+def test_full_member_list_attached_periodically(server, connect, monkeypatch):
+    monkeypatch.setattr(presence_module, 'PRESENCE_FULL_SYNC_EVERY', 2)
+    alice = connect('alice')
+    connect('bob')
+    connect('carol')
+    # alice 加入是第 1 次变化，bob 加入是第 2 次，附带完整列表
+    joined = received(alice, 'user_joined')
+    assert [m['username'] for m in joined[0]['members']] == ['alice', 'bob']
+    assert 'members' not in joined[1]
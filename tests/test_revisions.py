@@ -0,0 +1,182 @@
+"""revisions.py 历史版本：delta 编码、checkpoint 切换、按时间精简后的重建，以及删除房间后的写回"""
+import importlib
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+import revisions as revisions_module
+from revisions import RevisionStore, apply_delta, encode_delta
+
+NOW = datetime(2026, 6, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def revisions(database):
+    return RevisionStore()
+
+
+@pytest.fixture
+def server(database, tmp_path, monkeypatch):
+    # 导入 server 时会创建 images/ 等目录，放在临时目录中；后台任务由测试直接调用
+    monkeypatch.chdir(tmp_path)
+    server = importlib.import_module('server')
+    monkeypatch.setattr(server, 'start_background_tasks', lambda: None)
+    monkeypatch.setattr(server, 'ensure_background_task', lambda task: None)
+    return server
+
+
+def kinds(room_id):
+    return [row['kind'] for row in reversed(db.list_revisions(room_id, limit=1000))]
+
+
+def contents_of(store, room_id):
+    return {row['revision']: store.get(room_id, row['revision'])['content']
+            for row in db.list_revisions(room_id, limit=1000)}
+
+
+LINES = ''.join(f'line {i}: {"x" * (i % 37)}\n' for i in range(400))
+
+
+@pytest.mark.parametrize('old, new', [
+    ('', ''),
+    ('', 'new text'),
+    ('old text', ''),
+    ('same', 'same'),
+    ('hello world', 'hello brave world'),
+    ('中文内容 emoji 🎉 结尾', '中文 🎉 新内容 emoji 🎉 结尾'),
+    # 变化区域超过 LINE_DIFF_THRESHOLD 时按行比较，未变的行以复制表示
+    (LINES, LINES.replace('line 100:', 'changed 100:').replace('line 300:', 'changed 300:')),
+    (LINES, 'prefix\n' + LINES[::-1]),
+])
+def test_delta_round_trip(old, new):
+    old, new = old.encode('utf-8'), new.encode('utf-8')
+    assert apply_delta(old, encode_delta(old, new)) == new
+
+
+def test_line_diff_copies_unchanged_lines():
+    old = LINES.encode('utf-8')
+    new = LINES.replace('line 100:', 'changed 100:').replace('line 300:', 'changed 300:').encode('utf-8')
+    assert len(old) - 2 > revisions_module.LINE_DIFF_THRESHOLD
+    assert len(encode_delta(old, new)) < 200
+
+
+def test_checkpoint_every_n_revisions(revisions, monkeypatch):
+    monkeypatch.setattr(revisions_module, 'REVISION_CHECKPOINT_EVERY', 4)
+    db.create_room('notes')
+    text = 'x' * 500
+    for i in range(10):
+        text += f' edit {i}'
+        assert revisions.record('notes', text) == i + 1
+    # 内容未变时不记录
+    assert revisions.record('notes', text) is None
+    assert kinds('notes') == ['checkpoint', 'delta', 'delta', 'delta'] * 2 + ['checkpoint', 'delta']
+
+
+def test_delta_chain_larger_than_content_switches_to_checkpoint(revisions):
+    db.create_room('notes')
+    # 短内容的 delta 压缩后比全文还大，直接保存全文
+    revisions.record('notes', 'ab')
+    revisions.record('notes', 'cd')
+    assert kinds('notes') == ['checkpoint', 'checkpoint']
+
+    # 每次修改不同位置，delta 链累计超过全文大小后保存新的 checkpoint
+    text = list('abcdefghij' * 20)
+    for i in range(40):
+        text[(i * 37) % len(text)] = chr(ord('A') + i % 26)
+        revisions.record('notes', ''.join(text))
+    rows = list(reversed(db.get_revisions('notes')))
+    assert 'checkpoint' in [row['kind'] for row in rows[2:]]
+    for row in rows:
+        if row['kind'] == 'delta':
+            assert 0 < row['chain'] < revisions_module.REVISION_CHECKPOINT_EVERY
+            assert row['chain_bytes'] <= row['size']
+        else:
+            assert row['chain'] == row['chain_bytes'] == 0
+
+
+def test_get_reconstructs_without_cache(revisions):
+    db.create_room('notes')
+    expected = {}
+    text = '初始内容\n'
+    for i in range(12):
+        text = text.replace(f'[{i - 1}]', '') + f'第 {i} 行 [{i}]\n'
+        expected[revisions.record('notes', text)] = text
+    assert contents_of(RevisionStore(), 'notes') == expected
+    assert revisions.get('notes', 99) is None
+    assert revisions.get('missing', 1) is None
+
+
+def test_compaction_thins_by_age_and_keeps_content(revisions, monkeypatch):
+    monkeypatch.setattr(revisions_module, 'REVISION_CHECKPOINT_EVERY', 4)
+    db.create_room('notes')
+    times = (
+        # 超过 REVISION_HOURLY_DAYS：同一天只保留最新的一个
+        [NOW - timedelta(days=40, hours=5, minutes=m) for m in (30, 20, 10)]
+        + [NOW - timedelta(days=40, hours=1)]
+        # 超过 REVISION_KEEP_ALL_HOURS：同一小时只保留最新的一个
+        + [NOW - timedelta(days=3, minutes=m) for m in (50, 40, 30)]
+        + [NOW - timedelta(days=2)]
+        # 最近的版本全部保留
+        + [NOW - timedelta(hours=3, minutes=m) for m in (30, 20, 10)]
+    )
+    expected = {}
+    text = 'history\n'
+    for i, created_at in enumerate(times):
+        text += f'revision {i}\n'
+        expected[revisions.record('notes', text, now=created_at)] = text
+
+    assert revisions.compact(now=NOW) == 5
+    # 保留的版本内容不变，不依赖缓存也能重建；之后的 delta 仍以精简后的版本为基准
+    kept = (4, 7, 8, 9, 10, 11)
+    assert sorted(row['revision'] for row in db.list_revisions('notes')) == list(kept)
+    assert contents_of(RevisionStore(), 'notes') == {revision: expected[revision] for revision in kept}
+    assert revisions.record('notes', text + 'more', now=NOW) == 12
+    assert RevisionStore().get('notes', 12)['content'] == text + 'more'
+    # 再次精简没有可删除的版本
+    assert revisions.compact(now=NOW) == 0
+
+
+def test_revision_not_recorded_for_missing_room(revisions):
+    assert revisions.record('missing', 'text') is None
+    assert db.list_revisions('missing') == []
+
+
+def test_edit_after_delete_does_not_leak_into_recreated_room(server):
+    room_id = 'leak-check'
+    db.create_room(room_id)
+    client = server.socketio.test_client(server.app)
+    client.emit('join', {'room': room_id, 'username': 'alice', 'ops': True})
+    client.emit('content_op', {'version': 0, 'ops': [{'op': 'insert', 'pos': 0, 'text': 'secret v1'}]})
+    server.room_store.flush_all()
+    server.revision_store.record_pending()
+    client.get_received()
+
+    assert server.purge_room(room_id)
+    # 仍在线的连接继续编辑：不再接受，并通知客户端离开
+    client.emit('content_op', {'version': 1, 'ops': [{'op': 'insert', 'pos': 0, 'text': 'secret v2 '}]})
+    assert [event['name'] for event in client.get_received()] == ['auth_failed']
+    assert server.presence.get(client.eio_sid) is None
+    server.room_store.flush_all()
+    server.revision_store.record_pending()
+
+    db.create_room(room_id)
+    server.cluster.room_changed(room_id)
+    http = server.app.test_client()
+    assert http.get(f'/api/room/{room_id}/revisions').get_json()['revisions'] == []
+    assert db.get_room_content(room_id) == ''
+    client.disconnect()
+
+
+def test_flush_racing_delete_records_no_revision(server):
+    room_id = 'race-check'
+    db.create_room(room_id)
+    server.room_store.open(room_id)
+    server.room_store.set_content(room_id, 'typed before delete')
+    # 删除发生在写回取得快照之后：写入不匹配任何行，不登记历史版本
+    db.delete_room(room_id)
+    server.room_store.flush_all()
+    db.create_room(room_id)
+    server.revision_store.record_pending()
+    assert db.list_revisions(room_id) == []
+    server.room_store.evict(room_id)
@@ -0,0 +1,150 @@
+"""room_tokens.py 令牌签发和校验，room_cache.py 的失效和并发未命中合并"""
+import threading
+
+import pytest
+
+import db
+import room_cache
+import room_tokens
+from room_cache import RoomCache
+from room_tokens import RoomAccess
+
+
+@pytest.fixture
+def cache(database, monkeypatch):
+    cache = RoomCache()
+    monkeypatch.setattr(room_tokens, 'room_cache', cache)
+    db.create_room('secret', 'pw')
+    db.create_room('open')
+    return cache
+
+
+@pytest.fixture
+def access(cache):
+    return RoomAccess(secret='test-secret', ttl=60)
+
+
+def test_token_admits_only_its_room(access):
+    token = access.issue('secret', now=1000)
+    assert access.allows('secret', token, now=1000)
+    assert not access.allows('other', token, now=1000)
+    assert not access.allows('secret', token[:-1] + ('A' if token[-1] != 'A' else 'B'), now=1000)
+    assert not access.allows('secret', None, now=1000)
+    assert not access.allows('secret', 'garbage', now=1000)
+    # 公开房间无需令牌，不存在的房间不签发
+    assert access.allows('open', None)
+    assert access.issue('missing') is None
+    assert access.stats()['accepted'] == 1
+
+
+def test_token_expires(access):
+    token = access.issue('secret', now=1000)
+    assert access.allows('secret', token, now=1060)
+    assert not access.allows('secret', token, now=1061)
+
+
+def test_token_from_other_secret_is_rejected(access):
+    token = RoomAccess(secret='another-secret').issue('secret')
+    assert not access.allows('secret', token)
+
+
+def test_password_change_revokes_tokens(access, cache):
+    token = access.issue('secret')
+    assert db.reset_room_password('secret', 'pw', 'new-pw')
+    # 缓存失效之前仍使用旧的密码版本，失效后之前签发的令牌立即失效
+    assert access.allows('secret', token)
+    cache.invalidate('secret')
+    assert not access.allows('secret', token)
+    assert access.allows('secret', access.issue('secret'))
+
+    # 管理员重置密码同样更换密码版本
+    token = access.issue('secret')
+    assert db.admin_reset_room_password('secret', 'admin-pw')
+    cache.invalidate('secret')
+    assert not access.allows('secret', token)
+
+
+def test_cache_serves_hits_without_db(cache, monkeypatch):
+    assert cache.verify_password('secret', 'pw')
+    monkeypatch.setattr(room_cache.db, 'get_room_meta', lambda room_id: pytest.fail('不应读库'))
+    assert cache.verify_password('secret', 'pw')
+    assert not cache.verify_password('secret', 'wrong')
+    assert cache.stats()['hits'] == 2
+
+
+def test_cache_invalidation_after_password_change(cache):
+    assert cache.verify_password('secret', 'pw')
+    epoch = cache.get('secret')['password_epoch']
+    assert db.reset_room_password('secret', 'pw', 'new-pw')
+    cache.invalidate('secret')
+    assert not cache.verify_password('secret', 'pw')
+    assert cache.verify_password('secret', 'new-pw')
+    assert cache.get('secret')['password_epoch'] != epoch
+
+
+def test_negative_entries_until_created(cache):
+    assert not cache.exists('later')
+    assert not cache.exists('later')
+    assert cache.stats()['negative_hits'] == 1
+    db.create_room('later')
+    cache.invalidate('later')
+    assert cache.exists('later')
+
+
+def test_concurrent_misses_share_one_query(cache, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    queries = []
+
+    def slow_meta(room_id):
+        queries.append(room_id)
+        started.set()
+        release.wait(5)
+        return {'room_id': room_id, 'password_hash': None, 'password_epoch': 1, 'created_at': ''}
+
+    monkeypatch.setattr(room_cache.db, 'get_room_meta', slow_meta)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('busy'))) for _ in range(8)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    while cache.stats()['coalesced'] < 7:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert queries == ['busy']
+    assert len(results) == 8 and all(meta['password_epoch'] == 1 for meta in results)
+    assert cache.get('busy')['room_id'] == 'busy'
+    assert cache.stats()['misses'] == 1
+
+
+def test_failed_query_is_shared_and_not_cached(cache, monkeypatch):
+    def broken(room_id):
+        raise RuntimeError('database is locked')
+
+    original = db.get_room_meta
+    monkeypatch.setattr(room_cache.db, 'get_room_meta', broken)
+    with pytest.raises(RuntimeError):
+        cache.get('secret')
+    monkeypatch.setattr(room_cache.db, 'get_room_meta', original)
+    assert cache.get('secret')['room_id'] == 'secret'
+
+
+def test_invalidate_during_load_starts_fresh_query(cache, monkeypatch):
+    calls = []
+    original = db.get_room_meta
+
+    def meta_then_invalidate(room_id):
+        calls.append(room_id)
+        if len(calls) == 1:
+            cache.invalidate(room_id)
+        return original(room_id)
+
+    monkeypatch.setattr(room_cache.db, 'get_room_meta', meta_then_invalidate)
+    cache.get('secret')
+    # 第一次读库期间发生失效，结果不写入缓存
+    cache.get('secret')
+    assert calls == ['secret', 'secret']
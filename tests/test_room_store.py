@@ -0,0 +1,146 @@
+"""room_store.py 写回缓存：空闲与最大延迟写回、最后一个连接离开后的写回和移出、写入失败后的重试"""
+import pytest
+
+import db
+import room_store
+from room_store import FLUSH_IDLE_DELAY, FLUSH_MAX_DELAY, RoomStore
+
+
+class FakeClock:
+    """替换 room_store 中的 time 模块，测试控制 monotonic 时间"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(room_store, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def writes(database, monkeypatch):
+    """实际写入数据库的批次 [[(room_id, content)]]"""
+    batches = []
+    save = db.save_room_contents
+
+    def recording(items):
+        batches.append(list(items))
+        return save(items)
+    monkeypatch.setattr(room_store.db, 'save_room_contents', recording)
+    db.create_room('notes')
+    return batches
+
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    """写入成功后登记的历史版本 [(room_id, content)]"""
+    items = []
+    monkeypatch.setattr(room_store.revision_store, 'enqueue', items.extend)
+    return items
+
+
+@pytest.fixture
+def store(clock, writes, enqueued):
+    return RoomStore()
+
+
+def test_idle_flush_waits_for_pause(store, clock, writes):
+    store.open('notes')
+    store.set_content('notes', 'a')
+    clock.now += FLUSH_IDLE_DELAY / 2
+    store.set_content('notes', 'ab')
+    # 距离最后一次修改不足 FLUSH_IDLE_DELAY，不写回
+    clock.now += FLUSH_IDLE_DELAY / 2
+    assert store.flush_due(clock.now) == 0
+    clock.now += FLUSH_IDLE_DELAY / 2
+    assert store.flush_due(clock.now) == 1
+    assert writes == [[('notes', 'ab')]]
+    assert db.get_room_content('notes') == 'ab'
+    # 没有新的修改时不重复写入
+    clock.now += FLUSH_MAX_DELAY
+    assert store.flush_due(clock.now) == 0
+
+
+def test_continuous_edits_flush_at_max_delay(store, clock, writes):
+    store.open('notes')
+    start = clock.now
+    text = ''
+    flushed_at = []
+    # 修改间隔始终小于 FLUSH_IDLE_DELAY，只有最大延迟会触发写回
+    step = FLUSH_IDLE_DELAY / 2
+    while clock.now - start < FLUSH_MAX_DELAY * 2 + step:
+        text += 'x'
+        store.set_content('notes', text)
+        clock.now += step
+        if store.flush_due(clock.now):
+            flushed_at.append(clock.now - start)
+    assert len(flushed_at) == 2
+    assert all(FLUSH_MAX_DELAY <= elapsed for elapsed in flushed_at)
+    assert flushed_at[1] - flushed_at[0] <= FLUSH_MAX_DELAY + step
+    assert db.get_room_content('notes') == writes[-1][0][1]
+
+
+def test_release_evicts_after_commit(store, writes, enqueued):
+    store.open('notes')
+    store.set_content('notes', 'final')
+    store.release('notes')
+    assert writes == [[('notes', 'final')]]
+    assert store.room_ids() == []
+    assert enqueued == [('notes', 'final')]
+
+
+def test_join_during_release_write_keeps_document(store, writes, monkeypatch):
+    store.open('notes')
+    store.set_content('notes', 'shared')
+    save = room_store.db.save_room_contents
+    during = []
+
+    def join_while_writing(items):
+        # 写入提交之前文档仍在内存中，此时加入的连接拿到的是内存中的内容而不是数据库中的旧内容
+        during.append(store.room_ids())
+        during.append(store.open('notes'))
+        return save(items)
+    monkeypatch.setattr(room_store.db, 'save_room_contents', join_while_writing)
+
+    store.release('notes')
+    assert during == [['notes'], ('shared', 1)]
+    # 新连接仍持有文档，写入完成后不移出
+    assert store.room_ids() == ['notes']
+    assert store.apply_ops('notes', 1, [{'op': 'insert', 'pos': 6, 'text': '!'}])[0] == 2
+
+
+def test_failed_write_marks_dirty_again(store, clock, enqueued, monkeypatch):
+    store.open('notes')
+    store.set_content('notes', 'keep me')
+    save = room_store.db.save_room_contents
+
+    def broken(items):
+        raise RuntimeError('disk full')
+    monkeypatch.setattr(room_store.db, 'save_room_contents', broken)
+
+    clock.now += FLUSH_MAX_DELAY
+    with pytest.raises(RuntimeError):
+        store.flush_due(clock.now)
+    assert store.stats()['dirty_rooms'] == 1
+    assert enqueued == []
+
+    # 最后一个连接离开时写入仍失败：文档不移出，等待下一次写回
+    with pytest.raises(RuntimeError):
+        store.release('notes')
+    assert store.room_ids() == ['notes']
+
+    monkeypatch.setattr(room_store.db, 'save_room_contents', save)
+    clock.now += FLUSH_IDLE_DELAY
+    assert store.flush_due(clock.now) == 1
+    assert db.get_room_content('notes') == 'keep me'
+    assert enqueued == [('notes', 'keep me')]
+    # 已写回且无人持有的文档在空闲超时后移出内存
+    clock.now += room_store.EVICT_IDLE_SECONDS
+    store.flush_due(clock.now)
+    assert store.room_ids() == []
@@ -0,0 +1,212 @@
+"""文件上传：流式上传的提前拒绝和文件头校验，断点续传的分块、完成校验和过期会话清理"""
+import hashlib
+import importlib
+import io
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+
+
+class StopLoop(Exception):
+    pass
+
+
+@pytest.fixture
+def server(database, tmp_path, monkeypatch):
+    # 导入 server 时会创建 images/ 等目录，放在临时目录中
+    monkeypatch.chdir(tmp_path)
+    server = importlib.import_module('server')
+    (tmp_path / 'files').mkdir()
+    monkeypatch.setitem(server.app.config, 'FILES_FOLDER', str(tmp_path / 'files'))
+    db.create_room('drop')
+    server.room_cache.invalidate('drop')
+    return server
+
+
+@pytest.fixture
+def client(server, monkeypatch):
+    # 上传接口按需启动的后台清理任务不在测试中运行
+    monkeypatch.setattr(server, 'ensure_background_task', lambda task: None)
+    return server.app.test_client()
+
+
+def leftover_files(server):
+    """files/ 下的全部文件（含临时文件）"""
+    return sorted(os.listdir(server.app.config['FILES_FOLDER']))
+
+
+def post_file(client, filename, data, mimetype=None):
+    return client.post('/api/room/drop/upload', content_type='multipart/form-data',
+                       data={'file': (io.BytesIO(data), filename, mimetype)})
+
+
+def stored_content(server, file_id):
+    file_info = db.get_file(file_id)
+    with open(os.path.join(server.app.config['FILES_FOLDER'], file_info['filename']), 'rb') as f:
+        return file_info, f.read()
+
+
+# ==================== 流式上传 ====================
+
+def test_streaming_upload_stores_by_digest(server, client):
+    data = b'%PDF-1.7 ' + b'x' * 200000
+    response = post_file(client, 'report.pdf', data, 'application/pdf')
+    assert response.status_code == 200
+    file_info, content = stored_content(server, response.get_json()['file_id'])
+    assert content == data
+    assert file_info['filename'] == hashlib.sha256(data).hexdigest()
+    assert leftover_files(server) == [file_info['filename']]
+
+
+def test_upload_rejected_once_bytes_pass_max_size(server, client, monkeypatch):
+    monkeypatch.setitem(server.ALLOWED_EXTENSIONS['txt'], 'max_size', 1000)
+    # Content-Length 在限制之内（含 multipart 开销），接收到第 1001 个字节时中止
+    response = post_file(client, 'notes.txt', b'a' * 5000, 'text/plain')
+    assert response.status_code == 413
+    assert leftover_files(server) == []
+    # Content-Length 已超出限制时不接收文件数据
+    response = post_file(client, 'notes.txt', b'a' * (1000 + server.MULTIPART_OVERHEAD + 1), 'text/plain')
+    assert response.status_code == 413
+    assert leftover_files(server) == []
+    assert post_file(client, 'notes.txt', b'a' * 1000, 'text/plain').status_code == 200
+
+
+def test_header_checked_on_first_chunk(server, client):
+    response = post_file(client, 'fake.pdf', b'MZ' + b'\0' * 100000, 'application/pdf')
+    assert response.status_code == 400
+    assert '文件头验证失败' in response.get_json()['error']
+    assert leftover_files(server) == []
+    assert db.count_files('drop') == (0, 0)
+
+
+@pytest.mark.parametrize('data, status', [(b'%PDF', 200), (b'MZ', 400), (b'', 200)])
+def test_files_under_16_bytes_checked_on_finish(server, client, data, status):
+    response = post_file(client, 'tiny.pdf', data, 'application/pdf')
+    assert response.status_code == status
+    if status != 200:
+        assert leftover_files(server) == []
+
+
+def test_upload_rejects_bad_metadata_before_reading(server, client):
+    assert post_file(client, 'script.exe', b'MZ').status_code == 400
+    assert post_file(client, 'notes.txt', b'text', 'application/pdf').status_code == 400
+    assert client.post('/api/room/missing/upload', content_type='multipart/form-data',
+                       data={'file': (io.BytesIO(b'x'), 'a.txt')}).status_code == 404
+    assert leftover_files(server) == []
+
+
+# ==================== 断点续传 ====================
+
+def create_session(client, filename='archive.zip', size=0, mime_type=None):
+    return client.post('/api/room/drop/uploads', json={'filename': filename, 'size': size, 'mime_type': mime_type})
+
+
+def put_chunk(client, upload_id, offset, data):
+    return client.put(f'/api/room/drop/uploads/{upload_id}', query_string={'offset': offset}, data=data)
+
+
+def complete(client, upload_id):
+    return client.post(f'/api/room/drop/uploads/{upload_id}/complete')
+
+
+ZIP = b'PK\x03\x04' + bytes(range(256)) * 40
+
+
+def test_session_validates_metadata_and_size(client, server):
+    assert create_session(client, 'video.mp4', size=None).status_code == 400
+    assert create_session(client, 'video.exe', size=10).status_code == 400
+    assert create_session(client, 'video.mp4', size=10, mime_type='text/plain').status_code == 400
+    max_size = server.ALLOWED_EXTENSIONS['mp4']['max_size']
+    assert create_session(client, 'video.mp4', size=max_size + 1).status_code == 413
+    assert client.post('/api/room/missing/uploads', json={'filename': 'a.mp4', 'size': 1}).status_code == 404
+
+
+def test_resumable_upload_with_retransmitted_chunks(client, server):
+    upload_id = create_session(client, size=len(ZIP)).get_json()['upload_id']
+    assert put_chunk(client, upload_id, 0, ZIP[:4000]).get_json()['offset'] == 4000
+    # 跳过中间的数据：拒绝并返回已接收的位置
+    response = put_chunk(client, upload_id, 6000, ZIP[6000:8000])
+    assert response.status_code == 409 and response.get_json()['offset'] == 4000
+    # 重传已接收的部分（乱序到达的旧分块）不会使已接收的位置倒退
+    assert put_chunk(client, upload_id, 2000, ZIP[2000:6000]).get_json()['offset'] == 6000
+    assert put_chunk(client, upload_id, 1000, ZIP[1000:2000]).get_json()['offset'] == 6000
+    assert client.get(f'/api/room/drop/uploads/{upload_id}').get_json()['offset'] == 6000
+    # 未上传完成时不能完成
+    assert complete(client, upload_id).status_code == 409
+    assert put_chunk(client, upload_id, 6000, ZIP[6000:]).get_json()['offset'] == len(ZIP)
+
+    response = complete(client, upload_id)
+    assert response.status_code == 200
+    # 摘要在合并后按完整内容计算
+    file_info, content = stored_content(server, response.get_json()['file_id'])
+    assert content == ZIP
+    assert file_info['filename'] == hashlib.sha256(ZIP).hexdigest()
+    assert leftover_files(server) == [file_info['filename']]
+    # 会话已被领取，重复完成失败
+    assert complete(client, upload_id).status_code == 404
+
+
+def test_chunk_bounds(client, server, monkeypatch):
+    upload_id = create_session(client, size=100).get_json()['upload_id']
+    # 超出声明的文件大小
+    assert put_chunk(client, upload_id, 0, b'x' * 101).status_code == 400
+    assert put_chunk(client, upload_id, None, b'x').status_code == 400
+    monkeypatch.setattr(server, 'RESUMABLE_MAX_CHUNK_SIZE', 10)
+    assert put_chunk(client, upload_id, 0, b'x' * 11).status_code == 413
+    assert client.get(f'/api/room/drop/uploads/{upload_id}').get_json()['offset'] == 0
+    assert client.put(f'/api/room/drop/uploads/other-id', query_string={'offset': 0}, data=b'x').status_code == 404
+
+
+def test_complete_rejects_bad_header_and_removes_data(client, server):
+    data = b'not an archive at all' * 10
+    upload_id = create_session(client, size=len(data)).get_json()['upload_id']
+    put_chunk(client, upload_id, 0, data)
+    response = complete(client, upload_id)
+    assert response.status_code == 400
+    assert '文件头验证失败' in response.get_json()['error']
+    assert leftover_files(server) == []
+    assert db.get_upload_session(upload_id) is None
+    assert db.count_files('drop') == (0, 0)
+
+
+def test_cancel_removes_session_data(client, server):
+    upload_id = create_session(client, size=len(ZIP)).get_json()['upload_id']
+    put_chunk(client, upload_id, 0, ZIP[:100])
+    assert client.delete(f'/api/room/drop/uploads/{upload_id}').status_code == 200
+    assert leftover_files(server) == []
+    assert client.get(f'/api/room/drop/uploads/{upload_id}').status_code == 404
+
+
+def test_run_server_starts_upload_reaper(server, monkeypatch):
+    started = []
+    monkeypatch.setattr(server, '_background_tasks', set())
+    monkeypatch.setattr(server.socketio, 'start_background_task', started.append)
+    monkeypatch.setattr(server.socketio, 'run', lambda *args, **kwargs: None)
+    monkeypatch.setattr(server.signal, 'signal', lambda *args: None)
+
+    server.run_server()
+    assert server.upload_session_reaper in started
+    assert server.cleanup_worker in started
+
+
+def test_reaper_clears_expired_sessions_before_first_sleep(server, monkeypatch):
+    db.create_room('drop')
+    for upload_id in ('stale', 'fresh'):
+        db.create_upload_session(upload_id, 'drop', 'a.txt', 'text/plain', 10)
+        open(server.upload_part_path(upload_id), 'wb').close()
+    expired = (datetime.now() - timedelta(seconds=server.UPLOAD_SESSION_TTL + 60)).isoformat()
+    with db.connection() as conn, conn:
+        conn.execute("UPDATE upload_sessions SET updated_at = ? WHERE upload_id = 'stale'", (expired,))
+
+    def stop(seconds):
+        raise StopLoop
+    monkeypatch.setattr(server.socketio, 'sleep', stop)
+
+    with pytest.raises(StopLoop):
+        server.upload_session_reaper()
+    assert db.get_upload_session('stale') is None
+    assert db.get_upload_session('fresh') is not None
+    assert not server.os.path.exists(server.upload_part_path('stale'))